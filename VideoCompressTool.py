@@ -1,5 +1,6 @@
 import os
 import shutil
+import tempfile
 import time
 import subprocess
 import json
@@ -8,7 +9,7 @@ from PyQt6.QtWidgets import (
     QWidget, QLabel, QFileDialog, QHBoxLayout, QSpinBox,
     QDoubleSpinBox, QCheckBox, QTreeWidget, QTreeWidgetItem,
     QHeaderView, QStyle, QProgressBar, QMessageBox,
-    QStatusBar, QTreeWidgetItemIterator
+    QStatusBar, QTreeWidgetItemIterator, QLineEdit, QComboBox
 )
 from PyQt6.QtCore import (
     Qt, QThread, pyqtSignal, QSize, QTimer
@@ -19,6 +20,321 @@ import datetime
 import sqlite3  # 添加 sqlite3 导入
 import multiprocessing
 import sys
+import queue
+import statistics
+import threading
+import cProfile
+import functools
+import hashlib
+import tracemalloc
+import array
+import math
+import re
+import gzip
+import bisect
+import collections
+import concurrent.futures
+import socket
+import argparse
+import http.server
+import hmac
+import secrets
+try:
+    import numpy as np
+except ImportError:
+    np = None  # 没有安装 NumPy 时使用纯 Python 实现
+
+
+def write_json_atomic(path, data):
+    """先写临时文件再重命名，中途退出也不会留下写了一半的 JSON 文件"""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+    os.replace(temp_path, path)
+
+
+class SettingsStore:
+    """settings.json 的内存缓存
+
+    修改只更新内存并标记为待写入，由防抖定时器合并成一次写入；写入先写临时文件再重命名，
+    中途退出也不会留下写了一半的设置文件。退出时调用 flush 立即写入。
+    """
+    FLUSH_DELAY_MS = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self.data = self.read()
+        self.dirty = False
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.FLUSH_DELAY_MS)
+        self.timer.timeout.connect(self.flush)
+
+    def read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            # 旧版本在设置中保存过树形控件状态，现在单独保存在 tree_state.json
+            data.pop('tree_state', None)
+            return data
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        self.update({key: value})
+
+    def update(self, values):
+        changed = any(self.data.get(key) != value for key, value in values.items())
+        if not changed:
+            return
+        self.data.update(values)
+        self.dirty = True
+        self.timer.start()
+
+    def flush(self):
+        """把待写入的设置原子地写入文件"""
+        self.timer.stop()
+        if not self.dirty:
+            return
+        try:
+            write_json_atomic(self.path, self.data)
+            self.dirty = False
+        except Exception as e:
+            print(f"保存设置失败：{e}")
+
+
+class Profiler:
+    """可选的性能分析，默认关闭；设置环境变量 VCT_PROFILE=1 或按 Ctrl+Shift+P 开启
+
+    开启后被 @profiled 包装的函数每次调用都会用 cProfile 和 tracemalloc 采集，
+    把 .pstats 文件和内存快照写入数据目录下的 profiles 文件夹，并输出一行耗时摘要。
+    同一线程中嵌套的调用只记录耗时；内存峰值是整个进程的。
+    """
+    def __init__(self):
+        self.enabled = os.environ.get('VCT_PROFILE', '') not in ('', '0')
+        self.output_dir = os.path.abspath('profiles')
+        self.local = threading.local()
+        self.counter = 0
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        if not enabled and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        print(f"性能分析已{'开启' if enabled else '关闭'}，结果保存在：{self.output_dir}")
+
+    def call(self, name, func, *args, **kwargs):
+        if getattr(self.local, 'active', False):
+            # 外层调用已经在采集，这里只计时
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                print(f"[性能] {name} {time.perf_counter() - start:.3f}s")
+
+        self.local.active = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # 其他线程的 cProfile 正在运行（Python 3.12 起同一时间只能有一个）
+            profile = None
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            if profile:
+                profile.disable()
+            self.local.active = False
+            self.save_capture(name, elapsed, profile)
+
+    def save_capture(self, name, elapsed, profile):
+        """保存 .pstats 文件和内存快照，并输出摘要"""
+        if not tracemalloc.is_tracing():
+            # 采集期间性能分析被关闭
+            print(f"[性能] {name} {elapsed:.3f}s")
+            return
+        _, peak = tracemalloc.get_traced_memory()
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            self.counter += 1
+            base_name = f"{name}_{datetime.datetime.now():%Y%m%d_%H%M%S}_{self.counter}"
+            base_path = os.path.join(self.output_dir, base_name)
+            if profile:
+                profile.dump_stats(base_path + '.pstats')
+            tracemalloc.take_snapshot().dump(base_path + '.tracemalloc')
+        except Exception as e:
+            print(f"保存性能分析结果失败：{e}")
+            base_name = None
+        print(f"[性能] {name} {elapsed:.3f}s，内存峰值 {peak / 1024 / 1024:.1f}MB" + (f" -> {base_name}" if base_name else ""))
+
+
+PROFILER = Profiler()
+
+
+def profiled(name=None):
+    """包装需要分析的函数，未开启性能分析时直接调用"""
+    def decorator(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            return PROFILER.call(label, func, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+METRICS_PORT = 9464  # Prometheus 指标端点的默认端口
+
+
+class Metrics:
+    """压缩过程的运行指标，由 MetricsServer 以 Prometheus 文本格式输出
+
+    计数器在程序运行期间累计；队列深度和历史中累计节省的空间在每次抓取时从数据库读取，
+    正在运行的 ffmpeg 进程数和编码帧率取自当前的压缩线程。
+    """
+    STAGES = ('probe_time', 'encode_time', 'ssim_time', 'metadata_time', 'replace_time')
+    STAGE_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = {'completed': 0, 'failed': 0, 'skipped': 0}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.encode_seconds = 0.0
+        # 阶段 -> [各区间的累计计数, 总和, 次数]
+        self.stage_histograms = {stage: [[0] * len(self.STAGE_BUCKETS), 0.0, 0] for stage in self.STAGES}
+        self.encoder_fps = {}  # 正在编码的文件 -> 当前帧率
+        self.thread = None     # 当前的 VideoCompressThread
+
+    def job_finished(self, result):
+        with self.lock:
+            self.jobs[result] += 1
+
+    def job_completed(self, data):
+        """记录一个压缩完成的文件：大小、编码耗时和各阶段耗时"""
+        with self.lock:
+            self.jobs['completed'] += 1
+            self.bytes_in += data.get('original_size') or 0
+            self.bytes_out += data.get('compressed_size') or 0
+            self.encode_seconds += data.get('encode_time') or 0
+            for stage in self.STAGES:
+                seconds = data.get(stage)
+                if seconds is None:
+                    continue
+                buckets, _, _ = histogram = self.stage_histograms[stage]
+                for index, bound in enumerate(self.STAGE_BUCKETS):
+                    if seconds <= bound:
+                        buckets[index] += 1
+                histogram[1] += seconds
+                histogram[2] += 1
+
+    def set_encoder_fps(self, file_path, fps):
+        with self.lock:
+            if fps:
+                self.encoder_fps[file_path] = fps
+            else:
+                self.encoder_fps.pop(file_path, None)
+
+    def render(self):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{value}"' for key, value in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        queue_depth = JobQueue().count_by_state()
+        metric('vct_queue_jobs', 'gauge', "Jobs in the persistent queue by state",
+               [({'state': state}, queue_depth.get(state, 0))
+                for state in JOB_PENDING_STATES + (JOB_DONE, JOB_FAILED)])
+        with self.lock:
+            metric('vct_jobs_total', 'counter', "Jobs finished since start by result",
+                   [({'result': result}, count) for result, count in self.jobs.items()])
+            metric('vct_bytes_in_total', 'counter', "Source bytes of completed jobs", [({}, self.bytes_in)])
+            metric('vct_bytes_out_total', 'counter', "Output bytes of completed jobs", [({}, self.bytes_out)])
+            metric('vct_bytes_saved_total', 'counter', "Bytes saved by completed jobs since start",
+                   [({}, self.bytes_in - self.bytes_out)])
+            metric('vct_encode_seconds_total', 'counter', "Wall-clock seconds spent encoding",
+                   [({}, round(self.encode_seconds, 3))])
+            lines.append("# HELP vct_stage_seconds Per-stage latency of completed jobs")
+            lines.append("# TYPE vct_stage_seconds histogram")
+            for stage, (buckets, total, count) in self.stage_histograms.items():
+                stage_name = stage[:-len('_time')]
+                for bound, bucket_count in zip(self.STAGE_BUCKETS, buckets):
+                    lines.append(f'vct_stage_seconds_bucket{{stage="{stage_name}",le="{bound}"}} {bucket_count}')
+                lines.append(f'vct_stage_seconds_bucket{{stage="{stage_name}",le="+Inf"}} {count}')
+                lines.append(f'vct_stage_seconds_sum{{stage="{stage_name}"}} {round(total, 3)}')
+                lines.append(f'vct_stage_seconds_count{{stage="{stage_name}"}} {count}')
+            encoder_fps = sum(self.encoder_fps.values())
+            encoding_files = len(self.encoder_fps)
+        thread = self.thread
+        running = len(thread.current_processes) if thread is not None and thread.isRunning() else 0
+        metric('vct_ffmpeg_processes', 'gauge', "Running local ffmpeg processes", [({}, running)])
+        metric('vct_encoding_files', 'gauge', "Files currently being encoded", [({}, encoding_files)])
+        metric('vct_encoder_fps', 'gauge', "Current total encoder frames per second", [({}, round(encoder_fps, 2))])
+        metric('vct_history_bytes_saved', 'gauge', "Bytes saved by all completed files in the compression history",
+               [({}, history_bytes_saved())])
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+
+def history_bytes_saved(db_path='compression_history.db'):
+    """压缩历史中所有完成的文件累计节省的字节数"""
+    try:
+        with sqlite3.connect(db_path) as conn:
+            row = conn.execute(
+                "SELECT SUM(original_size - compressed_size) FROM compression_history "
+                "WHERE status LIKE '完成%' AND compressed_size > 0"
+            ).fetchone()
+        return row[0] or 0
+    except sqlite3.Error:
+        return 0
+
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = METRICS.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 不在控制台打印每次抓取
+        pass
+
+
+class MetricsServer:
+    """在本机端口上提供 /metrics"""
+
+    def __init__(self, port, host='127.0.0.1'):
+        self.server = http.server.ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self.server.daemon_threads = True
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"指标端点：http://{self.server.server_address[0]}:{self.server.server_address[1]}/metrics")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
 
 
 """
@@ -28,62 +344,2493 @@ import sys
 例如，对于一个 1920×1080、30fps 的视频，如果希望画质较好，选择量化系数为 0.12，那么比特率大约为（1920×1080×30×0.12）/（1024×1024）≈7.3Mbps。
 返回单位 bps
 """
-def estimate_appropriate_bitrate(input_video_path, quantization_coef):
+@profiled()
+def estimate_appropriate_bitrate(input_video_path, quantization_coef, content_aware=False, max_height=None, max_fps=None):
     # 获取视频的分辨率和帧率
-    command = f'ffprobe -v error -select_streams v:0 -show_entries stream=width,height,r_frame_rate,duration,bit_rate -of json "{input_video_path}"'
-    result = subprocess.run(command, shell=True, capture_output=True, text=True)
+    info = probe_video(input_video_path)
+    if not info:
+        return 0, None, None, None
+    # 按画面复杂度调整量化系数：没测过时先测量一次，结果写入 info 和探测缓存
+    if content_aware:
+        get_complexity(input_video_path, info)
+    
+    # 计算建议比特率
+    bitrate = target_bitrate(info, quantization_coef, max_height, max_fps, content_aware)
+    return bitrate, info['duration'], info['bit_rate'], info['frame_rate']
+
+
+def target_bitrate(info, quantization_coef, max_height=None, max_fps=None, content_aware=False):
+    """建议比特率：输出的宽 × 高 × 帧率 × 量化系数，content_aware 时再乘以画面复杂度倍数
+
+    估算比特率、处理顺序、预计耗时和预估节省都用这个公式；只使用 info 中已有的复杂度，不会测量
+    """
+    # 设置了分辨率、帧率上限时按输出的尺寸和帧率计算
+    width, height, frame_rate, _ = output_geometry(info, max_height, max_fps)
+    bitrate = width * height * frame_rate * quantization_coef
+    # 静态画面降低，剧烈运动提高
+    if content_aware and info.get('spatial') is not None:
+        bitrate *= complexity_scale((info['spatial'], info['temporal']))
+    return bitrate
+
+
+def output_geometry(info, max_height=None, max_fps=None):
+    """按分辨率和帧率上限计算输出的 (宽, 高, 帧率, 视频滤镜列表)，没有超过上限时滤镜为空
+
+    分辨率上限作用于短边，竖拍视频同样按 1080p、720p 等档位缩小
+    """
+    width, height, frame_rate = info['width'], info['height'], info['frame_rate']
+    filters = []
+    if max_fps and frame_rate and frame_rate > max_fps + 0.01:
+        # 先降帧率再缩放，需要缩放的帧更少
+        frame_rate = max_fps
+        filters.append(f"fps={max_fps}")
+    if max_height and width and height and min(width, height) > max_height:
+        if width >= height:
+            width, height = max(2, round(width * max_height / height / 2) * 2), max_height
+            filters.append(f"scale=-2:{max_height}")
+        else:
+            width, height = max_height, max(2, round(height * max_height / width / 2) * 2)
+            filters.append(f"scale={max_height}:-2")
+    return width, height, frame_rate, filters
+
+
+def reference_filters(original_info, output_info):
+    """把原视频转换到与压缩结果相同的帧率和尺寸的滤镜，用于比较 SSIM"""
+    filters = []
+    if not original_info or not output_info:
+        return filters
+    if output_info['frame_rate'] and original_info['frame_rate'] \
+            and abs(output_info['frame_rate'] - original_info['frame_rate']) > 0.01:
+        filters.append(f"fps={output_info['frame_rate']:.6g}")
+    if (output_info['width'], output_info['height']) != (original_info['width'], original_info['height']):
+        filters.append(f"scale={output_info['width']}:{output_info['height']}")
+    return filters
+
+
+PROBE_CACHE_DB = 'compression_history.db'
+PROBE_KEYS = ('width', 'height', 'frame_rate', 'duration', 'bit_rate', 'codec', 'spatial', 'temporal')
+PROBE_COMPLEXITY_COLUMNS = ('spatial', 'temporal')
+
+
+def probe_video(file_path, use_cache=True):
+    """获取视频流的分辨率、帧率、时长、比特率和编码格式，失败返回 None
+
+    结果缓存在数据库中，文件大小和修改时间都没变时直接使用缓存，不再调用 ffprobe；
+    缓存中还有测过的画面复杂度（spatial、temporal），没测过时为 None
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError as e:
+        print(f"获取视频信息失败：{e}")
+        return None
+
+    if use_cache:
+        info = load_cached_probe(file_path, stat)
+        if info:
+            return info
+
+    command = [
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'stream=width,height,r_frame_rate,duration,bit_rate,codec_name:format=duration',
+        '-of', 'json',
+        file_path
+    ]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"获取视频信息失败：{result.stderr}")
+        return None
+
+    try:
+        data = json.loads(result.stdout)
+        stream = data['streams'][0]
+        num, den = stream['r_frame_rate'].split('/')  # 处理类似 "30000/1001" 的格式
+        # mkv 等容器的视频流没有 duration，使用容器的时长
+        duration = stream.get('duration') or data.get('format', {}).get('duration') or 0
+        info = {
+            'width': int(stream['width']),
+            'height': int(stream['height']),
+            'frame_rate': int(num) / int(den),
+            'duration': float(duration),
+            'bit_rate': int(stream.get('bit_rate', 0)),
+            'codec': stream.get('codec_name', ''),
+            'spatial': None,
+            'temporal': None,
+        }
+    except Exception as e:
+        print(f"解析视频信息失败：{e}")
+        return None
+
+    if use_cache:
+        save_cached_probe(file_path, stat, info)
+    return info
+
+
+def init_probe_cache(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS probe_cache
+        (file_path TEXT PRIMARY KEY,
+        file_size INTEGER,
+        mtime REAL,
+        width INTEGER,
+        height INTEGER,
+        frame_rate REAL,
+        duration REAL,
+        bit_rate INTEGER,
+        codec TEXT,
+        spatial REAL,
+        temporal REAL)''')
+    # 旧版本的缓存表没有画面复杂度
+    cursor.execute('PRAGMA table_info(probe_cache)')
+    existing_columns = {row[1] for row in cursor.fetchall()}
+    for column in PROBE_COMPLEXITY_COLUMNS:
+        if column not in existing_columns:
+            cursor.execute(f'ALTER TABLE probe_cache ADD COLUMN {column} REAL')
+
+
+def load_cached_probe(file_path, stat):
+    """读取与文件当前大小、修改时间一致的探测结果"""
+    try:
+        with sqlite3.connect(PROBE_CACHE_DB) as conn:
+            cursor = conn.cursor()
+            init_probe_cache(cursor)
+            cursor.execute(
+                f'SELECT {", ".join(PROBE_KEYS)} FROM probe_cache '
+                'WHERE file_path = ? AND file_size = ? AND mtime = ?',
+                (file_path, stat.st_size, stat.st_mtime)
+            )
+            row = cursor.fetchone()
+    except sqlite3.Error as e:
+        print(f"读取探测缓存失败：{e}")
+        return None
+    if not row:
+        return None
+    return dict(zip(PROBE_KEYS, row))
+
+
+def load_probe_cache():
+    """一次读出全部探测缓存：文件路径 -> (文件大小, 修改时间, 探测结果)"""
+    try:
+        with sqlite3.connect(PROBE_CACHE_DB) as conn:
+            cursor = conn.cursor()
+            init_probe_cache(cursor)
+            cursor.execute(f'SELECT file_path, file_size, mtime, {", ".join(PROBE_KEYS)} FROM probe_cache')
+            rows = cursor.fetchall()
+    except sqlite3.Error as e:
+        print(f"读取探测缓存失败：{e}")
+        return {}
+    return {row[0]: (row[1], row[2], dict(zip(PROBE_KEYS, row[3:]))) for row in rows}
+
+
+def save_cached_probe(file_path, stat, info):
+    try:
+        with sqlite3.connect(PROBE_CACHE_DB) as conn:
+            cursor = conn.cursor()
+            init_probe_cache(cursor)
+            cursor.execute(
+                f'REPLACE INTO probe_cache (file_path, file_size, mtime, {", ".join(PROBE_KEYS)}) '
+                f'VALUES (?, ?, ?, {", ".join("?" for _ in PROBE_KEYS)})',
+                (file_path, stat.st_size, stat.st_mtime) + tuple(info.get(key) for key in PROBE_KEYS)
+            )
+            conn.commit()
+    except sqlite3.Error as e:
+        print(f"保存探测缓存失败：{e}")
+
+
+COMPLEXITY_FRAME_WIDTH = 160      # 分析时缩小到的宽度
+COMPLEXITY_WINDOWS = 3            # 分析的片段数
+COMPLEXITY_WINDOW_SECONDS = 2.0   # 每个片段的长度
+COMPLEXITY_SAMPLE_FPS = 5         # 片段内每秒取的帧数
+# 普通实拍视频的典型值，复杂度与之相同时系数不变
+COMPLEXITY_REFERENCE_SPATIAL = 8.0
+COMPLEXITY_REFERENCE_TEMPORAL = 6.0
+COMPLEXITY_SCALE_RANGE = (0.6, 1.6)
+
+
+def measure_complexity(file_path, info):
+    """在几个片段上按低分辨率、抽帧解码，测量画面复杂度
+
+    返回 (spatial, temporal)：spatial 为相邻像素亮度差的平均值（细节），
+    temporal 为相邻采样帧亮度差的平均值（运动）；无法解码时返回 None
+    """
+    if not info.get('width') or not info.get('height'):
+        return None
+    width = min(COMPLEXITY_FRAME_WIDTH, info['width'] - info['width'] % 2)
+    height = max(2, round(info['height'] * width / info['width'] / 2) * 2)
+    frame_size = width * height
+    creation_flags = subprocess.CREATE_NO_WINDOW if platform.system() == 'Windows' else 0
+    spatial_values = []
+    temporal_values = []
+    for start, length in get_sample_windows(info.get('duration'), COMPLEXITY_WINDOWS, COMPLEXITY_WINDOW_SECONDS):
+        command = [
+            'ffmpeg', '-v', 'error',
+            '-ss', f"{start:.3f}", '-t', f"{length:.3f}", '-i', file_path,
+            '-map', '0:v:0', '-an', '-sn',
+            '-vf', f"fps={COMPLEXITY_SAMPLE_FPS},scale={width}:{height}:flags=area,format=gray",
+            '-f', 'rawvideo', '-pix_fmt', 'gray', '-'
+        ]
+        result = subprocess.run(command, capture_output=True, creationflags=creation_flags)
+        if result.returncode != 0:
+            continue
+        frames = [result.stdout[offset:offset + frame_size]
+                  for offset in range(0, len(result.stdout) - frame_size + 1, frame_size)]
+        for index, frame in enumerate(frames):
+            spatial_values.append(frame_detail(frame, width, height))
+            if index:
+                temporal_values.append(frame_difference(frames[index - 1], frame))
+    if not spatial_values:
+        return None
+    temporal = statistics.fmean(temporal_values) if temporal_values else 0.0
+    return statistics.fmean(spatial_values), temporal
+
+
+def frame_detail(frame, width, height):
+    """灰度帧中水平、垂直相邻像素亮度差的平均值"""
+    if np is not None:
+        pixels = np.frombuffer(frame, dtype=np.uint8).reshape(height, width).astype(np.int16)
+        return float((np.abs(np.diff(pixels, axis=1)).mean() + np.abs(np.diff(pixels, axis=0)).mean()) / 2)
+    horizontal = sum(abs(a - b) for a, b in zip(frame, frame[1:])) / max(1, len(frame) - 1)
+    vertical = sum(abs(a - b) for a, b in zip(frame, frame[width:])) / max(1, len(frame) - width)
+    return (horizontal + vertical) / 2
+
+
+def frame_difference(previous, frame):
+    """两帧灰度图亮度差的平均值"""
+    if np is not None:
+        return float(np.abs(np.frombuffer(frame, dtype=np.uint8).astype(np.int16)
+                            - np.frombuffer(previous, dtype=np.uint8)).mean())
+    return sum(abs(a - b) for a, b in zip(previous, frame)) / max(1, len(frame))
+
+
+def get_complexity(file_path, info):
+    """读取缓存的画面复杂度，没测过时测量一次并写入探测缓存"""
+    if info.get('spatial') is not None:
+        return info['spatial'], info['temporal']
+    complexity = measure_complexity(file_path, info)
+    if complexity is None:
+        return None
+    info['spatial'], info['temporal'] = complexity
+    try:
+        with sqlite3.connect(PROBE_CACHE_DB) as conn:
+            cursor = conn.cursor()
+            init_probe_cache(cursor)
+            cursor.execute('UPDATE probe_cache SET spatial = ?, temporal = ? WHERE file_path = ?',
+                           (complexity[0], complexity[1], file_path))
+            conn.commit()
+    except sqlite3.Error as e:
+        print(f"保存画面复杂度失败：{e}")
+    return complexity
+
+
+def complexity_scale(complexity):
+    """由画面复杂度得到量化系数的倍数，与典型实拍视频相同时为 1
+
+    运动对码率的影响比细节大；屏幕录制等静态画面倍数小于 1，运动相机等剧烈运动大于 1
+    """
+    if not complexity:
+        return None
+    spatial, temporal = complexity
+    scale = (max(spatial, 0.5) / COMPLEXITY_REFERENCE_SPATIAL) ** 0.3 \
+        * ((temporal + 1) / (COMPLEXITY_REFERENCE_TEMPORAL + 1)) ** 0.4
+    return min(max(scale, COMPLEXITY_SCALE_RANGE[0]), COMPLEXITY_SCALE_RANGE[1])
+
+
+def cached_complexities():
+    """探测缓存中所有测过的画面复杂度，返回 {文件路径: (spatial, temporal)}"""
+    try:
+        with sqlite3.connect(PROBE_CACHE_DB) as conn:
+            cursor = conn.cursor()
+            init_probe_cache(cursor)
+            cursor.execute('SELECT file_path, spatial, temporal FROM probe_cache WHERE spatial IS NOT NULL')
+            return {path: (spatial, temporal) for path, spatial, temporal in cursor.fetchall()}
+    except sqlite3.Error as e:
+        print(f"读取画面复杂度失败：{e}")
+        return {}
+
+
+def build_encode_command(input_path, output_path, bitrate, threads, input_args=None, output_args=None,
+                         video_filters=None):
+    """构建压缩用的 ffmpeg 命令，正式压缩和采样片段共用同一套编码参数
+
+    video_filters 为分辨率、帧率上限对应的滤镜（见 output_geometry）
+    """
+    command = ['ffmpeg']
+    command.extend(input_args or [])
+    command.extend([
+        '-i', input_path,
+        '-b:v', str(int(bitrate)),
+        '-movflags', '+faststart',  # 添加 faststart 标志以支持流媒体和快速预览
+        '-tag:v', 'avc1',  # 使用 avc1 标签代替 H264，提高兼容性
+    ])
+    if video_filters:
+        command.extend(['-vf', ','.join(video_filters)])
+    command.extend(output_args or [])
+    command.extend([
+        '-loglevel', 'error',  # 只显示错误信息
+        '-y',  # 自动覆盖
+        '-pix_fmt', 'yuv420p',  # 使用更通用的像素格式
+        '-threads', str(threads),  # 添加线程数参数
+        output_path
+    ])
+    return command
+
+
+# 附加输出的默认路径模板：{dir} 为压缩结果所在目录，{name} 为源文件名（不含扩展名），{height} 为代理文件的短边
+PROXY_TEMPLATE = os.path.join('{dir}', 'proxy', '{name}_{height}p.mp4')
+POSTER_TEMPLATE = os.path.join('{dir}', '{name}_poster.jpg')
+PROXY_CRF = 28            # 代理文件用固定质量编码，只用于剪辑和预览
+POSTER_POSITION = 0.1     # 封面帧取在时长的 10% 处，避开片头的黑场
+
+
+def rendition_outputs(directory, name, proxy_heights=(), proxy_template=PROXY_TEMPLATE, poster_template=None):
+    """按路径模板得到附加输出的列表：[('proxy', 短边, 路径), ..., ('poster', None, 路径)]"""
+    renditions = [('proxy', height, proxy_template.format(dir=directory, name=name, height=height))
+                  for height in proxy_heights]
+    if poster_template:
+        renditions.append(('poster', None, poster_template.format(dir=directory, name=name, height='')))
+    return renditions
+
+
+# 可以原样复制任意字幕流的容器；MP4、MOV 只能存放文本字幕（mov_text），图形字幕无法转换，因此不映射字幕
+SUBTITLE_COPY_EXTENSIONS = ('.mkv',)
+
+
+def stream_map_args(output_path, input_index=0):
+    """用 -map 指定输出流时，视频以外还要保留的流：全部音轨（按容器默认的编码器编码，与不指定 -map 时相同），
+    输出为 MKV 时再原样复制全部字幕"""
+    args = ['-map', f"{input_index}:a?"]
+    if os.path.splitext(output_path)[1].lower() in SUBTITLE_COPY_EXTENSIONS:
+        args.extend(['-map', f"{input_index}:s?", '-c:s', 'copy'])
+    return args
+
+
+def build_multi_output_command(input_path, output_path, bitrate, threads, renditions, info,
+                               output_args=None, video_filters=None):
+    """一次解码同时生成压缩结果和附加输出：用 split 滤镜把解码后的画面分给各个输出
+
+    压缩结果的编码参数与 build_encode_command 相同，音轨和字幕见 stream_map_args；output_path 为 None 时只生成附加输出
+    """
+    labels = (['master'] if output_path else []) + [f"r{index}" for index in range(len(renditions))]
+    graph = [f"[0:v]{','.join((video_filters or []) + [f'split={len(labels)}'])}"
+             + ''.join(f"[{label}]" for label in labels)]
+    outputs = []
+    for index, (kind, height, path) in enumerate(renditions):
+        if kind == 'proxy':
+            # 短边超过代理分辨率时才缩小，竖拍视频同样按短边
+            scale = output_geometry(info, height)[3] or ['null']
+            graph.append(f"[r{index}]{','.join(scale)}[r{index}out]")
+            outputs.extend([
+                '-map', f"[r{index}out]", '-map', '0:a:0?',
+                '-c:v', 'libx264', '-preset', 'veryfast', '-crf', str(PROXY_CRF), '-pix_fmt', 'yuv420p',
+                '-c:a', 'aac', '-b:a', '96k', '-movflags', '+faststart', '-threads', str(threads),
+                '-y', path
+            ])
+        else:
+            start = (info.get('duration') or 0) * POSTER_POSITION
+            graph.append(f"[r{index}]trim=start={start:.3f},setpts=PTS-STARTPTS[r{index}out]")
+            outputs.extend(['-map', f"[r{index}out]", '-frames:v', '1', '-update', '1', '-q:v', '3', '-y', path])
+
+    if output_path:
+        command = build_encode_command(input_path, output_path, bitrate, threads,
+                                       output_args=['-map', '[master]'] + stream_map_args(output_path) + (output_args or []))
+    else:
+        command = ['ffmpeg', '-i', input_path, '-loglevel', 'error'] + (output_args or [])
+    # 滤镜图紧跟在输入之后
+    position = command.index('-i') + 2
+    command[position:position] = ['-filter_complex', ';'.join(graph)]
+    command.extend(outputs)
+    return command
+
+
+def remove_renditions(renditions):
+    """删除编码失败或被中断时写了一半的附加输出"""
+    for _, _, rendition_path in renditions:
+        if os.path.exists(rendition_path):
+            os.remove(rendition_path)
+
+
+def parse_progress_seconds(state):
+    """从 ffmpeg -progress 输出的字段中取出已编码的时长（秒）"""
+    # out_time_ms 实际单位是微秒；编码刚开始时可能为 'N/A'
+    try:
+        return int(state.get('out_time_ms', 0)) / 1000000
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def parse_progress_rate(state, key):
+    """从 ffmpeg -progress 输出中取出 fps 或 speed（如 '1.25x'），无效时返回 None"""
+    value = str(state.get(key, '')).strip().rstrip('x')
+    try:
+        rate = float(value)
+    except ValueError:
+        return None
+    return rate if rate > 0 else None
+
+
+def parse_progress_size(state):
+    """从 ffmpeg -progress 输出中取出已写入的字节数（total_size），无效时返回 0"""
+    try:
+        return max(0, int(state.get('total_size', 0)))
+    except (TypeError, ValueError):
+        return 0
+
+
+class SizeProjection:
+    """按编码进度中的 total_size 外推压缩后的大小，预计的体积比例持续高于阈值时判定为不值得压缩
+
+    编码开头 x264 还在缓冲帧，已写入的大小偏小，所以至少编码了一定比例和时长才开始判断；
+    预计比例要在一段进度内一直高于阈值才中止，避免被局部的复杂片段误判。
+    """
+    MIN_FRACTION = 0.15      # 至少编码了全片的 15%
+    MIN_SECONDS = 20         # 且至少编码了 20 秒
+    STABLE_FRACTION = 0.05   # 预计比例连续高于阈值的进度跨度
+
+    def __init__(self, original_size, duration, max_ratio):
+        self.original_size = original_size
+        self.duration = float(duration)
+        self.max_ratio = max_ratio
+        self.ratio = None
+        self.above_since = None
+        self.aborted = False
+
+    def update(self, states):
+        """传入各进程最新的进度字段，需要中止时返回 True"""
+        encoded_seconds = sum(parse_progress_seconds(state) for state in states)
+        written = sum(parse_progress_size(state) for state in states)
+        fraction = min(encoded_seconds / self.duration, 1.0)
+        if encoded_seconds < self.MIN_SECONDS or fraction < self.MIN_FRACTION or not written:
+            return False
+        self.ratio = written / fraction / self.original_size
+        if self.ratio <= self.max_ratio:
+            self.above_since = None
+            return False
+        if self.above_since is None:
+            self.above_since = fraction
+        if fraction - self.above_since >= self.STABLE_FRACTION:
+            self.aborted = True
+        return self.aborted
+
+
+def get_sample_windows(duration, count=3, length=4.0):
+    """在视频中均匀选取若干个采样片段，返回 [(开始时间, 长度), ...]"""
+    if not duration or duration <= 0:
+        return []
+    if duration <= length * count:
+        # 视频太短，直接整段作为一个样本
+        return [(0.0, float(duration))]
+    windows = []
+    for i in range(count):
+        # 避开片头片尾，取 (i+1)/(count+1) 处
+        center = duration * (i + 1) / (count + 1)
+        start = max(0.0, min(center - length / 2, duration - length))
+        windows.append((start, length))
+    return windows
+
+
+def encode_sample_clip(input_path, start, length, bitrate, output_path, threads, include_audio=False,
+                       video_filters=None):
+    """按正式压缩的参数编码一个采样片段，成功返回 True"""
+    command = build_encode_command(
+        input_path, output_path, bitrate, threads,
+        input_args=['-ss', f"{start:.3f}"],
+        output_args=['-t', f"{length:.3f}"] + ([] if include_audio else ['-an']),
+        video_filters=video_filters
+    )
+    creation_flags = subprocess.CREATE_NO_WINDOW if platform.system() == 'Windows' else 0
+    result = subprocess.run(command, capture_output=True, text=True, creationflags=creation_flags)
+    if result.returncode != 0 or not os.path.exists(output_path):
+        print(f"编码采样片段失败：{result.stderr}")
+        return False
+    return True
+
+
+def calculate_clip_ssim(input_path, start, length, clip_path, video_filters=None):
+    """计算采样片段与原视频对应区间的SSIM值；片段经过了 video_filters 时原视频也先经过同样的滤镜"""
+    reference = f"[0:v]{','.join(video_filters)}[ref];[ref]" if video_filters else '[0:v]'
+    command = [
+        'ffmpeg',
+        '-ss', f"{start:.3f}", '-t', f"{length:.3f}", '-i', input_path,
+        '-i', clip_path,
+        '-filter_complex', f'{reference}[1:v]ssim',
+        '-f', 'null',
+        '-'
+    ]
+    creation_flags = subprocess.CREATE_NO_WINDOW if platform.system() == 'Windows' else 0
+    result = subprocess.run(command, capture_output=True, text=True, creationflags=creation_flags)
+    for line in result.stderr.split('\n'):
+        if 'SSIM' in line and 'All:' in line:
+            try:
+                return float(line.split('All:')[1].split('(')[0].strip())
+            except (ValueError, IndexError):
+                return None
+    return None
+
+
+# NumPy SSIM 引擎：两个视频以原分辨率解码为 yuv420p rawvideo，从管道读取，在进程池中按帧计算。
+# 算法与 ffmpeg 的 ssim 滤镜相同（4x4 块求和、步长为 4 的 8x8 窗口、Y/U/V 按像素数加权），
+# 得到的值与 ffmpeg 输出的 All 一致，影响程度的分档和目标SSIM对两种引擎通用
+SSIM_BATCH_FRAMES = 64       # 每批发送给进程池的帧数
+SSIM_BATCH_BYTES = 16 * 1024 * 1024  # 每批帧数据转换为 int32 后的上限，高分辨率时每批只有一帧
+SSIM_WORST_FRAMES = 5        # 报告 SSIM 最低的帧数
+SSIM_C1 = 416                # ffmpeg 中的 (int)(.01*.01*255*255*64 + .5)
+SSIM_C2 = 235928             # ffmpeg 中的 (int)(.03*.03*255*255*64*63 + .5)
+# 提前结束：先在均匀分布于整个时长的若干个片段上计算，各片段均值的置信区间
+# 不跨越影响程度的分档且半宽不超过 SSIM_MAX_ERROR 时直接返回，否则完整计算一遍
+SSIM_SAMPLE_WINDOWS = 16
+SSIM_WINDOW_FRAMES = 48
+SSIM_CONFIDENCE_Z = 1.96
+SSIM_MAX_ERROR = 0.001
+SSIM_LEVEL_THRESHOLDS = (0.98, 0.95, 0.90)  # 与 get_impact_level 的分档一致
+
+SSIM_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))
+
+_ssim_pool = None
+_ssim_pool_lock = threading.Lock()
+
+
+def get_ssim_pool():
+    """SSIM 计算共用的进程池，第一次使用时创建
+
+    使用 spawn 启动子进程：在有多个线程（Qt、压缩线程）的进程中 fork 可能复制到被其他线程持有的锁
+    """
+    global _ssim_pool
+    with _ssim_pool_lock:
+        if _ssim_pool is None:
+            _ssim_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=SSIM_WORKERS, mp_context=multiprocessing.get_context('spawn')
+            )
+        return _ssim_pool
+
+
+def ssim_plane(x, y):
+    """一个平面逐帧的 SSIM，x/y 形状为 (帧数, 高, 宽) 的 uint8 数组，与 ffmpeg ssim 滤镜的 ssim_plane 相同"""
+    count, height, width = x.shape
+    rows, cols = height // 4, width // 4
+    shape = (count, rows, 4, cols, 4)
+    # 8x8 窗口内 Σ(x²+y²) 最大约 830 万，int32 足够，内存只有 int64 的一半
+    x = x[:, :rows * 4, :cols * 4].astype(np.int32).reshape(shape)
+    y = y[:, :rows * 4, :cols * 4].astype(np.int32).reshape(shape)
+    # 每个 4x4 块的 Σx、Σy、Σ(x²+y²)、Σxy，逐个计算以减少同时存在的临时数组
+    block_sums = [x.sum(axis=(2, 4), dtype=np.int32), y.sum(axis=(2, 4), dtype=np.int32)]
+    block_sums.append((x * x + y * y).sum(axis=(2, 4), dtype=np.int32))
+    block_sums.append((x * y).sum(axis=(2, 4), dtype=np.int32))
+    del x, y
+    # 相邻 2x2 个块合成一个 8x8 窗口
+    s1, s2, ss, s12 = (
+        (v[:, :-1, :-1] + v[:, 1:, :-1] + v[:, :-1, 1:] + v[:, 1:, 1:]).astype(np.float64)
+        for v in block_sums
+    )
+    variance = ss * 64 - s1 * s1 - s2 * s2
+    covariance = s12 * 64 - s1 * s2
+    ssim_map = ((2 * s1 * s2 + SSIM_C1) * (2 * covariance + SSIM_C2)
+                / ((s1 * s1 + s2 * s2 + SSIM_C1) * (variance + SSIM_C2)))
+    return ssim_map.mean(axis=(1, 2))
+
+
+def ssim_frames(original, compressed, width, height):
+    """计算一批 yuv420p 帧逐帧的 SSIM，original/compressed 形状为 (帧数, 每帧字节数) 的 uint8 数组
+
+    Y、U、V 三个平面分别计算，再按平面的像素数加权，对应 ffmpeg ssim 滤镜的 All 值
+    """
+    chroma_width, chroma_height = (width + 1) // 2, (height + 1) // 2
+    luma_size, chroma_size = width * height, chroma_width * chroma_height
+    planes = (
+        (0, height, width),
+        (luma_size, chroma_height, chroma_width),
+        (luma_size + chroma_size, chroma_height, chroma_width),
+    )
+    total = 0
+    for offset, plane_height, plane_width in planes:
+        size = plane_height * plane_width
+        shape = (len(original), plane_height, plane_width)
+        total = total + ssim_plane(original[:, offset:offset + size].reshape(shape),
+                                   compressed[:, offset:offset + size].reshape(shape)) * size
+    return total / (luma_size + 2 * chroma_size)
+
+
+def open_yuv_pipe(video_path, filters=None, start=None, length=None):
+    """启动 ffmpeg 把视频解码为 yuv420p rawvideo 写到标准输出；start/length 只解码其中一段"""
+    command = ['ffmpeg', '-v', 'error']
+    if start is not None:
+        command += ['-ss', f"{start:.3f}", '-t', f"{length:.3f}"]
+    command += ['-i', video_path, '-map', '0:v:0', '-an', '-sn']
+    if filters:
+        command += ['-vf', ','.join(filters)]
+    command += ['-f', 'rawvideo', '-pix_fmt', 'yuv420p', '-']
+    creation_flags = subprocess.CREATE_NO_WINDOW if platform.system() == 'Windows' else 0
+    return subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            creationflags=creation_flags)
+
+
+def read_ssim_scores(original_path, compressed_path, width, height, filters, start=None, length=None):
+    """逐帧比较两个视频（或其中 start 开始 length 秒的一段），返回每帧 SSIM 的列表
+
+    filters 用于把原视频转换到压缩结果的尺寸和帧率
+    """
+    frame_size = width * height + 2 * ((width + 1) // 2) * ((height + 1) // 2)
+    batch_frames = max(1, min(SSIM_BATCH_FRAMES, SSIM_BATCH_BYTES // (frame_size * 4)))
+    pipes = [
+        open_yuv_pipe(original_path, filters, start, length),
+        open_yuv_pipe(compressed_path, None, start, length),
+    ]
+    pool = get_ssim_pool()
+    pending = collections.deque()
+    scores = []
+    try:
+        while True:
+            buffers = [pipe.stdout.read(frame_size * batch_frames) for pipe in pipes]
+            count = min(len(buffer) for buffer in buffers) // frame_size
+            if count == 0:
+                break
+            # 在读到的字节上建立视图，提交给进程池时序列化
+            original, compressed = (
+                np.frombuffer(buffer, dtype=np.uint8, count=count * frame_size).reshape(count, frame_size)
+                for buffer in buffers
+            )
+            pending.append(pool.submit(ssim_frames, original, compressed, width, height))
+            while len(pending) >= SSIM_WORKERS * 2 or (pending and pending[0].done()):
+                scores.extend(pending.popleft().result().tolist())
+            if count < batch_frames:
+                break
+        while pending:
+            scores.extend(pending.popleft().result().tolist())
+    finally:
+        for pipe in pipes:
+            if pipe.poll() is None:
+                pipe.kill()
+            pipe.stdout.close()
+            pipe.wait()
+    return scores
+
+
+def ssim_confident(window_means):
+    """按各采样片段的均值估计整体均值的置信区间，区间足够窄且落在同一影响程度分档内时返回 True"""
+    if len(window_means) < 2:
+        return False
+    mean = statistics.fmean(window_means)
+    error = SSIM_CONFIDENCE_Z * statistics.stdev(window_means) / math.sqrt(len(window_means))
+    if error > SSIM_MAX_ERROR:
+        return False
+    return all(not (mean - error < threshold <= mean + error) for threshold in SSIM_LEVEL_THRESHOLDS)
+
+
+def compute_ssim(original_path, compressed_path, early_exit=True):
+    """用 NumPy 逐帧计算两个视频的 SSIM，结果与 ffmpeg ssim 滤镜的 All 值一致
+
+    early_exit 时较长的视频先只比较均匀分布在整个时长上的 SSIM_SAMPLE_WINDOWS 个片段，
+    片段均值的置信区间满足要求时直接返回，否则完整比较。
+    返回 dict：ssim 平均值，frames 比较的帧数，worst 最差的帧 [(时间秒, SSIM), ...]，
+    early 是否只比较了采样片段；无法计算时返回 None。
+    """
+    info = probe_video(original_path)
+    compressed_info = probe_video(compressed_path, use_cache=False)
+    if not info or not compressed_info or not compressed_info['width'] or not compressed_info['height']:
+        return None
+    # 压缩时限制了分辨率或帧率的，原视频先转换到相同的尺寸和帧率，两边的帧才能一一对应
+    filters = reference_filters(info, compressed_info)
+    width, height = compressed_info['width'], compressed_info['height']
+    frame_rate = compressed_info['frame_rate'] or info['frame_rate'] or 25
+    duration = info['duration'] or 0
+
+    scores, times = [], []
+    early = False
+    window_seconds = SSIM_WINDOW_FRAMES / frame_rate
+    if early_exit and duration >= window_seconds * SSIM_SAMPLE_WINDOWS * 4:
+        window_means = []
+        for index in range(SSIM_SAMPLE_WINDOWS):
+            start = duration * (index + 0.5) / SSIM_SAMPLE_WINDOWS - window_seconds / 2
+            window = read_ssim_scores(original_path, compressed_path, width, height, filters, start, window_seconds)
+            if window:
+                window_means.append(statistics.fmean(window))
+                scores.extend(window)
+                times.extend(start + i / frame_rate for i in range(len(window)))
+        early = ssim_confident(window_means)
+    if not early:
+        scores = read_ssim_scores(original_path, compressed_path, width, height, filters)
+        times = [i / frame_rate for i in range(len(scores))]
+
+    if not scores:
+        return None
+    worst = sorted(range(len(scores)), key=scores.__getitem__)[:SSIM_WORST_FRAMES]
+    return {
+        'ssim': statistics.fmean(scores),
+        'frames': len(scores),
+        'worst': [(times[index], scores[index]) for index in worst],
+        'early': early,
+    }
+
+
+# 压缩历史表在基础字段之外追加的列（列名: 类型），旧数据库启动时自动补齐
+HISTORY_EXTRA_COLUMNS = {
+    'predicted_ratio': 'REAL',  # 压缩前根据采样片段预测的体积比例
+    'time_taken': 'REAL',       # 从开始处理到完成的总耗时（秒）
+    'probe_time': 'REAL',       # 各阶段耗时（秒）
+    'encode_time': 'REAL',
+    'ssim_time': 'REAL',
+    'metadata_time': 'REAL',
+    'replace_time': 'REAL',
+    'encode_fps': 'REAL',       # 编码期间 ffmpeg 报告的平均帧率
+    'encode_speed': 'REAL',     # 编码期间 ffmpeg 报告的平均速度（相对实时的倍数）
+    'width': 'INTEGER',         # 源视频参数和编码线程数，用于按类别估算剩余时间
+    'height': 'INTEGER',
+    'frame_rate': 'REAL',
+    'codec': 'TEXT',
+    'threads': 'INTEGER',
+    'ssim_worst': 'TEXT',       # SSIM 最低的几帧，"时间秒:SSIM" 以逗号分隔
+    'worker': 'TEXT',           # 在远程节点上编码时的节点名称
+    'complexity_scale': 'REAL', # 按画面复杂度对量化系数乘的倍数
+    'target_resolution': 'TEXT',  # 受分辨率、帧率上限限制时的输出规格，如 "1920x1080@30"
+}
+
+# 树形控件中可选显示的耗时列：(历史字段, 列标题, 格式)，排在“状态”列之后
+TIMING_COLUMN_START = 10
+TIMING_COLUMNS = [
+    ('probe_time', "探测耗时", "{:.1f}s"),
+    ('encode_time', "编码耗时", "{:.1f}s"),
+    ('ssim_time', "SSIM耗时", "{:.1f}s"),
+    ('metadata_time', "属性耗时", "{:.1f}s"),
+    ('replace_time', "替换耗时", "{:.2f}s"),
+    ('encode_fps', "编码帧率", "{:.1f}"),
+    ('encode_speed', "编码速度", "{:.2f}x"),
+]
+
+
+def ensure_history_columns(cursor):
+    """为旧版本的压缩历史表补齐新增的列"""
+    cursor.execute('PRAGMA table_info(compression_history)')
+    existing_columns = {row[1] for row in cursor.fetchall()}
+    for column, column_type in HISTORY_EXTRA_COLUMNS.items():
+        if column not in existing_columns:
+            cursor.execute(f'ALTER TABLE compression_history ADD COLUMN {column} {column_type}')
+
+
+class EtaPredictor:
+    """根据压缩历史估算队列的剩余时间
+
+    编码速度以“每秒墙钟时间编码的视频秒数”计，按分辨率档位、帧率档位、编码格式和线程数分组取中位数；
+    分组没有样本时逐级放宽条件，最后按历史的像素吞吐量换算。
+    """
+    RESOLUTION_CLASSES = (480, 720, 1080, 1440, 2160)
+    FRAME_RATE_CLASSES = (30, 60)
+    THREAD_SCALING = 0.6          # x264 多线程的加速比远低于线性，放宽线程数条件时按 线程数^0.6 换算
+    DEFAULT_PIXEL_RATE = 20e6     # 没有任何历史时，假设每秒能编码的像素数
+    DEFAULT_OVERHEAD = 5.0        # 没有历史时，每个文件探测、复制属性等额外耗时（秒）
+    DEFAULT_SSIM_RATIO = 0.3      # 没有历史时，SSIM 耗时与视频时长之比
+
+    def __init__(self):
+        self.speeds = {}          # 分组 -> 速度列表
+        self.pixel_rates = []     # 每秒编码的像素数（已按线程数归一）
+        self.ssim_ratios = []
+        self.overheads = []
+        self.medians = {}
+
+    def train(self, history):
+        """从 load_compression_history 返回的记录中学习"""
+        for record in history.values():
+            self.add_sample(record)
+
+    def add_sample(self, record):
+        """加入一条已完成的压缩记录，缺少必要字段时忽略"""
+        try:
+            duration = float(str(record.get('duration') or 0).replace(' 秒', ''))
+            encode_time = float(record.get('encode_time') or 0)
+            width = int(record.get('width') or 0)
+            height = int(record.get('height') or 0)
+            frame_rate = float(record.get('frame_rate') or 0)
+            threads = int(record.get('threads') or 0)
+        except (TypeError, ValueError):
+            return
+        if not (duration > 0 and encode_time > 0 and width and height and frame_rate and threads):
+            return
+
+        speed = duration / encode_time
+        normalized = speed / threads ** self.THREAD_SCALING
+        for level, key in enumerate(self.group_keys(width, height, frame_rate, record.get('codec') or '', threads)):
+            # 第一级包含线程数，使用实际速度；更宽的分组按线程数归一
+            self.speeds.setdefault(key, []).append(speed if level == 0 else normalized)
+        self.pixel_rates.append(width * height * frame_rate * normalized)
+
+        ssim_time = float(record.get('ssim_time') or 0)
+        if ssim_time:
+            self.ssim_ratios.append(ssim_time / duration)
+        time_taken = float(record.get('time_taken') or 0)
+        if time_taken:
+            # 探测、比特率搜索、体积预测、复制属性、替换等编码和SSIM以外的耗时
+            self.overheads.append(max(0.0, time_taken - encode_time - ssim_time))
+        self.medians = {}
+
+    def group_keys(self, width, height, frame_rate, codec, threads):
+        """从精确到宽松的分组键"""
+        short_side = min(width, height)
+        resolution = next((limit for limit in self.RESOLUTION_CLASSES if short_side <= limit), 'max')
+        fps = next((limit for limit in self.FRAME_RATE_CLASSES if frame_rate <= limit + 1), 'max')
+        return [
+            (resolution, fps, codec, threads),
+            (resolution, fps, codec),
+            (resolution, fps),
+            (resolution,),
+        ]
+
+    def median(self, key, values):
+        if key not in self.medians:
+            self.medians[key] = statistics.median(values) if values else None
+        return self.medians[key]
+
+    def predict_speed(self, info, threads):
+        """预测编码速度（视频秒数/墙钟秒数）"""
+        keys = self.group_keys(info['width'], info['height'], info['frame_rate'], info.get('codec') or '', threads)
+        for level, key in enumerate(keys):
+            speed = self.median(key, self.speeds.get(key))
+            if speed:
+                return speed if level == 0 else speed * threads ** self.THREAD_SCALING
+        pixel_rate = self.median('pixel_rate', self.pixel_rates)
+        if pixel_rate:
+            pixel_rate *= threads ** self.THREAD_SCALING
+        else:
+            pixel_rate = self.DEFAULT_PIXEL_RATE
+        return pixel_rate / (info['width'] * info['height'] * info['frame_rate'])
+
+    def estimate_seconds(self, info, threads, quantization_coef, max_height=None, max_fps=None, content_aware=False):
+        """估算处理一个文件的总耗时（秒）"""
+        overhead = self.median('overhead', self.overheads)
+        if overhead is None:
+            overhead = self.DEFAULT_OVERHEAD
+        # 估算比特率不低于原比特率的 90% 时不会压缩，只有探测的耗时
+        bitrate = target_bitrate(info, quantization_coef, max_height, max_fps, content_aware)
+        if info.get('bit_rate') and bitrate >= info['bit_rate'] * 0.9:
+            return overhead
+        duration = info.get('duration') or 0
+        ssim_ratio = self.median('ssim_ratio', self.ssim_ratios)
+        if ssim_ratio is None:
+            ssim_ratio = self.DEFAULT_SSIM_RATIO
+        return duration / self.predict_speed(info, threads) + duration * ssim_ratio + overhead
+
+
+# 输出分辨率（短边）和帧率上限的选项，None 为不限制
+MAX_HEIGHT_OPTIONS = [None, 2160, 1440, 1080, 720, 480]
+MAX_FPS_OPTIONS = [None, 60, 30, 25, 24]
+
+# 任务的处理顺序：(策略, 显示名称)
+SCHEDULE_POLICIES = [
+    ('savings_rate', "每秒节省最多优先"),
+    ('shortest', "耗时最短优先"),
+    ('largest', "文件最大优先"),
+    ('tree', "列表顺序"),
+]
+
+
+def expected_savings(info, size, quantization_coef, max_height=None, max_fps=None, content_aware=False):
+    """按 estimate_appropriate_bitrate 的公式估算压缩能节省的字节数，不会压缩的文件为 0"""
+    bitrate = target_bitrate(info, quantization_coef, max_height, max_fps, content_aware)
+    current = info.get('bit_rate')
+    duration = info.get('duration') or 0
+    if not current or bitrate >= current * 0.9:
+        return 0.0
+    return min(size, (current - bitrate) * duration / 8)
+
+
+def order_jobs(files, policy, quantization_coef, threads, predictor, max_height=None, max_fps=None,
+               content_aware=False):
+    """按调度策略排列 [(文件路径, 相对路径), ...]
+
+    savings_rate 按预计节省的字节数 / 预计耗时从高到低，批处理中途停止时已经拿到大部分收益；
+    shortest 按预计耗时从短到长；largest 按文件大小从大到小；tree 保持列表顺序。
+    探测不到信息的文件排在最后，同分的文件保持原来的顺序。
+    max_height、max_fps、content_aware 与压缩时相同，用于估算目标比特率。
+    """
+    if policy == 'tree':
+        return list(files)
+    keys = {}
+    for file_path, _ in files:
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            continue
+        if policy == 'largest':
+            keys[file_path] = -size
+            continue
+        info = probe_video(file_path)
+        if not info or not info['width'] or not info['height'] or not info['frame_rate']:
+            continue
+        seconds = max(predictor.estimate_seconds(info, threads, quantization_coef, max_height, max_fps,
+                                                 content_aware), 1.0)
+        if policy == 'shortest':
+            keys[file_path] = seconds
+        else:
+            keys[file_path] = -expected_savings(info, size, quantization_coef, max_height, max_fps,
+                                                content_aware) / seconds
+    return sorted(files, key=lambda job: (job[0] not in keys, keys.get(job[0], 0)))
+
+
+# 任务队列中每个任务的状态
+JOB_QUEUED = 'queued'          # 等待处理
+JOB_RUNNING = 'running'        # 正在编码，输出文件可能只写了一半
+JOB_VERIFYING = 'verifying'    # 编码完成，正在计算SSIM
+JOB_FINALIZING = 'finalizing'  # 正在复制元数据、替换源文件
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_PENDING_STATES = (JOB_QUEUED, JOB_RUNNING, JOB_VERIFYING, JOB_FINALIZING)
+
+
+class JobQueue:
+    """持久化的压缩任务队列，与压缩历史存放在同一个 SQLite 数据库中
+
+    每个任务记录所处阶段和中间文件路径，程序中断后可以精确清理半成品，
+    并从未完成的阶段继续，而不是重新压缩
+    """
+
+    def __init__(self, db_path='compression_history.db'):
+        self.db_path = db_path
+        self.init_table()
+
+    def init_table(self):
+        """确保任务表存在"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute('''CREATE TABLE IF NOT EXISTS compression_jobs
+                    (file_path TEXT PRIMARY KEY,
+                    rel_path TEXT,
+                    position INTEGER,
+                    state TEXT,
+                    output_path TEXT,
+                    temp_path TEXT,
+                    backup_path TEXT,
+                    original_size INTEGER,
+                    target_bitrate REAL,
+                    predicted_ratio REAL,
+                    impact_level TEXT,
+                    updated_time TEXT)''')
+        except Exception as e:
+            print(f"初始化任务队列失败：{e}")
+
+    def start_batch(self, files):
+        """用新一批文件重建队列；已在队列中且未完成的任务保留其阶段，以免重复已完成的步骤"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                existing = {
+                    row[0]: row[1] for row in conn.execute('SELECT file_path, state FROM compression_jobs')
+                }
+                new_paths = {file_path for file_path, _ in files}
+                # 不在本批次中的旧任务先清理中间文件再移除
+                for file_path in existing:
+                    if file_path not in new_paths:
+                        self.discard_job(file_path, conn)
+                now = datetime.datetime.now().isoformat()
+                for position, (file_path, rel_path) in enumerate(files):
+                    if existing.get(file_path) in JOB_PENDING_STATES:
+                        conn.execute('UPDATE compression_jobs SET position = ?, updated_time = ? WHERE file_path = ?',
+                                     (position, now, file_path))
+                    else:
+                        conn.execute('REPLACE INTO compression_jobs (file_path, rel_path, position, state, updated_time) '
+                                     'VALUES (?, ?, ?, ?, ?)', (file_path, rel_path, position, JOB_QUEUED, now))
+        except Exception as e:
+            print(f"写入任务队列失败：{e}")
+
+    def get(self, file_path):
+        """获取单个任务，不存在时返回 None"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.row_factory = sqlite3.Row
+                row = conn.execute('SELECT * FROM compression_jobs WHERE file_path = ?', (file_path,)).fetchone()
+                return dict(row) if row else None
+        except Exception as e:
+            print(f"读取任务失败：{e}")
+            return None
+
+    def count_by_state(self):
+        """各状态的任务数"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                return dict(conn.execute('SELECT state, COUNT(*) FROM compression_jobs GROUP BY state'))
+        except Exception as e:
+            print(f"读取任务队列失败：{e}")
+            return {}
+
+    def update(self, file_path, **fields):
+        """更新任务的状态或中间文件路径"""
+        fields['updated_time'] = datetime.datetime.now().isoformat()
+        assignments = ', '.join(f"{key} = ?" for key in fields)
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute(f'UPDATE compression_jobs SET {assignments} WHERE file_path = ?',
+                             tuple(fields.values()) + (file_path,))
+        except Exception as e:
+            print(f"更新任务状态失败：{e}")
+
+    def pending_jobs(self):
+        """按队列顺序返回所有未完成的任务 [(file_path, rel_path), ...]"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                placeholders = ', '.join('?' for _ in JOB_PENDING_STATES)
+                rows = conn.execute(
+                    f'SELECT file_path, rel_path FROM compression_jobs WHERE state IN ({placeholders}) ORDER BY position',
+                    JOB_PENDING_STATES
+                ).fetchall()
+                return [(row[0], row[1]) for row in rows]
+        except Exception as e:
+            print(f"读取任务队列失败：{e}")
+            return []
+
+    def jobs_in_state(self, *states):
+        """返回处于指定状态的任务列表"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.row_factory = sqlite3.Row
+                placeholders = ', '.join('?' for _ in states)
+                rows = conn.execute(f'SELECT * FROM compression_jobs WHERE state IN ({placeholders})', states).fetchall()
+                return [dict(row) for row in rows]
+        except Exception as e:
+            print(f"读取任务队列失败：{e}")
+            return []
+
+    def recover_interrupted(self):
+        """程序上次异常退出后，按任务记录的阶段精确清理或补完中间文件"""
+        for job in self.jobs_in_state(JOB_RUNNING, JOB_VERIFYING, JOB_FINALIZING):
+            file_path = job['file_path']
+            output_path = job.get('output_path')
+            temp_path = job.get('temp_path')
+            backup_path = job.get('backup_path')
+            try:
+                # 复制元数据时的临时文件总是不完整的
+                if temp_path and os.path.exists(temp_path):
+                    os.remove(temp_path)
+                    print(f"已删除未完成的临时文件：{temp_path}")
+
+                if job['state'] == JOB_RUNNING:
+                    # 编码中断，输出只写了一半，删除后从头压缩
+                    if output_path and os.path.exists(output_path):
+                        os.remove(output_path)
+                        print(f"已删除未完成的压缩文件：{output_path}")
+                    self.update(file_path, state=JOB_QUEUED)
+                elif job['state'] == JOB_VERIFYING:
+                    # 编码已完成，只需重新校验；输出丢失则重新压缩
+                    if not (output_path and os.path.exists(output_path)):
+                        self.update(file_path, state=JOB_QUEUED)
+                elif backup_path and os.path.exists(backup_path):
+                    # 替换源文件时中断：.bak 是原文件
+                    if not os.path.exists(file_path) and output_path and os.path.exists(output_path):
+                        # 旧记录中的结果可能在另一个分区的暂存目录中，os.rename 会失败
+                        shutil.move(output_path, file_path)
+                        os.remove(backup_path)
+                        self.update(file_path, state=JOB_DONE)
+                    elif os.path.exists(file_path):
+                        os.remove(backup_path)
+                        self.update(file_path, state=JOB_DONE)
+                    else:
+                        os.rename(backup_path, file_path)
+                        self.update(file_path, state=JOB_QUEUED)
+                    print(f"已恢复中断的替换操作：{file_path}")
+                elif not (output_path and os.path.exists(output_path)):
+                    # 输出已不在：若源文件大小已变化，说明替换已完成
+                    if os.path.exists(file_path) and job.get('original_size') \
+                            and os.path.getsize(file_path) != job['original_size']:
+                        self.update(file_path, state=JOB_DONE)
+                    else:
+                        self.update(file_path, state=JOB_QUEUED)
+            except Exception as e:
+                print(f"恢复中断任务失败：{file_path}，{e}")
+                self.update(file_path, state=JOB_FAILED)
+
+    def discard_job(self, file_path, conn=None):
+        """删除任务，同时清理它留下的未完成输出"""
+        job = self.get(file_path)
+        if job and job['state'] in (JOB_RUNNING, JOB_VERIFYING, JOB_FINALIZING):
+            for path in (job.get('output_path'), job.get('temp_path')):
+                try:
+                    if path and os.path.exists(path):
+                        os.remove(path)
+                        print(f"已删除未完成的文件：{path}")
+                except Exception as e:
+                    print(f"删除未完成的文件失败：{e}")
+        try:
+            if conn is not None:
+                conn.execute('DELETE FROM compression_jobs WHERE file_path = ?', (file_path,))
+            else:
+                with sqlite3.connect(self.db_path) as conn:
+                    conn.execute('DELETE FROM compression_jobs WHERE file_path = ?', (file_path,))
+        except Exception as e:
+            print(f"删除任务失败：{e}")
+
+    def discard_pending(self):
+        """放弃所有未完成的任务"""
+        for file_path, _ in self.pending_jobs():
+            self.discard_job(file_path)
+
+
+class AdaptiveThrottle:
+    """根据系统负载动态调整后续任务的编码线程数、并发任务数和进程优先级
+
+    采样 1 分钟负载、CPU 空闲比例和可用内存；负载来自本程序自己的编码线程时不算“机器被占用”。
+    Linux 读 /proc，Windows 通过 GetSystemTimes 和 GlobalMemoryStatusEx 采样（没有平均负载，按空闲比例估算）
+    """
+
+    # 每个并发任务至少保留的可用内存
+    MEMORY_PER_JOB = 1024 * 1024 * 1024
+
+    def __init__(self, max_threads=None):
+        self.cpu_count = multiprocessing.cpu_count()
+        self.max_threads = max_threads or self.cpu_count
+        self.last_cpu_times = None
+        # 当前分配给本程序编码的线程总数，用来从系统负载中扣除自己的部分
+        self.own_threads = 0
+        self.threads = max(1, self.cpu_count // 2)
+        self.concurrency = 1
+        self.low_priority = False
+
+    @staticmethod
+    def is_supported():
+        """当前平台能否采样系统负载"""
+        return platform.system() == 'Windows' or os.path.exists('/proc/stat') or hasattr(os, 'getloadavg')
+
+    def read_load_average(self):
+        """1 分钟平均负载，不支持的平台返回 None"""
+        try:
+            return os.getloadavg()[0]
+        except (AttributeError, OSError):
+            return None
+
+    def read_cpu_times(self):
+        """累计的 (空闲时间, 总时间)，不支持的平台返回 None"""
+        if platform.system() == 'Windows':
+            import ctypes
+            idle, kernel, user = (ctypes.c_ulonglong() for _ in range(3))
+            if not ctypes.windll.kernel32.GetSystemTimes(ctypes.byref(idle), ctypes.byref(kernel), ctypes.byref(user)):
+                return None
+            # 内核时间已包含空闲时间
+            return float(idle.value), float(kernel.value + user.value)
+        try:
+            with open('/proc/stat', 'r') as f:
+                fields = [float(value) for value in f.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+        # idle + iowait
+        return fields[3] + (fields[4] if len(fields) > 4 else 0), sum(fields)
+
+    def read_cpu_idle(self):
+        """两次采样之间的 CPU 空闲比例，首次采样或不支持时返回 None"""
+        times = self.read_cpu_times()
+        if times is None:
+            return None
+        idle, total = times
+        previous = self.last_cpu_times
+        self.last_cpu_times = (idle, total)
+        if previous is None or total <= previous[1]:
+            return None
+        return (idle - previous[0]) / (total - previous[1])
+
+    def read_available_memory(self):
+        """可用内存字节数，不支持时返回 None"""
+        if platform.system() == 'Windows':
+            import ctypes
+
+            class MemoryStatus(ctypes.Structure):
+                _fields_ = [
+                    ('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                    ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                    ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                    ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                    ('ullAvailExtendedVirtual', ctypes.c_ulonglong),
+                ]
+
+            status = MemoryStatus()
+            status.dwLength = ctypes.sizeof(MemoryStatus)
+            if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+                return status.ullAvailPhys
+            return None
+        try:
+            with open('/proc/meminfo', 'r') as f:
+                for line in f:
+                    if line.startswith('MemAvailable:'):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def update(self):
+        """采样一次并重新计算线程数、并发数和优先级，返回描述当前决策的文本"""
+        load = self.read_load_average()
+        idle = self.read_cpu_idle()
+        available_memory = self.read_available_memory()
+
+        # 其他程序占用的核心数：系统负载减去本程序的编码线程
+        if load is not None:
+            others_busy = max(0.0, load - self.own_threads)
+        elif idle is not None:
+            others_busy = max(0.0, (1 - idle) * self.cpu_count - self.own_threads)
+        else:
+            others_busy = 0.0
+        free_cores = max(1, int(self.cpu_count - others_busy))
+
+        # CPU 还有明显空闲就逐步加线程，没有空闲就逐步减
+        if idle is not None and idle > 0.25:
+            budget = min(free_cores, self.threads * self.concurrency + max(1, self.cpu_count // 8))
+        elif idle is not None and idle < 0.05:
+            budget = max(1, self.threads * self.concurrency - max(1, self.cpu_count // 8))
+            budget = min(budget, free_cores)
+        else:
+            budget = free_cores
+        budget = max(1, min(budget, self.max_threads))
+
+        # 低分辨率时 x264 单任务用不满太多线程，超过 8 个线程时拆成多个并发任务
+        concurrency = max(1, budget // 8)
+        if available_memory is not None:
+            concurrency = max(1, min(concurrency, available_memory // self.MEMORY_PER_JOB))
+        self.concurrency = concurrency
+        self.threads = max(1, budget // concurrency)
+
+        # 其他程序占用超过四分之一的核心时视为机器正在使用，降低编码优先级
+        self.low_priority = others_busy >= self.cpu_count / 4
+
+        return (f"自适应：{self.threads} 线程 × {self.concurrency} 任务"
+                f"{'，低优先级' if self.low_priority else ''}")
+
+
+def apply_process_priority(command, low_priority):
+    """需要让出资源时以低 CPU/IO 优先级运行命令，返回 (命令, creationflags)"""
+    creation_flags = subprocess.CREATE_NO_WINDOW if platform.system() == 'Windows' else 0
+    if not low_priority:
+        return command, creation_flags
+    if platform.system() == 'Windows':
+        return command, creation_flags | subprocess.BELOW_NORMAL_PRIORITY_CLASS
+    prefix = []
+    if shutil.which('nice'):
+        prefix += ['nice', '-n', '15']
+    if shutil.which('ionice'):
+        prefix += ['ionice', '-c', '3']  # idle 类：磁盘空闲时才读写
+    return prefix + command, creation_flags
+
+
+class ScratchStager:
+    """把源文件预取到本地暂存目录（本地 SSD 或 tmpfs），编码、SSIM 和复制元数据都在本地进行
+
+    源文件在 NAS 等网络共享上时，ffmpeg 一边读源文件一边把 _comp、_temp 文件写回同一个共享，
+    网络会成为瓶颈。暂存后只有预取和最终结果的一次顺序写回经过网络。
+    """
+    COPY_BUFFER = 16 * 1024 * 1024
+    SPACE_FACTOR = 3  # 源文件、压缩结果、复制元数据的临时文件
+
+    def __init__(self, scratch_dir):
+        self.scratch_dir = scratch_dir
+        self.lock = threading.Lock()
+        self.prefetches = {}  # 源文件路径 -> (复制线程, 结果列表)
+        self.cancelled = False
+
+    def work_dir(self, file_path):
+        key = hashlib.md5(os.path.abspath(file_path).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.scratch_dir, key)
+
+    def local_output_path(self, file_path):
+        name, ext = os.path.splitext(os.path.basename(file_path))
+        return os.path.join(self.work_dir(file_path), name + "_comp" + ext)
+
+    def prefetch(self, file_path):
+        """在后台开始复制源文件，已经开始的不会重复复制"""
+        with self.lock:
+            if file_path in self.prefetches:
+                return
+            result = []
+            thread = threading.Thread(target=self.copy_source, args=(file_path, result), daemon=True)
+            self.prefetches[file_path] = (thread, result)
+            thread.start()
+
+    def copy_source(self, file_path, result):
+        local_path = os.path.join(self.work_dir(file_path), os.path.basename(file_path))
+        try:
+            stat = os.stat(file_path)
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            # 上次中断留下的完整副本直接复用
+            if os.path.exists(local_path):
+                local_stat = os.stat(local_path)
+                if local_stat.st_size == stat.st_size and abs(local_stat.st_mtime - stat.st_mtime) <= 1:
+                    result.append(local_path)
+                    return
+            if shutil.disk_usage(self.scratch_dir).free < stat.st_size * self.SPACE_FACTOR:
+                print(f"暂存目录空间不足，直接处理源文件：{file_path}")
+                result.append(None)
+                return
+            start = time.time()
+            partial_path = local_path + '.part'
+            copy_file_sequential(file_path, partial_path, self.COPY_BUFFER, lambda: self.cancelled)
+            shutil.copystat(file_path, partial_path)
+            os.replace(partial_path, local_path)
+            print(f"已预取到暂存目录：{file_path}（{stat.st_size / 1024 / 1024 / max(time.time() - start, 0.001):.1f}MB/s）")
+            result.append(local_path)
+        except Exception as e:
+            print(f"预取源文件失败，直接处理源文件：{e}")
+            result.append(None)
+
+    def acquire(self, file_path):
+        """等待源文件复制完成，返回本地副本路径，失败时返回 None"""
+        self.prefetch(file_path)
+        thread, result = self.prefetches[file_path]
+        thread.join()
+        return result[0] if result else None
+
+    def local_renditions(self, file_path, renditions):
+        """附加输出在暂存目录中对应的路径，与 renditions 一一对应"""
+        directory = os.path.join(self.work_dir(file_path), 'renditions')
+        return [(kind, height, os.path.join(directory, f"{index}_{os.path.basename(path)}"))
+                for index, (kind, height, path) in enumerate(renditions)]
+
+    def copy_back(self, local_output_path, output_path):
+        """把本地的压缩结果一次顺序写回目标位置，保留文件时间"""
+        start = time.time()
+        partial_path = output_path + '.part'
+        try:
+            copy_file_sequential(local_output_path, partial_path, self.COPY_BUFFER)
+            shutil.copystat(local_output_path, partial_path)
+            os.replace(partial_path, output_path)
+        except BaseException:
+            # 写了一半的文件不能留在共享存储上
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+        print(f"已写回压缩结果：{output_path}（{time.time() - start:.1f}s）")
+
+    def release(self, file_path):
+        """删除文件的本地副本和中间文件"""
+        with self.lock:
+            entry = self.prefetches.pop(file_path, None)
+        if entry:
+            entry[0].join()
+        shutil.rmtree(self.work_dir(file_path), ignore_errors=True)
+
+    def release_all(self):
+        """批处理结束或停止时清理所有副本，正在进行的预取会被中止"""
+        self.cancelled = True
+        for file_path in list(self.prefetches):
+            self.release(file_path)
+
+
+def copy_file_sequential(source_path, target_path, buffer_size, cancelled=None):
+    """用大块缓冲顺序复制文件，网络文件系统上比小块读写快得多；cancelled() 返回 True 时中止"""
+    with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+        while True:
+            if cancelled and cancelled():
+                raise InterruptedError("复制已取消")
+            chunk = source.read(buffer_size)
+            if not chunk:
+                break
+            target.write(chunk)
+
+
+DEDUPE_SAMPLE_SIZE = 64 * 1024        # 抽样哈希时每块的大小
+DEDUPE_SAMPLE_BLOCKS = 8              # 抽样哈希在文件中均匀读取的块数
+DEDUPE_BUFFER_SIZE = 8 * 1024 * 1024  # 完整哈希时的读取缓冲
+
+
+def sampled_hash(file_path, size):
+    """在文件中均匀读取若干块计算哈希，用于快速排除大小相同但内容不同的文件"""
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(file_path, 'rb') as f:
+        for i in range(DEDUPE_SAMPLE_BLOCKS):
+            f.seek(max(0, (size - DEDUPE_SAMPLE_SIZE) * i // max(1, DEDUPE_SAMPLE_BLOCKS - 1)))
+            digest.update(f.read(DEDUPE_SAMPLE_SIZE))
+    return digest.digest()
+
+
+def full_hash(file_path, cancelled=None):
+    """顺序读取整个文件计算哈希；cancelled() 返回 True 时中止"""
+    digest = hashlib.blake2b(digest_size=32)
+    with open(file_path, 'rb') as f:
+        while True:
+            if cancelled and cancelled():
+                raise InterruptedError("哈希计算已取消")
+            chunk = f.read(DEDUPE_BUFFER_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.digest()
+
+
+def find_duplicate_groups(file_paths, cancelled=None, on_hashed=None):
+    """找出内容完全相同的文件，返回 [[路径, ...], ...]，每组至少两个文件
+
+    依次按文件大小、抽样哈希、完整哈希分组，每一步只处理上一步仍有重复的文件；
+    指向同一个 inode 的硬链接不需要读取内容。
+    每算完一个文件的哈希调用 on_hashed(路径, 'sampled' 或 'full')
+    """
+    def regroup(groups, key):
+        result = []
+        for group in groups:
+            buckets = {}
+            for path in group:
+                try:
+                    buckets.setdefault(key(path), []).append(path)
+                except OSError as e:
+                    print(f"读取文件失败，不参与去重：{e}")
+            result.extend(bucket for bucket in buckets.values() if len(bucket) > 1)
+        return result
+
+    stats = {}
+    for path in file_paths:
+        try:
+            stats[path] = os.stat(path)
+        except OSError:
+            continue
+    groups = regroup([list(stats)], lambda path: stats[path].st_size)
+    groups = [group for group in groups if stats[group[0]].st_size > 0]
+
+    def sample_hash(path):
+        value = sampled_hash(path, stats[path].st_size)
+        if on_hashed:
+            on_hashed(path, 'sampled')
+        return value
+
+    groups = regroup(groups, sample_hash)
+
+    hashes = {}
+
+    def content_hash(path):
+        inode = (stats[path].st_dev, stats[path].st_ino)
+        if inode not in hashes:
+            hashes[inode] = full_hash(path, cancelled)
+            if on_hashed:
+                on_hashed(path, 'full')
+        return hashes[inode]
+
+    groups = regroup(groups, content_hash)
+    return [sorted(group) for group in groups]
+
+
+def place_duplicate(result_path, target_path, source_stat, use_hardlink):
+    """把压缩结果放到重复文件对应的位置，保留该文件自己的修改时间和权限
+
+    use_hardlink 时只有修改时间与压缩结果相同才创建硬链接（硬链接共用同一份时间），
+    否则或创建失败（跨分区等）时复制。返回 "hardlink" 或 "copy"。
+    """
+    base, extension = os.path.splitext(target_path)
+    temp_path = f"{base}_temp{extension}"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    method = 'copy'
+    if use_hardlink and os.stat(result_path).st_mtime == source_stat.st_mtime:
+        try:
+            os.link(result_path, temp_path)
+            method = 'hardlink'
+        except OSError as e:
+            print(f"创建硬链接失败，改为复制：{e}")
+    if method == 'copy':
+        copy_file_sequential(result_path, temp_path, DEDUPE_BUFFER_SIZE)
+        os.chmod(temp_path, source_stat.st_mode & 0o7777)
+        os.utime(temp_path, (source_stat.st_atime, source_stat.st_mtime))
+    os.replace(temp_path, target_path)
+    return method
+
+
+# 分布式压缩：主程序作为协调端监听 TCP 端口，其他机器运行 `python VideoCompressTool.py worker`
+# 连接后领取编码任务。消息是每行一个 JSON 对象：
+#   节点 -> 协调端：hello（名称、线程数、共享令牌）、ready（空闲，可以领取任务）、progress（ffmpeg 进度字段）、result（返回码）
+#   协调端 -> 节点：job（输入输出路径、比特率、线程数、是否低优先级）、cancel
+# 节点只负责编码，探测、SSIM、复制属性、替换源文件和写压缩历史仍由协调端完成。
+# 协调端默认只监听本机，接受其他机器的节点时需要改为 0.0.0.0 或局域网地址；节点必须在 hello 中提供相同的令牌
+COORDINATOR_PORT = 8765
+COORDINATOR_HOST = '127.0.0.1'
+PROTOCOL_VERSION = 3  # 2：任务中带有分辨率、帧率上限的滤镜；3：hello 中带有令牌
+HELLO_TIMEOUT = 10          # 连接后多少秒内没有发送完 hello 就断开（总时长，不是每次读取的超时）
+HELLO_MAX_BYTES = 4096      # hello 消息的最大长度
+REMOTE_PROGRESS_TIMEOUT = 60  # 编码中多少秒没有收到节点的消息就认为节点已失联
+
+
+def send_message(sock, lock, message):
+    """发送一条 JSON 消息，多个线程共用一个连接时用 lock 保证消息完整"""
+    data = (json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8')
+    with lock:
+        sock.sendall(data)
+
+
+class RemoteWorker:
+    """协调端上代表一个已连接的远程节点"""
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.name = f"{address[0]}:{address[1]}"
+        self.threads = 1
+        self.send_lock = threading.Lock()
+        self.messages = queue.Queue()  # 当前任务的 progress/result 消息，连接断开时放入 None
+        self.connected = True
+        self.ready = False
+        self.busy = False
+        self.job_id = 0
+
+    def send(self, message):
+        send_message(self.sock, self.send_lock, message)
+
+    def encode(self, input_path, output_path, bitrate, low_priority, on_progress=None, cancelled=None,
+               video_filters=None):
+        """在远程节点上编码，返回值与 run_ffmpeg_processes 相同；连接断开时抛出 ConnectionError"""
+        self.job_id += 1
+        job_id = self.job_id
+        while not self.messages.empty():
+            self.messages.get_nowait()
+        try:
+            self.send({
+                'type': 'job', 'id': job_id,
+                'input': input_path, 'output': output_path,
+                'bitrate': bitrate, 'threads': self.threads, 'low_priority': low_priority,
+                'filters': video_filters or [],
+            })
+        except OSError as e:
+            raise ConnectionError(str(e))
+        
+        states = [{}]
+        cancel_sent = False
+        last_message_time = time.time()
+        while True:
+            if cancelled and cancelled() and not cancel_sent:
+                try:
+                    self.send({'type': 'cancel', 'id': job_id})
+                except OSError as e:
+                    raise ConnectionError(str(e))
+                cancel_sent = True
+            try:
+                message = self.messages.get(timeout=0.5)
+            except queue.Empty:
+                # ffmpeg 每 0.5 秒输出一次进度，长时间没有消息说明节点卡住或网络已断开
+                if time.time() - last_message_time > REMOTE_PROGRESS_TIMEOUT:
+                    self.connected = False
+                    try:
+                        self.sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+                    raise ConnectionError(f"节点 {self.name} 超过 {REMOTE_PROGRESS_TIMEOUT} 秒没有响应")
+                continue
+            last_message_time = time.time()
+            if message is None:
+                raise ConnectionError(f"节点 {self.name} 已断开")
+            if message.get('id') != job_id:
+                continue
+            if message['type'] == 'progress':
+                # 与本机编码一致：字段累积保存，只在已编码时长更新时回调
+                state = message.get('state', {})
+                states[0].update(state)
+                if on_progress and 'out_time_ms' in state:
+                    on_progress(states)
+            elif message['type'] == 'result':
+                stderr = message.get('stderr', '')
+                if cancel_sent:
+                    return None, [stderr]
+                return [message.get('returncode', -1)], [stderr]
+
+
+class JobCoordinator:
+    """监听远程节点的连接，把编码任务分配给空闲的节点"""
+
+    def __init__(self, token, port=COORDINATOR_PORT, host=COORDINATOR_HOST):
+        self.token = token
+        self.host = host
+        self.port = port
+        self.workers = []
+        self.lock = threading.Lock()
+        self.server = None
+
+    def start(self):
+        self.server = socket.create_server((self.host, self.port))
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+        print(f"正在监听远程节点：{self.host or '所有地址'}:{self.port}")
+
+    def stop(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        with self.lock:
+            workers, self.workers = self.workers, []
+        for worker in workers:
+            try:
+                worker.sock.close()
+            except OSError:
+                pass
+
+    def accept_loop(self):
+        server = self.server
+        while True:
+            try:
+                sock, address = server.accept()
+            except OSError:
+                # 监听已关闭
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # 节点所在机器断电或断网时，由 TCP keepalive 发现连接已失效
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            worker = RemoteWorker(sock, address)
+            threading.Thread(target=self.read_loop, args=(worker,), daemon=True).start()
+
+    def read_hello(self, sock):
+        """逐字节读取第一行消息，总共超过 HELLO_TIMEOUT 秒或 HELLO_MAX_BYTES 字节仍没有读完时返回 None
+
+        逐字节读取不会多读走后面的消息，之后的消息仍从 makefile 中按行读取
+        """
+        deadline = time.monotonic() + HELLO_TIMEOUT
+        data = bytearray()
+        while len(data) < HELLO_MAX_BYTES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            sock.settimeout(remaining)
+            byte = sock.recv(1)
+            if not byte:
+                return None
+            if byte == b'\n':
+                sock.settimeout(None)
+                return data.decode('utf-8')
+            data += byte
+        return None
+
+    def read_loop(self, worker):
+        """读取一个节点发来的消息，直到连接断开；第一条消息必须是令牌正确的 hello"""
+        try:
+            try:
+                line = self.read_hello(worker.sock)
+                message = json.loads(line) if line is not None else {}
+            except ValueError:
+                message = {}
+            if message.get('type') != 'hello' or message.get('version') != PROTOCOL_VERSION:
+                print(f"节点 {worker.address} 没有按时发送 hello 或协议版本不一致，已拒绝")
+                return
+            if not hmac.compare_digest(str(message.get('token', '')), self.token):
+                print(f"节点 {worker.address} 的令牌不正确，已拒绝")
+                return
+            try:
+                worker.name = str(message.get('name') or worker.name)
+                worker.threads = max(1, int(message.get('threads') or 1))
+            except (TypeError, ValueError):
+                pass
+            with self.lock:
+                self.workers.append(worker)
+            print(f"远程节点已连接：{worker.name}（{worker.threads} 线程）")
+
+            for line in worker.sock.makefile('r', encoding='utf-8'):
+                try:
+                    message = json.loads(line)
+                    kind = message.get('type')
+                    if kind == 'ready':
+                        worker.ready = True
+                    elif kind in ('progress', 'result'):
+                        worker.messages.put(message)
+                except Exception as e:
+                    # 单条消息格式不对时忽略这一条，不影响连接
+                    print(f"无法处理节点 {worker.name} 的消息：{e}")
+        except OSError:
+            pass
+        finally:
+            worker.connected = False
+            worker.messages.put(None)
+            with self.lock:
+                if worker in self.workers:
+                    self.workers.remove(worker)
+                    print(f"远程节点已断开：{worker.name}")
+            try:
+                worker.sock.close()
+            except OSError:
+                pass
+
+    def acquire(self):
+        """取一个空闲的节点并标记为忙碌，没有时返回 None"""
+        with self.lock:
+            for worker in self.workers:
+                if worker.connected and worker.ready and not worker.busy:
+                    worker.busy = True
+                    worker.ready = False
+                    return worker
+        return None
+
+    def release(self, worker, ready=False):
+        """归还节点；处理过任务的节点会在结束后再发送 ready，没有派出任务时 ready 为 True"""
+        worker.busy = False
+        if ready:
+            worker.ready = True
+
+    def worker_count(self):
+        with self.lock:
+            return len(self.workers)
+
+
+def map_path(path, path_maps):
+    """把协调端的路径换成本机的路径，path_maps 为 [(协调端前缀, 本机前缀), ...]"""
+    for prefix, target in path_maps:
+        if path.startswith(prefix):
+            rest = path[len(prefix):]
+            if os.sep == '/':
+                rest = rest.replace('\\', '/')
+            return target.rstrip('/\\') + rest
+    return path
+
+
+def run_worker(argv):
+    """远程节点入口：连接协调端，循环领取编码任务并在本机运行 ffmpeg"""
+    parser = argparse.ArgumentParser(prog='VideoCompressTool.py worker', description="视频压缩远程节点")
+    parser.add_argument('--host', default='127.0.0.1', help="协调端地址")
+    parser.add_argument('--port', type=int, default=COORDINATOR_PORT, help="协调端端口")
+    parser.add_argument('--token', default=os.environ.get('VCT_WORKER_TOKEN', ''),
+                        help="协调端界面上显示的令牌，也可以用环境变量 VCT_WORKER_TOKEN 提供")
+    parser.add_argument('--threads', type=int, default=multiprocessing.cpu_count(), help="每个任务的编码线程数")
+    parser.add_argument('--name', default=f"{socket.gethostname()}-{os.getpid()}", help="节点名称")
+    parser.add_argument('--path-map', action='append', default=[], metavar='协调端前缀=本机前缀',
+                        help="共享存储在两边挂载位置不同时的路径映射，可重复")
+    args = parser.parse_args(argv)
+    path_maps = [tuple(item.split('=', 1)) for item in args.path_map if '=' in item]
+
+    while True:
+        try:
+            sock = socket.create_connection((args.host, args.port))
+        except OSError as e:
+            print(f"连接协调端失败，5 秒后重试：{e}")
+            time.sleep(5)
+            continue
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        print(f"已连接协调端：{args.host}:{args.port}")
+        try:
+            serve_coordinator(sock, args, path_maps)
+        except (OSError, ValueError) as e:
+            print(f"与协调端的连接中断：{e}")
+        except KeyboardInterrupt:
+            return 0
+        finally:
+            sock.close()
+        time.sleep(1)
+
+
+def serve_coordinator(sock, args, path_maps):
+    """处理一个协调端连接：发送 ready，执行收到的任务，直到连接关闭"""
+    send_lock = threading.Lock()
+    send_message(sock, send_lock, {
+        'type': 'hello', 'version': PROTOCOL_VERSION, 'name': args.name, 'threads': args.threads,
+        'token': args.token
+    })
+    send_message(sock, send_lock, {'type': 'ready'})
+    current = {}  # 任务编号 -> 正在运行的 ffmpeg 进程，收到 cancel 或连接断开时终止
+    try:
+        for line in sock.makefile('r', encoding='utf-8'):
+            message = json.loads(line)
+            if message.get('type') == 'cancel':
+                process = current.get(message.get('id'))
+                if process is not None and process.poll() is None:
+                    process.terminate()
+            elif message.get('type') == 'job':
+                threading.Thread(target=run_worker_job, args=(sock, send_lock, message, path_maps, current),
+                                 daemon=True).start()
+    finally:
+        for process in list(current.values()):
+            if process.poll() is None:
+                process.kill()
+
+
+def run_worker_job(sock, send_lock, job, path_maps, current):
+    """执行一个编码任务，把 ffmpeg 的进度逐块发回协调端，结束后发送结果和 ready"""
+    job_id = job['id']
+    input_path = map_path(job['input'], path_maps)
+    output_path = map_path(job['output'], path_maps)
+    print(f"开始编码：{input_path}")
+    command = build_encode_command(
+        input_path, output_path, job['bitrate'], job['threads'],
+        output_args=['-progress', 'pipe:1', '-nostats'],
+        video_filters=job.get('filters')
+    )
+    command, creation_flags = apply_process_priority(command, job.get('low_priority', False))
+    start = time.time()
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL,
+                                   universal_newlines=True, creationflags=creation_flags, bufsize=1)
+    except OSError as e:
+        send_message(sock, send_lock, {'type': 'result', 'id': job_id, 'returncode': -1, 'stderr': str(e)})
+        send_message(sock, send_lock, {'type': 'ready'})
+        return
+    current[job_id] = process
+    stderr_output = []
+    stderr_reader = threading.Thread(target=lambda: stderr_output.append(process.stderr.read()), daemon=True)
+    stderr_reader.start()
+    state = {}
+    try:
+        for line in process.stdout:
+            key, _, value = line.strip().partition('=')
+            if not value:
+                continue
+            state[key] = value
+            # 每个进度块以 progress=continue/end 结束
+            if key == 'progress':
+                send_message(sock, send_lock, {'type': 'progress', 'id': job_id, 'state': state})
+                state = {}
+        process.wait()
+        stderr_reader.join(timeout=5)
+        print(f"编码结束：{output_path}，返回码 {process.returncode}，耗时 {time.time() - start:.1f}s")
+        send_message(sock, send_lock, {
+            'type': 'result', 'id': job_id, 'returncode': process.returncode, 'stderr': ''.join(stderr_output)
+        })
+        send_message(sock, send_lock, {'type': 'ready'})
+    except OSError as e:
+        # 协调端已断开，结果没有人接收
+        print(f"无法发送编码结果：{e}")
+        if process.poll() is None:
+            process.kill()
+    finally:
+        current.pop(job_id, None)
+
+
+# 校准：每个分辨率档位（短边）使用的合成测试视频尺寸
+CALIBRATION_CLASSES = {720: (1280, 720), 1080: (1920, 1080), 2160: (3840, 2160)}
+CALIBRATION_FPS = 30
+CALIBRATION_JOB_COUNTS = (1, 2, 3, 4, 6, 8, 12, 16)
+
+
+def calibration_combinations(cpu_count):
+    """要测试的 (同时压缩的文件数, 每个文件的线程数)，线程总数不超过 CPU 核心数"""
+    return [(jobs, max(1, cpu_count // jobs)) for jobs in CALIBRATION_JOB_COUNTS if jobs <= cpu_count]
+
+
+def calibrated_config(calibration, short_side):
+    """按校准结果取某个分辨率的 (文件数, 线程数)；没有校准或校准时的核心数与本机不同时返回 None"""
+    if not calibration or calibration.get('cpu_count') != multiprocessing.cpu_count():
+        return None
+    classes = {int(key): value for key, value in calibration.get('classes', {}).items()}
+    if not classes:
+        return None
+    # 取不小于短边的最近档位，超过所有档位时取最大的
+    key = next((limit for limit in sorted(classes) if short_side <= limit), max(classes))
+    return classes[key]['jobs'], classes[key]['threads']
+
+
+def generate_calibration_clip(path, width, height, seconds):
+    """用 lavfi 的 testsrc2 加上随时间变化的噪点生成测试视频，编码难度接近实拍"""
+    command = [
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f"testsrc2=size={width}x{height}:rate={CALIBRATION_FPS}",
+        '-t', str(seconds),
+        '-vf', 'noise=alls=12:allf=t',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '12', '-pix_fmt', 'yuv420p',
+        path
+    ]
+    result = subprocess.run(command, capture_output=True, text=True)
     if result.returncode != 0:
-        print(f"获取视频信息失败：{result.stderr}")
-        return 0, None, None, None
-    
+        raise RuntimeError(f"生成测试视频失败：{result.stderr}")
+
+
+def measure_throughput(clip_path, work_dir, width, height, frames, jobs, threads, quantization_coef):
+    """同时运行 jobs 个编码、每个 threads 线程，返回总的编码帧率"""
+    bitrate = target_bitrate({'width': width, 'height': height, 'frame_rate': CALIBRATION_FPS}, quantization_coef)
+    ext = os.path.splitext(clip_path)[1]
+    processes = []
+    start = time.perf_counter()
+    for index in range(jobs):
+        command = build_encode_command(clip_path, os.path.join(work_dir, f"out_{index}{ext}"), bitrate, threads,
+                                       output_args=['-an'])
+        processes.append(subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE))
+    errors = [process.communicate()[1] for process in processes]
+    elapsed = time.perf_counter() - start
+    if any(process.returncode != 0 for process in processes):
+        raise RuntimeError(f"编码失败：{b''.join(errors).decode('utf-8', 'replace')}")
+    return jobs * frames / elapsed
+
+
+def run_calibration(argv):
+    """校准入口：在本机用合成视频测试各种“文件数 × 线程数”的组合，把每个分辨率档位最快的组合写入设置"""
+    parser = argparse.ArgumentParser(prog='VideoCompressTool.py calibrate', description="测试本机最合适的并发数和线程数")
+    parser.add_argument('--seconds', type=float, default=4, help="每段测试视频的时长（秒）")
+    parser.add_argument('--classes', default=','.join(str(key) for key in CALIBRATION_CLASSES),
+                        help="要测试的分辨率档位（短边），逗号分隔")
+    parser.add_argument('--coef', type=float, default=0.12, help="量化系数")
+    parser.add_argument('--settings', default='settings.json', help="写入结果的设置文件，请先关闭程序界面")
+    args = parser.parse_args(argv)
+    classes = [int(item) for item in args.classes.split(',') if item.strip()]
+    unknown = [item for item in classes if item not in CALIBRATION_CLASSES]
+    if unknown:
+        parser.error(f"不支持的分辨率档位：{unknown}，可选 {list(CALIBRATION_CLASSES)}")
+
+    cpu_count = multiprocessing.cpu_count()
+    frames = int(args.seconds * CALIBRATION_FPS)
+    combinations = calibration_combinations(cpu_count)
+    print(f"CPU 核心数：{cpu_count}，测试组合：{', '.join(f'{jobs}×{threads}' for jobs, threads in combinations)}")
+    work_dir = tempfile.mkdtemp(prefix='vct_calibrate_')
+    results = {}
+    failed = []
     try:
-        data = json.loads(result.stdout)
-        stream = data['streams'][0]
-        width = int(stream['width'])
-        height = int(stream['height'])
-        frame_rate = eval(stream['r_frame_rate'])  # 处理类似 "30000/1001" 的格式
-        duration = float(stream.get('duration', 0))
-        current_bitrate = int(stream.get('bit_rate', 0))
-        
-        # 计算建议比特率
-        bitrate = (width * height * frame_rate * quantization_coef)
-        return bitrate, duration, current_bitrate, frame_rate
-    except Exception as e:
-        print(f"解析视频信息失败：{e}")
-        return 0, None, None, None
+        for short_side in classes:
+            width, height = CALIBRATION_CLASSES[short_side]
+            clip_path = os.path.join(work_dir, f"source_{short_side}.mkv")
+            best = None
+            try:
+                generate_calibration_clip(clip_path, width, height, args.seconds)
+                for jobs, threads in combinations:
+                    fps = measure_throughput(clip_path, work_dir, width, height, frames, jobs, threads, args.coef)
+                    print(f"{short_side}p：{jobs} 个文件 × {threads} 线程，共 {fps:.1f} 帧/秒")
+                    if best is None or fps > best['fps']:
+                        best = {'jobs': jobs, 'threads': threads, 'fps': round(fps, 1)}
+            except RuntimeError as e:
+                # 这个档位的结果不完整，不保存，继续测试其余档位
+                print(f"{short_side}p 校准失败：{e}")
+                failed.append(short_side)
+                continue
+            results[str(short_side)] = best
+            print(f"{short_side}p 最佳：{best['jobs']} 个文件 × {best['threads']} 线程")
+    except KeyboardInterrupt:
+        print("校准已取消，设置未修改")
+        return 1
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if failed:
+        print(f"以下分辨率档位校准失败，保留原有结果：{', '.join(f'{item}p' for item in failed)}")
+    if not results:
+        print("没有成功的校准结果，设置未修改")
+        return 1
+
+    # 不经过 SettingsStore（它的防抖定时器需要 Qt 的事件循环），直接原子地写文件；
+    # 只测试了部分档位时保留其余档位的结果
+    try:
+        with open(args.settings, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        data = {}
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"无法读取设置文件 {args.settings}，校准结果未保存：{e}")
+        return 1
+    previous = data.get('calibration') or {}
+    calibrated = dict(previous.get('classes', {})) if previous.get('cpu_count') == cpu_count else {}
+    calibrated.update(results)
+    data['calibration'] = {
+        'cpu_count': cpu_count,
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'classes': calibrated,
+    }
+    try:
+        write_json_atomic(args.settings, data)
+    except OSError as e:
+        print(f"保存校准结果失败：{e}")
+        return 1
+    print(f"校准结果已保存到 {args.settings}")
+    return 1 if failed else 0
+
+
+class LeaseManager:
+    """多个实例（同一台或多台机器）处理共享存储上的同一批文件时，用文件租约避免重复压缩
+
+    租约是视频旁边的隐藏文件 .<文件名>.vct-lease，用 O_EXCL 创建保证只有一个实例领取成功；
+    持有期间后台线程定期更新它的修改时间（心跳），超过 TTL 没有心跳的租约视为持有者已退出，可以回收。
+    结果最终确定后在旁边写入完成记录 .<文件名>.vct-done，其他实例据此跳过已经处理完的文件。
+    不依赖数据库，文件夹有重叠的实例之间也有效。各机器的时钟偏差需要远小于 TTL。
+    """
+    TTL = 300                 # 租约过期时间（秒）
+    HEARTBEAT_INTERVAL = 60   # 心跳间隔（秒）
+    RETRY_INTERVAL = 30       # 被其他实例占用的文件多久后再尝试领取（秒）
+
+    def __init__(self, on_lost=None):
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{os.urandom(4).hex()}"
+        self.held = {}  # 视频路径 -> 租约路径
+        self.on_lost = on_lost  # 心跳发现租约被其他实例回收时调用 on_lost(视频路径)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.heartbeat_thread = None
+
+    @staticmethod
+    def lease_path(file_path):
+        directory, name = os.path.split(file_path)
+        return os.path.join(directory, f".{name}.vct-lease")
+
+    @staticmethod
+    def done_path(file_path):
+        directory, name = os.path.split(file_path)
+        return os.path.join(directory, f".{name}.vct-done")
+
+    def mark_done(self, file_path):
+        """写入完成记录，记下此时视频文件的大小和修改时间；先写临时文件再改名，不会留下写了一半的记录"""
+        path = self.done_path(file_path)
+        temp_path = f"{path}.{self.owner}.tmp"
+        try:
+            stat = os.stat(file_path)
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'owner': self.owner, 'size': stat.st_size, 'mtime': stat.st_mtime,
+                           'finished': datetime.datetime.now().isoformat()}, f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"写入完成记录失败：{e}")
+
+    def is_done(self, file_path):
+        """有完成记录且视频文件在那之后没有变化（大小和修改时间都相同）"""
+        try:
+            with open(self.done_path(file_path), 'r', encoding='utf-8') as f:
+                record = json.load(f)
+            stat = os.stat(file_path)
+        except (OSError, ValueError):
+            return False
+        return record.get('size') == stat.st_size and record.get('mtime') == stat.st_mtime
+
+    def start(self):
+        self.heartbeat_thread = threading.Thread(target=self.heartbeat_loop, daemon=True)
+        self.heartbeat_thread.start()
+
+    def stop(self):
+        """停止心跳并释放所有租约"""
+        self.stopped.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+        for file_path in list(self.held):
+            self.release(file_path)
+
+    def claim(self, file_path):
+        """领取文件的租约，成功返回 True；其他实例持有未过期的租约时返回 False"""
+        path = self.lease_path(file_path)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self.reclaim_expired(path):
+                    return False
+                continue
+            except OSError as e:
+                print(f"创建租约失败：{e}")
+                return False
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'owner': self.owner, 'host': socket.gethostname(), 'pid': os.getpid(),
+                           'claimed': datetime.datetime.now().isoformat()}, f)
+            with self.lock:
+                self.held[file_path] = path
+            return True
+        return False
+
+    def reclaim_expired(self, path):
+        """删除过期的租约，可以重新领取时返回 True"""
+        try:
+            if time.time() - os.stat(path).st_mtime < self.TTL:
+                return False
+        except FileNotFoundError:
+            return True
+        # 先改名再删除，多个实例同时回收时只有一个能改名成功
+        expired_path = f"{path}.{self.owner}.expired"
+        try:
+            os.rename(path, expired_path)
+        except FileNotFoundError:
+            return True
+        except OSError as e:
+            print(f"回收租约失败：{e}")
+            return False
+        try:
+            if time.time() - os.stat(expired_path).st_mtime < self.TTL:
+                # 检查和改名之间其他实例已经回收并重新领取，把它的租约还回去
+                try:
+                    os.link(expired_path, path)
+                except OSError:
+                    pass
+                return False
+        finally:
+            os.remove(expired_path)
+        print(f"已回收过期的租约：{path}")
+        return True
+
+    def read_owner(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('owner')
+        except (OSError, ValueError):
+            return None
+
+    def is_held(self, file_path):
+        """租约仍由本实例持有（没有过期后被其他实例回收）"""
+        path = self.held.get(file_path)
+        return path is not None and self.read_owner(path) == self.owner
+
+    def release(self, file_path):
+        with self.lock:
+            path = self.held.pop(file_path, None)
+        if path and self.read_owner(path) == self.owner:
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"删除租约失败：{e}")
+
+    def heartbeat_loop(self):
+        while not self.stopped.wait(self.HEARTBEAT_INTERVAL):
+            with self.lock:
+                held = list(self.held.items())
+            for file_path, path in held:
+                if self.read_owner(path) != self.owner:
+                    print(f"租约已被其他实例回收：{file_path}")
+                    with self.lock:
+                        self.held.pop(file_path, None)
+                    if self.on_lost:
+                        self.on_lost(file_path)
+                    continue
+                try:
+                    os.utime(path)
+                except OSError as e:
+                    print(f"更新租约失败：{e}")
 
 
 class VideoCompressThread(QThread):
     progress_signal = pyqtSignal(dict)
     finished_signal = pyqtSignal()
+    throttle_signal = pyqtSignal(str)  # 自适应模式下当前的线程/并发决策
+    job_finished_signal = pyqtSignal(str)  # 一个文件处理结束（无论成功、跳过或失败），用于更新剩余时间
 
-    def __init__(self, folder_path, target_folder, delete_source, quantization_coef, tree_widget):
+    def __init__(self, folder_path, target_folder, delete_source, quantization_coef, tree_widget, files=None):
         super().__init__()
         self.folder_path = folder_path
+        # files 为 None 时从树中收集选中的文件；恢复上次的任务时直接传入队列中的文件
+        self.files = files
+        self.job_queue = JobQueue()
         self.target_folder = target_folder
         self.delete_source = delete_source
         self.quantization_coef = quantization_coef
         self.tree = tree_widget
         self.is_running = True
-        self.current_process = None
+        self.current_processes = []
+        self.process_lock = threading.Lock()
         # 从主窗口获取当前设置的 CPU 核心数
         window = tree_widget.window()
         self.cpu_cores = window.cpu_spin.value() if window else max(1, multiprocessing.cpu_count() // 2)
+        # 目标质量模式：设置了目标SSIM时，先在采样片段上搜索满足目标的最低比特率
+        self.target_ssim = None
+        if window and window.target_quality_cb.isChecked():
+            self.target_ssim = window.target_ssim_spin.value()
+        # 体积预测：压缩前编码几个采样片段推算最终大小，预计节省不足阈值时跳过
+        self.predict_size = window.predict_size_cb.isChecked() if window else False
+        self.min_savings_percent = window.min_savings_percent_spin.value() if window else 10
+        self.min_savings_mb = window.min_savings_mb_spin.value() if window else 0
+        # 长视频分段并行：时长超过阈值时切成若干段同时编码
+        self.segment_parallel = window.segment_parallel_cb.isChecked() if window else False
+        self.segment_min_minutes = window.segment_min_minutes_spin.value() if window else 60
+        self.segment_count = window.segment_count_spin.value() if window else 4
+        # 自适应模式：按系统负载调整后续任务的线程数、并发数和优先级，代替固定的 CPU 核心数
+        self.throttle = AdaptiveThrottle() if window and window.adaptive_cpu_cb.isChecked() else None
+        # 校准结果：按本批文件的分辨率选择同时压缩的文件数和每个文件的线程数
+        self.calibration = None
+        if window and window.calibration_cb.isChecked():
+            self.calibration = window.settings.get('calibration')
+        self.concurrency = 1
+        self.low_priority = False
+        # 本地暂存：源文件在网络共享上时，先复制到本地目录再处理
+        self.stager = None
+        if window and window.scratch_cb.isChecked() and window.scratch_dir:
+            self.stager = ScratchStager(window.scratch_dir)
+        # 重复文件：内容相同的文件只压缩第一个，结果用硬链接或复制放到其余位置
+        self.dedupe = window.dedupe_cb.isChecked() if window else False
+        self.dedupe_hardlink = window.dedupe_hardlink_cb.isChecked() if window else False
+        # 已连接的远程节点
+        self.coordinator = window.coordinator if window else None
+        # 多实例协作：领取文件租约后才处理，其他实例正在处理的文件稍后重试
+        self.leases = LeaseManager(self.on_lease_lost) if window and window.lease_cb.isChecked() else None
+        self.lost_leases = set()    # 租约已被其他实例回收的文件，不再写入它的目标位置
+        self.file_processes = {}    # 文件 -> 正在为它运行的 ffmpeg 进程
+        self.lease_retry = {}  # 被占用的文件 -> 下次尝试领取的时间
+        # 按画面复杂度调整每个文件的量化系数
+        self.content_aware = window.content_aware_cb.isChecked() if window else False
+        # 编码中途按已写入的大小外推，预计体积比例超过阈值时中止
+        self.early_abort_ratio = None
+        if window and window.early_abort_cb.isChecked():
+            self.early_abort_ratio = window.early_abort_spin.value() / 100
+        # 附加输出：压缩时同一次解码生成的代理文件和封面帧
+        self.proxy_heights = window.proxy_heights() if window and window.proxy_cb.isChecked() else []
+        self.proxy_template = (window.proxy_template_edit.text() or PROXY_TEMPLATE) if window else PROXY_TEMPLATE
+        self.poster_template = None
+        if window and window.poster_cb.isChecked():
+            self.poster_template = window.poster_template_edit.text() or POSTER_TEMPLATE
+        # 输出的分辨率（短边）和帧率上限，None 表示不限制
+        self.max_height = window.max_height_combo.currentData() if window else None
+        self.max_fps = window.max_fps_combo.currentData() if window else None
+        # 处理顺序
+        self.schedule_policy = window.schedule_combo.currentData() if window else 'tree'
+        self.duplicates = {}  # 压缩的文件 -> [(重复文件路径, 相对路径), ...]
+        self.results = {}     # 压缩完成的文件 -> 压缩结果所在路径
+        self.pending_files = []
+        # 工作线程不能访问树形控件：创建线程时（界面线程）收集选中的文件和已显示比特率数据的文件
+        self.checked_files = self.collect_checked_files() if files is None else None
+        self.files_with_data = set()
+        iterator = QTreeWidgetItemIterator(tree_widget)
+        while iterator.value():
+            item = iterator.value()
+            if item.childCount() == 0 and item.text(4).strip():  # 原始比特率列有内容
+                self.files_with_data.add(item.data(0, Qt.ItemDataRole.UserRole))
+            iterator += 1
+        # 正在本机编码的文件 -> 实际使用的线程数，自适应模式从系统负载中扣除这部分
+        self.job_threads = {}
 
     def update_quantization_coef(self, new_coef):
         """更新量化系数"""
         self.quantization_coef = new_coef
         print(f"量化系数已更新为：{new_coef}")
 
+    def update_target_ssim(self, new_target):
+        """更新目标SSIM，None 表示关闭目标质量模式"""
+        self.target_ssim = new_target
+        print(f"目标SSIM已更新为：{new_target}")
+
+    @profiled()
+    def run_ffmpeg_processes(self, commands, on_progress=None, file_path=None):
+        """同时运行若干个带 -progress pipe:1 的 ffmpeg 命令并汇总进度
+
+        on_progress 会收到每个进程最新的进度字段（out_time_ms、fps、speed 等）组成的列表，返回 True 时停止所有进程。
+        file_path 为这些进程所属的文件，它的租约丢失时进程被终止。
+        返回 (返回码列表, 错误输出列表)；被停止或进程卡住时返回 (None, 错误输出列表)
+        """
+        processes = []
+        for command in commands:
+            command, creation_flags = apply_process_priority(command, self.low_priority)
+            processes.append(subprocess.Popen(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                stdin=subprocess.DEVNULL,
+                universal_newlines=True,
+                creationflags=creation_flags,
+                bufsize=1
+            ))
+        # 可能有多个文件同时在压缩，进程列表是所有任务共享的
+        with self.process_lock:
+            self.current_processes.extend(processes)
+            if file_path is not None:
+                self.file_processes.setdefault(file_path, []).extend(processes)
+
+        # 每个管道一个读取线程，Windows 下管道不支持 select
+        lines = queue.Queue()
+        stderr_outputs = [''] * len(processes)
+
+        def read_stdout(index, process):
+            for line in process.stdout:
+                lines.put((index, line))
+
+        def read_stderr(index, process):
+            stderr_outputs[index] = process.stderr.read()
+
+        readers = []
+        for index, process in enumerate(processes):
+            for target in (read_stdout, read_stderr):
+                reader = threading.Thread(target=target, args=(index, process), daemon=True)
+                reader.start()
+                readers.append(reader)
+
+        states = [{} for _ in processes]
+        stopped = False
+        last_progress_time = time.time()
+        while any(process.poll() is None for process in processes) or not lines.empty():
+            if not self.is_running or file_path in self.lost_leases:
+                stopped = True
+                break
+            try:
+                index, line = lines.get(timeout=0.1)
+            except queue.Empty:
+                # 检查是否超过60秒没有进度更新
+                if time.time() - last_progress_time > 60:
+                    print("压缩进程可能已经卡住，正在终止...")
+                    stopped = True
+                    break
+                continue
+
+            last_progress_time = time.time()
+            key, _, value = line.strip().partition('=')
+            if not value:
+                continue
+            states[index][key] = value
+            if key == 'out_time_ms' and on_progress and on_progress(states):
+                stopped = True
+                break
+
+        if stopped:
+            for process in processes:
+                if process.poll() is None:
+                    process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        for reader in readers:
+            reader.join(timeout=5)
+        with self.process_lock:
+            for process in processes:
+                self.current_processes.remove(process)
+                if file_path is not None:
+                    self.file_processes[file_path].remove(process)
+
+        if stopped:
+            return None, stderr_outputs
+        return [process.returncode for process in processes], stderr_outputs
+
+    @profiled()
+    def encode_segmented(self, input_video_path, output_video_path, bitrate, duration, threads, on_progress=None,
+                         video_filters=None, file_path=None):
+        """长视频分段并行压缩：按关键帧切分、各段同时编码、最后无损拼接
+
+        返回值与 run_ffmpeg_processes 相同
+        """
+        creation_flags = subprocess.CREATE_NO_WINDOW if platform.system() == 'Windows' else 0
+        # 中间文件放在输出文件旁边，避免把大文件写进系统临时目录
+        work_dir = tempfile.mkdtemp(prefix='.vct_segments_', dir=os.path.dirname(output_video_path))
+        try:
+            # 1. 按关键帧切分视频流（-c copy 时切点落在指定时间之后的第一个关键帧）
+            split_times = ','.join(
+                f"{duration * i / self.segment_count:.3f}" for i in range(1, self.segment_count)
+            )
+            split_command = [
+                'ffmpeg', '-i', input_video_path,
+                '-map', '0:v:0', '-c', 'copy',
+                '-f', 'segment', '-segment_times', split_times, '-reset_timestamps', '1',
+                '-loglevel', 'error', '-y',
+                os.path.join(work_dir, 'source_%03d.mkv')
+            ]
+            result = subprocess.run(split_command, capture_output=True, text=True, creationflags=creation_flags)
+            if result.returncode != 0:
+                return [result.returncode], [result.stderr]
+            source_segments = sorted(
+                os.path.join(work_dir, name) for name in os.listdir(work_dir) if name.startswith('source_')
+            )
+            print(f"已切分为 {len(source_segments)} 段，开始并行压缩")
+
+            # 2. 各段同时编码，CPU 核心数平均分给每一段；音频最后统一处理
+            ext = os.path.splitext(output_video_path)[1]
+            segment_threads = max(1, threads // len(source_segments))
+            encoded_segments = []
+            commands = []
+            for index, source_segment in enumerate(source_segments):
+                encoded_segment = os.path.join(work_dir, f"encoded_{index:03d}{ext}")
+                encoded_segments.append(encoded_segment)
+                commands.append(build_encode_command(
+                    source_segment, encoded_segment, bitrate, segment_threads,
+                    output_args=['-an', '-progress', 'pipe:1', '-nostats'],
+                    video_filters=video_filters
+                ))
+            return_codes, stderr_outputs = self.run_ffmpeg_processes(commands, on_progress, file_path)
+            if return_codes is None or any(code != 0 for code in return_codes):
+                return return_codes, stderr_outputs
+
+            # 3. 用 concat 分离器无损拼接视频，音频从原文件整段编码一次，避免分段处出现间隙；
+            #    音轨和字幕与不分段时相同（见 stream_map_args）
+            list_path = os.path.join(work_dir, 'concat.txt')
+            with open(list_path, 'w', encoding='utf-8') as f:
+                for encoded_segment in encoded_segments:
+                    escaped = encoded_segment.replace("'", "'\\''")
+                    f.write(f"file '{escaped}'\n")
+            concat_command = [
+                'ffmpeg',
+                '-f', 'concat', '-safe', '0', '-i', list_path,
+                '-i', input_video_path,
+                '-map', '0:v', *stream_map_args(output_video_path, 1),
+                '-c:v', 'copy',
+                '-movflags', '+faststart',
+                '-tag:v', 'avc1',
+                '-loglevel', 'error',
+                '-y',
+                output_video_path
+            ]
+            result = subprocess.run(concat_command, capture_output=True, text=True, creationflags=creation_flags)
+            return [result.returncode], [result.stderr]
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    @profiled()
+    def encode_renditions(self, video_path, renditions, info, threads, file_path=None):
+        """从压缩结果单独生成附加输出，返回值与 run_ffmpeg_processes 相同"""
+        for _, _, rendition_path in renditions:
+            os.makedirs(os.path.dirname(rendition_path) or '.', exist_ok=True)
+        command = build_multi_output_command(video_path, None, None, threads, renditions, info)
+        return self.run_ffmpeg_processes([command], file_path=file_path)
+
+    def finish_renditions(self, input_path, renditions):
+        """附加输出与压缩结果一样保留源文件的元数据和修改时间"""
+        for kind, _, rendition_path in renditions:
+            if not os.path.exists(rendition_path):
+                print(f"附加输出不存在：{rendition_path}")
+                continue
+            if kind == 'proxy':
+                self.copy_video_metadata(input_path, rendition_path)
+            else:
+                shutil.copystat(input_path, rendition_path)
+
+    def predict_output_size(self, input_video_path, duration, bitrate, video_filters=None):
+        """按正式压缩的参数编码几个采样片段（含音频），按码率外推整个文件压缩后的大小
+
+        无法预测时返回 None
+        """
+        windows = get_sample_windows(duration, count=4, length=3.0)
+        if not windows:
+            return None
+
+        ext = os.path.splitext(input_video_path)[1]
+        sample_dir = tempfile.mkdtemp(prefix='vct_predict_')
+        try:
+            total_bytes = 0
+            total_seconds = 0.0
+            for index, (start, length) in enumerate(windows):
+                if not self.is_running:
+                    return None
+                clip_path = os.path.join(sample_dir, f"predict_{index}{ext}")
+                if not encode_sample_clip(input_video_path, start, length, bitrate, clip_path,
+                                          self.cpu_cores, include_audio=True, video_filters=video_filters):
+                    return None
+                total_bytes += os.path.getsize(clip_path)
+                total_seconds += length
+            if total_seconds <= 0:
+                return None
+            return int(total_bytes / total_seconds * duration)
+        finally:
+            shutil.rmtree(sample_dir, ignore_errors=True)
+
+    @profiled()
+    def search_bitrate_for_target(self, input_video_path, duration, current_bitrate, estimated_bitrate,
+                                  video_filters=None):
+        """在采样片段上二分搜索满足目标SSIM的最低比特率
+
+        返回找到的比特率；即使最高候选也达不到目标时返回上界，
+        交给后续的“无需压缩”判断处理
+        """
+        windows = get_sample_windows(duration)
+        if not windows:
+            return estimated_bitrate
+
+        # 搜索区间：上界为原比特率（没有则取估算值的两倍），下界为上界的 5%
+        high = current_bitrate if current_bitrate else estimated_bitrate * 2
+        low = high * 0.05
+        ext = os.path.splitext(input_video_path)[1]
+        sample_dir = tempfile.mkdtemp(prefix='vct_samples_')
+        ssim_cache = {}
+
+        def samples_ssim(bitrate):
+            """编码所有采样片段，返回最差片段的SSIM"""
+            bitrate = int(bitrate)
+            if bitrate in ssim_cache:
+                return ssim_cache[bitrate]
+            worst = None
+            for index, (start, length) in enumerate(windows):
+                if not self.is_running:
+                    return None
+                clip_path = os.path.join(sample_dir, f"sample_{bitrate}_{index}{ext}")
+                if not encode_sample_clip(input_video_path, start, length, bitrate, clip_path, self.cpu_cores,
+                                          video_filters=video_filters):
+                    return None
+                ssim = calculate_clip_ssim(input_video_path, start, length, clip_path, video_filters)
+                os.remove(clip_path)
+                if ssim is None:
+                    return None
+                worst = ssim if worst is None else min(worst, ssim)
+            ssim_cache[bitrate] = worst
+            print(f"采样比特率 {bitrate/1024/1024:.2f}Mbps，最差片段SSIM：{worst:.4f}")
+            return worst
+
+        try:
+            best = None
+            # 最多迭代 7 次，或区间收敛到 5% 以内
+            for _ in range(7):
+                if not self.is_running or high / low < 1.05:
+                    break
+                mid = (low + high) / 2
+                ssim = samples_ssim(mid)
+                if ssim is None:
+                    # 采样失败时退回公式估算的比特率
+                    return int(best) if best else estimated_bitrate
+                if ssim >= self.target_ssim:
+                    best = mid
+                    high = mid
+                else:
+                    low = mid
+            return int(best) if best else int(high)
+        finally:
+            shutil.rmtree(sample_dir, ignore_errors=True)
+
     def update_cpu_cores(self, new_cores):
         """更新 CPU 核心数"""
         self.cpu_cores = new_cores
         print(f"CPU 核心数已更新为：{new_cores}")
 
-    def run(self):
-        if not os.path.exists(self.target_folder):
-            os.makedirs(self.target_folder)
-
+    def collect_checked_files(self):
+        """从树形控件中收集选中的视频文件，返回 [(文件路径, 相对路径), ...]"""
         video_extensions = ['.mp4', '.avi', '.mov', '.mkv']
         files_to_process = []
         
@@ -107,99 +2854,440 @@ class VideoCompressThread(QThread):
             if item.parent() is None:  # 只处理顶层项目
                 collect_checked_files(item)
             iterator += 1
+        return files_to_process
+
+    def run(self):
+        if not os.path.exists(self.target_folder):
+            os.makedirs(self.target_folder)
 
-        # 处理收集到的文件
-        for file_path, rel_path in files_to_process:
+        # 恢复上次的任务时直接使用队列中的文件，否则收集树中选中的文件并写入队列
+        if self.files is not None:
+            files_to_process = self.files
+        else:
+            files_to_process = self.checked_files
+            self.job_queue.start_batch(files_to_process)
+
+        if self.dedupe:
+            files_to_process = self.remove_duplicates(files_to_process)
             if not self.is_running:
-                break
+                return
+        files_to_process = self.order_files(files_to_process)
+        if self.calibration and not self.throttle:
+            self.apply_calibration(files_to_process)
 
-            try:
-                # 检查文件是否存在
-                if not os.path.exists(file_path):
-                    print(f"文件不存在：{file_path}")
-                    error_info = {
-                        "file_name": os.path.basename(file_path),
-                        "status": "文件不存在",
-                        "error": True,
-                        "compression_time": datetime.datetime.now().isoformat()
-                    }
-                    window = self.parent()
-                    if window:
-                        window.save_compression_history(file_path, error_info)
-                    self.progress_signal.emit(error_info)
-                    continue
+        # 处理收集到的文件；自适应模式下可能同时处理多个文件
+        # 重复文件的代表压缩失败时，其余文件会被放回这里单独处理
+        self.pending_files = pending_files = list(files_to_process)
+        workers = []
+        self.batch_stopped = False
+        last_sample_time = 0
+        # 连接了远程节点时，空闲的节点也领取任务，不占用本机的并发数
+        remote_workers = []
+        if self.leases:
+            self.leases.start()
+        METRICS.thread = self
+        while pending_files or workers or remote_workers:
+            workers = [worker for worker in workers if worker.is_alive()]
+            remote_workers = [worker for worker in remote_workers if worker.is_alive()]
+            if self.throttle and time.time() - last_sample_time >= 5:
+                self.adjust_throttle()
+                last_sample_time = time.time()
+            if not self.is_running or self.batch_stopped:
+                # 不再启动新任务，等待正在处理的文件结束
+                pending_files = []
+            elif pending_files:
+                remote = self.coordinator.acquire() if self.coordinator else None
+                if remote is not None or len(workers) < self.concurrency:
+                    job = self.next_job(pending_files)
+                    if job is not None:
+                        file_path, rel_path = job
+                        worker = threading.Thread(target=self.run_job, args=(file_path, rel_path, remote), daemon=True)
+                        worker.start()
+                        if remote is not None:
+                            remote_workers.append(worker)
+                        else:
+                            workers.append(worker)
+                            # 当前文件编码时预取接下来的源文件
+                            if self.stager:
+                                for next_path, _ in pending_files[:self.concurrency]:
+                                    self.stager.prefetch(next_path)
+                        continue
+                    if remote is not None:
+                        # 没有可以派出的任务，节点仍然空闲
+                        self.coordinator.release(remote, ready=True)
+            time.sleep(0.2)
 
-                try:
-                    file = os.path.basename(file_path)
-                    input_video_path = file_path
-                    
-                    # 定义输出文件路径，保持原有目录结构
-                    file_name_without_extension = os.path.splitext(file)[0]
-                    file_extension = os.path.splitext(file)[1]
-                    output_video_name = file_name_without_extension + "_comp" + file_extension
-                    
-                    # 创建目标子文件夹（如果不存在）
+        if self.leases:
+            self.leases.stop()
+        if self.stager:
+            self.stager.release_all()
+        if self.batch_stopped:
+            return
+        self.finished_signal.emit()
+
+    def next_job(self, pending_files):
+        """取出下一个要处理的文件；启用租约时跳过其他实例正在处理的文件，都被占用时返回 None"""
+        if self.leases is None:
+            return pending_files.pop(0)
+        now = time.time()
+        for index, (file_path, _) in enumerate(pending_files):
+            if self.lease_retry.get(file_path, 0) > now:
+                continue
+            if self.leases.claim(file_path):
+                self.lease_retry.pop(file_path, None)
+                return pending_files.pop(index)
+            if file_path not in self.lease_retry:
+                self.progress_signal.emit({
+                    "file_name": os.path.basename(file_path),
+                    "file_path": file_path,
+                    "status": "其他实例处理中"
+                })
+            self.lease_retry[file_path] = now + LeaseManager.RETRY_INTERVAL
+        return None
+
+    def run_job(self, file_path, rel_path, remote=None):
+        """在工作线程中处理一个文件；remote 为远程节点时编码在该节点上进行"""
+        try:
+            if self.process_file(file_path, rel_path, remote):
+                if (self.job_queue.get(file_path) or {}).get('state') == JOB_FAILED:
+                    METRICS.job_finished('failed')
+                self.job_finished_signal.emit(file_path)
+                if file_path in self.duplicates:
+                    self.place_duplicates(file_path)
+            else:
+                self.batch_stopped = True
+        finally:
+            METRICS.set_encoder_fps(file_path, None)
+            if self.leases:
+                self.leases.release(file_path)
+            if remote is not None:
+                self.coordinator.release(remote)
+            if self.stager:
+                self.stager.release(file_path)
+            with self.process_lock:
+                self.job_threads.pop(file_path, None)
+                self.file_processes.pop(file_path, None)
+                self.lost_leases.discard(file_path)
+
+    def order_files(self, files_to_process):
+        """按调度策略排列任务；已经编码完、只差收尾的恢复任务总是排在最前面"""
+        if self.schedule_policy == 'tree':
+            return files_to_process
+        start = time.time()
+        predictor = EtaPredictor()
+        window = self.parent()
+        if window:
+            predictor.train(window.load_compression_history())
+        ordered = order_jobs(files_to_process, self.schedule_policy, self.quantization_coef, self.cpu_cores, predictor,
+                             self.max_height, self.max_fps, self.content_aware)
+        resumed = [job for job in ordered
+                   if (self.job_queue.get(job[0]) or {}).get('state') in (JOB_VERIFYING, JOB_FINALIZING)]
+        if resumed:
+            resumed_paths = {file_path for file_path, _ in resumed}
+            ordered = resumed + [job for job in ordered if job[0] not in resumed_paths]
+        print(f"已按“{dict(SCHEDULE_POLICIES)[self.schedule_policy]}”排列 {len(ordered)} 个任务（{time.time() - start:.1f}s）")
+        return ordered
+
+    def remove_duplicates(self, files_to_process):
+        """把内容相同的文件分组，每组只保留第一个文件压缩，其余记在 self.duplicates 中"""
+        start = time.time()
+        rel_paths = dict(files_to_process)
+
+        def on_hashed(path, stage):
+            self.progress_signal.emit({
+                "file_name": os.path.basename(path),
+                "file_path": path,
+                "status": "已检查重复（抽样）" if stage == 'sampled' else "已检查重复（完整哈希）"
+            })
+
+        try:
+            groups = find_duplicate_groups(list(rel_paths), lambda: not self.is_running, on_hashed)
+        except InterruptedError:
+            return []
+        skipped = set()
+        for group in groups:
+            self.duplicates[group[0]] = [(path, rel_paths[path]) for path in group[1:]]
+            skipped.update(group[1:])
+        if groups:
+            print(f"发现 {len(groups)} 组重复文件，{len(skipped)} 个文件不再单独压缩（{time.time() - start:.1f}s）")
+        return [(path, rel_path) for path, rel_path in files_to_process if path not in skipped]
+
+    def remember_skip(self, file_path, progress_data):
+        """重复文件的代表被跳过时记下结果，内容相同的其余文件直接沿用，不再重复探测和采样"""
+        if file_path in self.duplicates:
+            self.results[file_path] = (None, dict(progress_data))
+
+    def place_duplicates(self, file_path):
+        """把压缩结果放到同组其余文件的位置；代表被跳过时其余文件同样跳过，压缩失败时其余文件单独处理"""
+        duplicates = self.duplicates.pop(file_path)
+        result = self.results.pop(file_path, None)
+        if result is None:
+            self.pending_files.extend(duplicates)
+            return
+        result_path, progress_data = result
+        if result_path is None:
+            self.skip_duplicates(file_path, duplicates, progress_data)
+            return
+        for duplicate_path, rel_path in duplicates:
+            if self.leases and not self.leases.claim(duplicate_path):
+                # 其他实例正在处理这个文件，稍后按普通任务重试
+                self.pending_files.append((duplicate_path, rel_path))
+                continue
+            try:
+                source_stat = os.stat(duplicate_path)
+                if self.delete_source:
+                    target_path = duplicate_path
+                else:
+                    name, extension = os.path.splitext(os.path.basename(duplicate_path))
                     target_subfolder = os.path.join(self.target_folder, rel_path) if rel_path != '.' else self.target_folder
-                    if not os.path.exists(target_subfolder):
-                        os.makedirs(target_subfolder)
-                    
-                    output_video_path = os.path.join(target_subfolder, output_video_name)
-                    
-                    # 获取原始文件大小
-                    input_video_size = os.path.getsize(input_video_path)
-                    start_time = time.time()
-                    print(f"正在压缩：{input_video_path}，原文件大小：{input_video_size / 1024 / 1024:.2f}MB")
-                    
-                    # 获取视频信息并更新表格
-                    appropriate_bitrate, duration, current_bitrate, frame_rate = estimate_appropriate_bitrate(input_video_path, self.quantization_coef)
-                    if appropriate_bitrate == 0:
-                        print(f"无法获取视频信息，跳过压缩：{input_video_path}")
+                    os.makedirs(target_subfolder, exist_ok=True)
+                    target_path = os.path.join(target_subfolder, name + "_comp" + extension)
+                method = place_duplicate(result_path, target_path, source_stat, self.dedupe_hardlink)
+                if self.leases:
+                    self.leases.mark_done(duplicate_path)
+                print(f"重复文件：{duplicate_path} 使用 {file_path} 的压缩结果（{'硬链接' if method == 'hardlink' else '复制'}）")
+            except Exception as e:
+                print(f"放置重复文件的压缩结果失败，改为单独压缩：{e}")
+                self.pending_files.append((duplicate_path, rel_path))
+                continue
+            finally:
+                if self.leases:
+                    self.leases.release(duplicate_path)
+            # 没有经过编码，不带各阶段耗时，避免影响速度模型
+            timing_keys = {field for field, _, _ in TIMING_COLUMNS} | {'time_taken'}
+            duplicate_data = {key: value for key, value in progress_data.items() if key not in timing_keys}
+            duplicate_data.update({
+                "file_name": os.path.basename(duplicate_path),
+                "file_path": duplicate_path,
+            })
+            self.job_queue.update(duplicate_path, state=JOB_DONE)
+            METRICS.job_completed(duplicate_data)
+            self.progress_signal.emit(duplicate_data)
+            self.job_finished_signal.emit(duplicate_path)
+
+    def skip_duplicates(self, file_path, duplicates, progress_data):
+        """代表被跳过（无需压缩、预测收益不足或中途中止）：其余文件记为同样的状态和历史"""
+        window = self.parent()
+        for duplicate_path, _ in duplicates:
+            duplicate_data = dict(progress_data)
+            duplicate_data.update({
+                "file_name": os.path.basename(duplicate_path),
+                "file_path": duplicate_path,
+                "compression_time": datetime.datetime.now().isoformat()
+            })
+            print(f"重复文件：{duplicate_path} 与 {file_path} 相同，{progress_data.get('status')}")
+            if window:
+                window.save_compression_history(duplicate_path, duplicate_data)
+            self.job_queue.update(duplicate_path, state=JOB_DONE, predicted_ratio=progress_data.get('predicted_ratio'))
+            METRICS.job_finished('skipped')
+            self.progress_signal.emit(duplicate_data)
+            self.job_finished_signal.emit(duplicate_path)
+
+    def apply_calibration(self, files_to_process):
+        """按校准结果设置并发数和线程数；文件分辨率不一时以编码工作量（像素数 × 帧率 × 时长）最大的档位为准"""
+        workloads = {}
+        for file_path, _ in files_to_process:
+            info = probe_video(file_path)
+            if not info or not info['width'] or not info['height']:
+                continue
+            short_side = min(info['width'], info['height'])
+            config = calibrated_config(self.calibration, short_side)
+            if config is None:
+                return
+            workloads[config] = workloads.get(config, 0) + \
+                info['width'] * info['height'] * (info['frame_rate'] or 0) * (info['duration'] or 0)
+        if not workloads:
+            return
+        self.concurrency, self.cpu_cores = max(workloads, key=workloads.get)
+        print(f"按校准结果：同时压缩 {self.concurrency} 个文件，每个 {self.cpu_cores} 线程")
+
+    def adjust_throttle(self):
+        """按当前系统负载更新后续任务使用的线程数、并发数和优先级"""
+        with self.process_lock:
+            self.throttle.own_threads = sum(self.job_threads.values())
+        status = self.throttle.update()
+        self.cpu_cores = self.throttle.threads
+        self.concurrency = self.throttle.concurrency
+        self.low_priority = self.throttle.low_priority
+        self.throttle_signal.emit(status)
+
+    def on_lease_lost(self, file_path):
+        """心跳发现租约已被其他实例回收：与 stop() 一样终止这个文件正在运行的 ffmpeg 进程"""
+        with self.process_lock:
+            self.lost_leases.add(file_path)
+            processes = list(self.file_processes.get(file_path, []))
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+
+    def lease_lost(self, file_path):
+        """多实例协作时，文件的租约已不再由本实例持有"""
+        return self.leases is not None and (file_path in self.lost_leases or not self.leases.is_held(file_path))
+
+    def abandon_lost_lease(self, file_path, progress_data, work_output_path, output_video_path):
+        """租约丢失后放弃这个文件：其他实例可能正在写同一个目标位置，只清理本地暂存中的结果"""
+        print(f"租约已丢失，放弃处理：{file_path}")
+        if work_output_path != output_video_path and os.path.exists(work_output_path):
+            os.remove(work_output_path)
+        progress_data.update({"status": "租约丢失"})
+        self.job_queue.update(file_path, state=JOB_FAILED)
+        self.progress_signal.emit(progress_data)
+        return True
+
+    def process_file(self, file_path, rel_path, remote=None):
+        """处理单个文件：获取信息、压缩、计算SSIM、复制属性并替换源文件
+
+        队列中记录了任务所处的阶段，恢复的任务会跳过已经完成的阶段。
+        remote 为远程节点时只有编码在节点上进行，节点直接读写共享存储上的文件。
+        返回 False 表示任务被停止，需要结束整个批处理
+        """
+        job = self.job_queue.get(file_path) or {}
+        state = job.get('state', JOB_QUEUED)
+        if state == JOB_DONE:
+            return True
+
+        try:
+            # 检查文件是否存在
+            if not os.path.exists(file_path):
+                print(f"文件不存在：{file_path}")
+                error_info = {
+                    "file_name": os.path.basename(file_path),
+                    "status": "文件不存在",
+                    "error": True,
+                    "compression_time": datetime.datetime.now().isoformat()
+                }
+                window = self.parent()
+                if window:
+                    window.save_compression_history(file_path, error_info)
+                self.progress_signal.emit(error_info)
+                self.job_queue.update(file_path, state=JOB_FAILED)
+                return True
+
+            try:
+                file = os.path.basename(file_path)
+                input_video_path = file_path
+                
+                # 定义输出文件路径，保持原有目录结构
+                file_name_without_extension = os.path.splitext(file)[0]
+                file_extension = os.path.splitext(file)[1]
+                output_video_name = file_name_without_extension + "_comp" + file_extension
+                
+                # 创建目标子文件夹（如果不存在）
+                target_subfolder = os.path.join(self.target_folder, rel_path) if rel_path != '.' else self.target_folder
+                if not os.path.exists(target_subfolder):
+                    os.makedirs(target_subfolder)
+                
+                output_video_path = os.path.join(target_subfolder, output_video_name)
+                if (self.leases and state == JOB_QUEUED and not job.get('output_path')
+                        and self.leases.is_done(file_path)
+                        and (self.delete_source or os.path.exists(output_video_path))):
+                    # 多实例协作时，有完成记录且源文件没有再变化，说明其他实例已经处理完这个文件
+                    print(f"已有完成记录，跳过：{file_path}")
+                    self.progress_signal.emit({
+                        "file_name": file,
+                        "file_path": file_path,
+                        "status": "已由其他实例完成"
+                    })
+                    self.job_queue.update(file_path, state=JOB_DONE)
+                    METRICS.job_finished('skipped')
+                    return True
+                
+                # 本地暂存时，编码、SSIM和复制元数据都使用本地的副本，最后只把结果写回一次
+                work_input_path = input_video_path
+                work_output_path = output_video_path
+                if self.stager and remote is None:
+                    local_input_path = self.stager.acquire(file_path)
+                    if local_input_path:
+                        work_input_path = local_input_path
+                        work_output_path = self.stager.local_output_path(file_path)
+                temp_video_path = f"{os.path.splitext(work_output_path)[0]}_temp{os.path.splitext(work_output_path)[1]}"
+                if state in (JOB_VERIFYING, JOB_FINALIZING) and not os.path.exists(work_output_path):
+                    # 上次的压缩结果已经不在（例如暂存目录在 tmpfs 上），重新压缩
+                    state = JOB_QUEUED
+                
+                # 获取原始文件大小（恢复的任务以入队时记录的大小为准）
+                input_video_size = job.get('original_size') or os.path.getsize(input_video_path)
+                start_time = time.time()
+                print(f"正在压缩：{input_video_path}，原文件大小：{input_video_size / 1024 / 1024:.2f}MB")
+                
+                # 获取视频信息并更新表格
+                stage_start = time.time()
+                appropriate_bitrate, duration, current_bitrate, frame_rate = estimate_appropriate_bitrate(
+                    input_video_path, self.quantization_coef, self.content_aware, self.max_height, self.max_fps
+                )
+                stage_times = {"probe_time": time.time() - stage_start}
+                # 记录源视频参数和线程数，用于按类别学习编码速度
+                video_info = probe_video(input_video_path) or {}
+                encode_features = {key: video_info.get(key) for key in ('width', 'height', 'frame_rate', 'codec')}
+                if self.content_aware and video_info.get('spatial') is not None:
+                    encode_features['complexity_scale'] = complexity_scale((video_info['spatial'], video_info['temporal']))
+                if appropriate_bitrate == 0:
+                    print(f"无法获取视频信息，跳过压缩：{input_video_path}")
+                    self.progress_signal.emit({
+                        "file_name": file,
+                        "status": "获取信息失败",
+                        "error": True
+                    })
+                    self.job_queue.update(file_path, state=JOB_FAILED)
+                    return True
+                # 分辨率、帧率上限：超过时编码加上缩放和降帧率的滤镜
+                output_width, output_height, output_fps, video_filters = output_geometry(
+                    video_info, self.max_height, self.max_fps
+                )
+                if video_filters:
+                    print(f"输出限制为 {output_width}x{output_height} {output_fps:g}fps：{', '.join(video_filters)}")
+                renditions = rendition_outputs(
+                    target_subfolder, file_name_without_extension, self.proxy_heights,
+                    self.proxy_template, self.poster_template
+                )
+                # 暂存时附加输出也先生成在本地暂存目录，与压缩结果一起写回
+                work_renditions = renditions
+                if work_output_path != output_video_path:
+                    work_renditions = self.stager.local_renditions(file_path, renditions)
+
+                predicted_ratio = job.get('predicted_ratio')
+                if state in (JOB_VERIFYING, JOB_FINALIZING):
+                    # 恢复的任务已经编码完成，沿用当时的目标比特率
+                    appropriate_bitrate = job.get('target_bitrate') or appropriate_bitrate
+                else:
+                    # 目标质量模式：在采样片段上搜索满足目标SSIM的最低比特率，代替公式估算值
+                    if self.target_ssim:
                         self.progress_signal.emit({
                             "file_name": file,
-                            "status": "获取信息失败",
-                            "error": True
+                            "file_path": file_path,
+                            "status": "搜索比特率中"
                         })
-                        continue
+                        appropriate_bitrate = self.search_bitrate_for_target(
+                            work_input_path, duration, current_bitrate, appropriate_bitrate, video_filters
+                        )
+                        if not self.is_running:
+                            return False
 
                     # 检查是否需要压缩
                     # 0.95 是比较合适的，但是 0.94 这种压缩后可能比例也就小 1%，不如多算一点
                     if current_bitrate and appropriate_bitrate >= current_bitrate * 0.9:
                         print(f"无需压缩：{file}，新比特率（{appropriate_bitrate/1024/1024:.2f}Mbps）接近或高于原比特率（{current_bitrate/1024/1024:.2f}Mbps）")
                         
-                        # 查找对应的树形项目
-                        item = None
-                        iterator = QTreeWidgetItemIterator(self.tree)
-                        while iterator.value():
-                            if iterator.value().data(0, Qt.ItemDataRole.UserRole) == file_path:
-                                item = iterator.value()
-                                break
-                            iterator += 1
-                        
-                        # 检查是否已有比特率数据
-                        has_existing_data = False
-                        if item and item.text(4).strip():  # 检查原始比特率列是否有内容
-                            has_existing_data = True
-                        
-                        if not has_existing_data:
-                            progress_data = {
-                                "file_name": file,
-                                "file_path": file_path,
-                                "duration": f"{duration:.2f} 秒" if duration and duration != "未知" else "未知",  # 添加"秒"单位
-                                "original_size": input_video_size,
-                                "original_bitrate": current_bitrate / 1024 / 1024 if current_bitrate else 0,
-                                "target_bitrate": appropriate_bitrate / 1024 / 1024,
-                                "status": "无需压缩",
-                                "skip_compression": True,
-                                "compression_time": datetime.datetime.now().isoformat()
-                            }
-                            
+                        skip_info = {
+                            "file_name": file,
+                            "file_path": file_path,
+                            "duration": f"{duration:.2f} 秒" if duration and duration != "未知" else "未知",  # 添加"秒"单位
+                            "original_size": input_video_size,
+                            "original_bitrate": current_bitrate / 1024 / 1024 if current_bitrate else 0,
+                            "target_bitrate": appropriate_bitrate / 1024 / 1024,
+                            "status": "无需压缩",
+                            "skip_compression": True,
+                            "compression_time": datetime.datetime.now().isoformat()
+                        }
+                        # 检查树中是否已有比特率数据
+                        if file_path not in self.files_with_data:
                             # 保存压缩历史
                             window = self.parent()
                             if window:
-                                window.save_compression_history(file_path, progress_data)
+                                window.save_compression_history(file_path, skip_info)
                             
                             # 发送进度信号
-                            self.progress_signal.emit(progress_data)
+                            self.progress_signal.emit(skip_info)
                         else:
                             # 如果已有数据，只更新状态
                             progress_data = {
@@ -210,122 +3298,266 @@ class VideoCompressThread(QThread):
                             }
                             self.progress_signal.emit(progress_data)
                         
-                        continue
+                        self.remember_skip(file_path, skip_info)
+                        self.job_queue.update(file_path, state=JOB_DONE)
+                        METRICS.job_finished('skipped')
+                        return True
 
-                    # 发送开始压缩信号，更新视频信息
-                    progress_data = {
-                        "file_name": file,
-                        "file_path": file_path,  # 添加完整文件路径
-                        "duration": f"{duration:.2f} 秒" if duration and duration != "未知" else "未知",  # 添加"秒"单位
-                        "original_size": input_video_size,
-                        "original_bitrate": current_bitrate / 1024 / 1024 if current_bitrate else 0,
-                        "target_bitrate": appropriate_bitrate / 1024 / 1024,
-                        "status": "正在压缩"
-                    }
-                    self.progress_signal.emit(progress_data)
+                    # 体积预测：采样片段外推的节省量不足阈值时跳过
+                    if self.predict_size and duration:
+                        self.progress_signal.emit({
+                            "file_name": file,
+                            "file_path": file_path,
+                            "status": "预测体积中"
+                        })
+                        predicted_size = self.predict_output_size(
+                            work_input_path, duration, appropriate_bitrate, video_filters
+                        )
+                        if not self.is_running:
+                            return False
+                        if predicted_size:
+                            predicted_ratio = predicted_size / input_video_size
+                            predicted_savings = input_video_size - predicted_size
+                            print(f"预测压缩后大小：{predicted_size / 1024 / 1024:.2f}MB（{predicted_ratio:.1%}）")
+                            if (predicted_savings < self.min_savings_mb * 1024 * 1024
+                                    or predicted_ratio > 1 - self.min_savings_percent / 100):
+                                print(f"预计节省不足，跳过压缩：{file}")
+                                progress_data = {
+                                    "file_name": file,
+                                    "file_path": file_path,
+                                    "duration": f"{duration:.2f} 秒",
+                                    "original_size": input_video_size,
+                                    "original_bitrate": current_bitrate / 1024 / 1024 if current_bitrate else 0,
+                                    "target_bitrate": appropriate_bitrate / 1024 / 1024,
+                                    "predicted_ratio": predicted_ratio,
+                                    "status": "预测收益不足",
+                                    "skip_compression": True,
+                                    "compression_time": datetime.datetime.now().isoformat()
+                                }
+                                window = self.parent()
+                                if window:
+                                    window.save_compression_history(file_path, progress_data)
+                                self.progress_signal.emit(progress_data)
+                                self.remember_skip(file_path, progress_data)
+                                self.job_queue.update(file_path, state=JOB_DONE, predicted_ratio=predicted_ratio)
+                                METRICS.job_finished('skipped')
+                                return True
+
+                # 发送开始压缩信号，更新视频信息
+                progress_data = {
+                    "file_name": file,
+                    "file_path": file_path,  # 添加完整文件路径
+                    "duration": f"{duration:.2f} 秒" if duration and duration != "未知" else "未知",  # 添加"秒"单位
+                    "original_size": input_video_size,
+                    "original_bitrate": current_bitrate / 1024 / 1024 if current_bitrate else 0,
+                    "target_bitrate": appropriate_bitrate / 1024 / 1024,
+                    "status": "正在压缩"
+                }
+                if predicted_ratio is not None:
+                    progress_data["predicted_ratio"] = predicted_ratio
+                if video_filters:
+                    progress_data["target_resolution"] = f"{output_width}x{output_height}@{output_fps:g}"
+                progress_data.update(stage_times)
+                progress_data.update(encode_features)
 
-                    # 直接压缩为目标文件
-                    try:                        
-                        # 添加 -progress pipe:1 参数来输出进度信息
-                        command = [
-                            'ffmpeg', '-i', input_video_path,
-                            '-b:v', str(appropriate_bitrate),
-                            '-movflags', '+faststart',  # 添加 faststart 标志以支持流媒体和快速预览
-                            '-tag:v', 'avc1',  # 使用 avc1 标签代替 H264，提高兼容性
-                            '-progress', 'pipe:1',  # 输出进度到管道
-                            '-nostats',  # 禁用默认统计信息
-                            '-loglevel', 'error',  # 只显示错误信息
-                            '-y',  # 自动覆盖
-                            '-pix_fmt', 'yuv420p',  # 使用更通用的像素格式
-                            '-threads', str(self.cpu_cores),  # 添加线程数参数
-                            output_video_path
-                        ]
-                        creation_flags = subprocess.CREATE_NO_WINDOW if platform.system() == 'Windows' else 0
-                        self.current_process = subprocess.Popen(
-                            command,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            stdin=subprocess.DEVNULL,
-                            universal_newlines=True,
-                            creationflags=creation_flags,
-                            bufsize=1
+                # 直接压缩为目标文件
+                try:
+                    if state in (JOB_VERIFYING, JOB_FINALIZING):
+                        print(f"沿用上次已完成的压缩结果：{work_output_path}")
+                    else:
+                        self.progress_signal.emit(progress_data)
+                        # 先记录输出路径再开始编码，中断后可以精确清理
+                        self.job_queue.update(
+                            file_path, state=JOB_RUNNING,
+                            output_path=work_output_path, temp_path=temp_video_path,
+                            original_size=input_video_size, target_bitrate=appropriate_bitrate,
+                            predicted_ratio=predicted_ratio
                         )
 
-                        # 读取进度信息
-                        last_progress_time = time.time()
-                        while self.current_process.poll() is None and self.is_running:
-                            # 使用select来实现非阻塞读取
-                            if platform.system() != 'Windows':
-                                import select
-                                reads, _, _ = select.select([self.current_process.stdout], [], [], 0.1)
-                                if not reads:
-                                    # 检查是否超过60秒没有进度更新
-                                    if time.time() - last_progress_time > 60:
-                                        print("压缩进程可能已经卡住，正在终止...")
-                                        self.current_process.terminate()
-                                        break
-                                    continue
-                            
-                            line = self.current_process.stdout.readline()
-                            if not line and self.current_process.poll() is not None:
-                                break
-                            
-                            if line:
-                                last_progress_time = time.time()
-                                if 'out_time_ms=' in line:
-                                    try:
-                                        # 处理 'N/A' 的情况
-                                        time_str = line.split('=')[1].strip()
-                                        if time_str != 'N/A':
-                                            time_ms = int(time_str) / 1000000  # 转换为秒
-                                            if duration:
-                                                progress = (time_ms / float(duration)) * 100
-                                                # 更新进度信息
-                                                progress_data.update({
-                                                    "status": f"正在压缩 {progress:.1f}%"
-                                                })
-                                                self.progress_signal.emit(progress_data)
-                                    except (ValueError, IndexError) as e:
-                                        print(f"解析进度信息失败：{e}")
-                                        continue
+                        encoder_samples = []
+                        # 编码中途预计体积比例过高时提前中止
+                        projection = None
+                        if self.early_abort_ratio and duration:
+                            projection = SizeProjection(input_video_size, duration, self.early_abort_ratio)
+
+                        def on_encode_progress(states):
+                            # 多个分段并行时，已编码时长、帧率和速度都是各进程之和
+                            encoded_seconds = sum(parse_progress_seconds(state) for state in states)
+                            fps_values = [parse_progress_rate(state, 'fps') for state in states]
+                            speed_values = [parse_progress_rate(state, 'speed') for state in states]
+                            if any(fps_values) and any(speed_values):
+                                encoder_samples.append((
+                                    sum(value for value in fps_values if value),
+                                    sum(value for value in speed_values if value)
+                                ))
+                                METRICS.set_encoder_fps(file_path, encoder_samples[-1][0])
+                            if duration:
+                                progress = min(encoded_seconds / float(duration) * 100, 100)
+                                # 更新进度信息
+                                progress_data.update({
+                                    "status": f"正在压缩 {progress:.1f}%",
+                                    "progress": progress / 100
+                                })
+                                self.progress_signal.emit(progress_data)
+                            return projection is not None and projection.update(states)
+
+                        # 本次编码实际使用的线程数；自适应模式下之后的调整只影响新任务
+                        threads = self.cpu_cores
+                        progress_data["threads"] = threads
+                        stage_start = time.time()
+                        renditions_done = False
+                        if remote is not None:
+                            progress_data.update({"threads": remote.threads, "worker": remote.name})
+                            try:
+                                return_codes, stderr_outputs = remote.encode(
+                                    work_input_path, work_output_path, appropriate_bitrate, self.low_priority,
+                                    on_encode_progress,
+                                    lambda: (not self.is_running or file_path in self.lost_leases
+                                             or (projection is not None and projection.aborted)),
+                                    video_filters
+                                )
+                            except ConnectionError as e:
+                                print(f"远程节点编码失败，改为本机压缩：{e}")
+                                progress_data["threads"] = threads
+                                progress_data.pop("worker")
+                                remote = None
+                                stage_start = time.time()
+                        if remote is None:
+                            with self.process_lock:
+                                self.job_threads[file_path] = threads
+                            if (self.segment_parallel and duration
+                                    and duration >= self.segment_min_minutes * 60 and self.segment_count > 1):
+                                # 长视频：按关键帧切分后并行编码
+                                return_codes, stderr_outputs = self.encode_segmented(
+                                    work_input_path, work_output_path, appropriate_bitrate, duration, threads,
+                                    on_encode_progress, video_filters, file_path
+                                )
+                            elif work_renditions:
+                                # 同一次解码用 split 滤镜同时输出压缩结果、代理文件和封面帧
+                                for _, _, rendition_path in work_renditions:
+                                    os.makedirs(os.path.dirname(rendition_path) or '.', exist_ok=True)
+                                command = build_multi_output_command(
+                                    work_input_path, work_output_path, appropriate_bitrate, threads,
+                                    work_renditions, video_info,
+                                    output_args=['-progress', 'pipe:1', '-nostats'],
+                                    video_filters=video_filters
+                                )
+                                return_codes, stderr_outputs = self.run_ffmpeg_processes(
+                                    [command], on_encode_progress, file_path
+                                )
+                                renditions_done = True
+                            else:
+                                # 添加 -progress pipe:1 参数来输出进度信息
+                                command = build_encode_command(
+                                    work_input_path, work_output_path, appropriate_bitrate, threads,
+                                    output_args=[
+                                        '-progress', 'pipe:1',  # 输出进度到管道
+                                        '-nostats',  # 禁用默认统计信息
+                                    ],
+                                    video_filters=video_filters
+                                )
+                                return_codes, stderr_outputs = self.run_ffmpeg_processes(
+                                    [command], on_encode_progress, file_path
+                                )
+
+                        if self.lease_lost(file_path):
+                            return self.abandon_lost_lease(file_path, progress_data, work_output_path,
+                                                           output_video_path)
+
+                        if projection is not None and projection.aborted and self.is_running:
+                            print(f"预计压缩后为原文件的 {projection.ratio:.1%}，中止压缩：{file}")
+                            if os.path.exists(work_output_path):
+                                os.remove(work_output_path)
+                            remove_renditions(work_renditions)
+                            progress_data = {
+                                "file_name": file,
+                                "file_path": file_path,
+                                "duration": progress_data.get("duration"),
+                                "original_size": input_video_size,
+                                "original_bitrate": current_bitrate / 1024 / 1024 if current_bitrate else 0,
+                                "target_bitrate": appropriate_bitrate / 1024 / 1024,
+                                "predicted_ratio": projection.ratio,
+                                "status": "收益不足，已中止",
+                                "skip_compression": True,
+                                "compression_time": datetime.datetime.now().isoformat()
+                            }
+                            window = self.parent()
+                            if window:
+                                window.save_compression_history(file_path, progress_data)
+                            self.progress_signal.emit(progress_data)
+                            self.remember_skip(file_path, progress_data)
+                            self.job_queue.update(file_path, state=JOB_DONE, predicted_ratio=projection.ratio)
+                            METRICS.job_finished('skipped')
+                            return True
+
+                        # 远程节点和分段编码不经过 split 滤镜，附加输出从压缩结果单独生成
+                        if (work_renditions and not renditions_done and return_codes is not None
+                                and self.is_running and all(code == 0 for code in return_codes)):
+                            progress_data.update({"status": "生成代理文件中"})
+                            self.progress_signal.emit(progress_data)
+                            return_codes, stderr_outputs = self.encode_renditions(
+                                work_output_path, work_renditions, video_info, threads, file_path
+                            )
 
                         # 检查进程是否正常结束
-                        return_code = self.current_process.poll()
-                        if return_code is None:
-                            self.current_process.terminate()
+                        if return_codes is None or not self.is_running:
                             print("压缩进程被终止")
-                            return
-                        elif return_code != 0:
-                            stderr_output = self.current_process.stderr.read()
-                            print(f"压缩失败，错误码：{return_code}，错误信息：{stderr_output}")
+                            if os.path.exists(work_output_path):
+                                os.remove(work_output_path)
+                            remove_renditions(work_renditions)
+                            self.job_queue.update(file_path, state=JOB_QUEUED)
+                            return False
+                        elif any(code != 0 for code in return_codes):
+                            print(f"压缩失败，错误码：{return_codes}，错误信息：{''.join(stderr_outputs)}")
                             progress_data.update({"status": "压缩失败"})
                             self.progress_signal.emit(progress_data)
-                            return
+                            if os.path.exists(work_output_path):
+                                os.remove(work_output_path)
+                            remove_renditions(work_renditions)
+                            self.job_queue.update(file_path, state=JOB_FAILED)
+                            return True
 
-                        if not self.is_running:
-                            if os.path.exists(output_video_path):
-                                os.remove(output_video_path)
-                            return
-
-                        # 检查压缩结果
-                        if os.path.exists(output_video_path):
-                            output_video_size = os.path.getsize(output_video_path)
-                            end_time = time.time()
-                            
+                        stage_times["encode_time"] = time.time() - stage_start
+                        if encoder_samples:
+                            stage_times["encode_fps"] = sum(sample[0] for sample in encoder_samples) / len(encoder_samples)
+                            stage_times["encode_speed"] = sum(sample[1] for sample in encoder_samples) / len(encoder_samples)
+                        elif duration and stage_times["encode_time"] > 0:
+                            # 没有进度采样时按整体耗时估算
+                            stage_times["encode_speed"] = duration / stage_times["encode_time"]
+                            if frame_rate:
+                                stage_times["encode_fps"] = duration * frame_rate / stage_times["encode_time"]
+                        progress_data.update(stage_times)
+                        self.job_queue.update(file_path, state=JOB_VERIFYING)
+
+                    # 检查压缩结果
+                    if os.path.exists(work_output_path):
+                        output_video_size = os.path.getsize(work_output_path)
+                        end_time = time.time()
+                        
+                        progress_data.update({
+                            "compressed_size": output_video_size,
+                            "compression_ratio": output_video_size / input_video_size,
+                            "time_taken": end_time - start_time
+                        })
+                        
+                        if state == JOB_FINALIZING:
+                            # 上次已经算过SSIM
+                            impact_level = job.get('impact_level') or "未知"
+                        else:
                             # 更新状态为"计算SSIM中"
-                            progress_data.update({
-                                "compressed_size": output_video_size,
-                                "compression_ratio": output_video_size / input_video_size,
-                                "time_taken": end_time - start_time,
-                                "status": "计算SSIM中"
-                            })
+                            progress_data.update({"status": "计算SSIM中"})
                             self.progress_signal.emit(progress_data)
                             
                             # 计算SSIM并获取带数值的影响程度描述
-                            ssim = self.calculate_ssim(input_video_path, output_video_path)
+                            stage_start = time.time()
+                            ssim = self.calculate_ssim(work_input_path, work_output_path, progress_data)
                             impact_level = self.get_impact_level(ssim)
+                            progress_data["ssim_time"] = time.time() - stage_start
 
-                            # 保存压缩信息
+                            # 保存压缩信息之前确认租约仍然有效
+                            if self.lease_lost(file_path):
+                                return self.abandon_lost_lease(file_path, progress_data, work_output_path,
+                                                               output_video_path)
                             window = self.parent()
                             if window:
                                 compression_info = {
@@ -336,127 +3568,190 @@ class VideoCompressThread(QThread):
                                     "target_bitrate": appropriate_bitrate / 1024 / 1024,
                                     "compressed_size": output_video_size,
                                     "compression_ratio": output_video_size / input_video_size,
+                                    "predicted_ratio": predicted_ratio,
                                     "impact_level": impact_level,
                                     "status": "完成",
                                     "compression_time": datetime.datetime.now().isoformat()
                                 }
+                                for column in HISTORY_EXTRA_COLUMNS:
+                                    if column in progress_data:
+                                        compression_info[column] = progress_data[column]
                                 window.save_compression_history(file_path, compression_info)
+                            self.job_queue.update(file_path, state=JOB_FINALIZING, impact_level=impact_level)
+                        
+                        # 更新状态为"复制属性中"
+                        progress_data.update({
+                            "status": "复制属性中"
+                        })
+                        self.progress_signal.emit(progress_data)
+                        
+                        # 复制文件属性
+                        stage_start = time.time()
+                        metadata_copied = self.copy_video_metadata(work_input_path, work_output_path)
+                        self.finish_renditions(work_input_path, work_renditions)
+                        progress_data["metadata_time"] = time.time() - stage_start
+                        # 写回目标位置和替换源文件之前确认租约仍然有效
+                        if self.lease_lost(file_path):
+                            progress_data["impact_level"] = impact_level
+                            return self.abandon_lost_lease(file_path, progress_data, work_output_path,
+                                                           output_video_path)
+                        if work_output_path != output_video_path:
+                            # 暂存目录中的结果顺序写回目标位置，再进行替换
+                            progress_data.update({"status": "写回结果中"})
+                            self.progress_signal.emit(progress_data)
+                            self.stager.copy_back(work_output_path, output_video_path)
+                            # 之后的替换步骤使用写回后的结果，中断恢复时才不会去找暂存目录中的副本
+                            self.job_queue.update(file_path, output_path=output_video_path)
+                            for (_, _, local_path), (_, _, rendition_path) in zip(work_renditions, renditions):
+                                if os.path.exists(local_path):
+                                    os.makedirs(os.path.dirname(rendition_path) or '.', exist_ok=True)
+                                    self.stager.copy_back(local_path, rendition_path)
+                            if self.lease_lost(file_path):
+                                # 写回期间租约丢失：写回的文件可能与其他实例的结果冲突，不再替换源文件
+                                progress_data["impact_level"] = impact_level
+                                return self.abandon_lost_lease(file_path, progress_data, work_output_path,
+                                                               output_video_path)
+                        result_path = output_video_path
+                        if metadata_copied:
+                            # 如果启用了替换源文件选项
+                            if self.delete_source:  # 保持变量名不变，但功能改为替换
+                                stage_start = time.time()
+                                try:
+                                    # 备份原文件（添加.bak后缀）
+                                    backup_path = input_video_path + '.bak'
+                                    self.job_queue.update(file_path, backup_path=backup_path)
+                                    os.rename(input_video_path, backup_path)
+                                    
+                                    # 将压缩后的文件移动到源文件位置
+                                    os.rename(output_video_path, input_video_path)
+                                    
+                                    # 删除备份文件
+                                    os.remove(backup_path)
+                                    
+                                    print(f"已替换源文件：{input_video_path}")
+                                    result_path = input_video_path
+                                except Exception as e:
+                                    result_path = None
+                                    print(f"替换源文件失败：{e}")
+                                    # 如果替换失败，尝试恢复原文件
+                                    try:
+                                        if os.path.exists(backup_path):
+                                            os.rename(backup_path, input_video_path)
+                                    except Exception as e2:
+                                        print(f"恢复原文件失败：{e2}")
+                                progress_data["replace_time"] = time.time() - stage_start
                             
-                            # 更新状态为"复制属性中"
+                            # 更新最终结果
                             progress_data.update({
-                                "status": "复制属性中"
+                                "impact_level": impact_level,
+                                "status": "完成"
                             })
-                            self.progress_signal.emit(progress_data)
-                            
-                            # 复制文件属性
-                            if self.copy_video_metadata(input_video_path, output_video_path):
-                                # 如果启用了替换源文件选项
-                                if self.delete_source:  # 保持变量名不变，但功能改为替换
-                                    try:
-                                        # 备份原文件（添加.bak后缀）
-                                        backup_path = input_video_path + '.bak'
-                                        os.rename(input_video_path, backup_path)
-                                        
-                                        # 将压缩后的文件移动到源文件位置
-                                        os.rename(output_video_path, input_video_path)
-                                        
-                                        # 删除备份文件
-                                        os.remove(backup_path)
-                                        
-                                        print(f"已替换源文件：{input_video_path}")
-                                    except Exception as e:
-                                        print(f"替换源文件失败：{e}")
-                                        # 如果替换失败，尝试恢复原文件
-                                        try:
-                                            if os.path.exists(backup_path):
-                                                os.rename(backup_path, input_video_path)
-                                        except Exception as e2:
-                                            print(f"恢复原文件失败：{e2}")
-                                
-                                # 更新最终结果
-                                progress_data.update({
-                                    "impact_level": impact_level,
-                                    "status": "完成"
-                                })
-                            else:
-                                progress_data.update({
-                                    "impact_level": impact_level,
-                                    "status": "完成(属性复制失败)"
-                                })
-                            self.progress_signal.emit(progress_data)
+                            if file_path in self.duplicates and result_path:
+                                self.results[file_path] = (result_path, dict(progress_data))
                         else:
-                            print(f"压缩失败：{file}")
                             progress_data.update({
-                                "status": "压缩失败",
-                                "impact_level": "未知"
+                                "impact_level": impact_level,
+                                "status": "完成(属性复制失败)"
                             })
-                            self.progress_signal.emit(progress_data)
-
-                    except Exception as e:
-                        print(f"压缩视频失败：{e}")
-                        progress_data.update({"status": "压缩失败"})
+                        progress_data["time_taken"] = time.time() - start_time
+                        if self.leases:
+                            # 结果已经写回并替换完成，其他实例可以据此跳过这个文件
+                            self.leases.mark_done(file_path)
+                        self.job_queue.update(file_path, state=JOB_DONE)
+                        METRICS.job_completed(progress_data)
+                        self.progress_signal.emit(progress_data)
+                    else:
+                        print(f"压缩失败：{file}")
+                        progress_data.update({
+                            "status": "压缩失败",
+                            "impact_level": "未知"
+                        })
+                        self.job_queue.update(file_path, state=JOB_FAILED)
                         self.progress_signal.emit(progress_data)
 
                 except Exception as e:
                     print(f"压缩视频失败：{e}")
-                    error_info = {
-                        "file_name": os.path.basename(file_path),
-                        "status": f"压缩失败：{str(e)}",
-                        "error": True,
-                        "compression_time": datetime.datetime.now().isoformat()
-                    }
-                    window = self.parent()
-                    if window:
-                        window.save_compression_history(file_path, error_info)
-                    self.progress_signal.emit(error_info)
-                    continue
+                    progress_data.update({"status": "压缩失败"})
+                    self.job_queue.update(file_path, state=JOB_FAILED)
+                    self.progress_signal.emit(progress_data)
 
             except Exception as e:
-                print(f"处理文件失败：{e}")
+                print(f"压缩视频失败：{e}")
                 error_info = {
                     "file_name": os.path.basename(file_path),
-                    "status": f"处理失败：{str(e)}",
+                    "status": f"压缩失败：{str(e)}",
                     "error": True,
                     "compression_time": datetime.datetime.now().isoformat()
                 }
-                # 立即保存错误信息
                 window = self.parent()
                 if window:
                     window.save_compression_history(file_path, error_info)
-                else:
-                    print(f"无法保存错误信息：window is None")
-                
+                self.job_queue.update(file_path, state=JOB_FAILED)
                 self.progress_signal.emit(error_info)
-                continue
+                return True
 
-        self.finished_signal.emit()
+        except Exception as e:
+            print(f"处理文件失败：{e}")
+            error_info = {
+                "file_name": os.path.basename(file_path),
+                "status": f"处理失败：{str(e)}",
+                "error": True,
+                "compression_time": datetime.datetime.now().isoformat()
+            }
+            # 立即保存错误信息
+            window = self.parent()
+            if window:
+                window.save_compression_history(file_path, error_info)
+            else:
+                print(f"无法保存错误信息：window is None")
+            
+            self.job_queue.update(file_path, state=JOB_FAILED)
+            self.progress_signal.emit(error_info)
+        return True
 
     def stop(self):
         self.is_running = False
-        # 如果有正在运行的进程，立即终止它
-        if self.current_process:
+        # 如果有正在运行的进程（分段并行时可能有多个），立即终止它们
+        for process in list(self.current_processes):
             try:
                 if platform.system() == 'Windows':
                     import ctypes
                     PROCESS_TERMINATE = 1
-                    handle = ctypes.windll.kernel32.OpenProcess(PROCESS_TERMINATE, False, self.current_process.pid)
+                    handle = ctypes.windll.kernel32.OpenProcess(PROCESS_TERMINATE, False, process.pid)
                     ctypes.windll.kernel32.TerminateProcess(handle, -1)
                     ctypes.windll.kernel32.CloseHandle(handle)
                 else:
                     import signal
-                    os.kill(self.current_process.pid, signal.SIGTERM)
+                    os.kill(process.pid, signal.SIGTERM)
             except Exception as e:
                 print(f"终止进程失败：{e}")
 
-    def calculate_ssim(self, original_path, compressed_path):
-        """计算两个视频的SSIM值"""
+    @profiled()
+    def calculate_ssim(self, original_path, compressed_path, detail=None):
+        """计算两个视频的SSIM值；安装了 NumPy 时逐帧计算，最差的几帧写入 detail['ssim_worst']"""
+        if np is not None:
+            try:
+                result = compute_ssim(original_path, compressed_path)
+            except Exception as e:
+                print(f"NumPy 计算SSIM失败，改用 ffmpeg：{e}")
+                result = None
+            if result:
+                worst = ','.join(f"{timestamp:.2f}:{ssim:.4f}" for timestamp, ssim in result['worst'])
+                print(f"SSIM {result['ssim']:.4f}（{result['frames']} 帧{'，采样片段' if result['early'] else ''}），"
+                      f"最差的帧：{worst}")
+                if detail is not None:
+                    detail['ssim_worst'] = worst
+                return result['ssim']
         try:
+            # 压缩时限制了分辨率或帧率的，先把原视频转换到相同的尺寸和帧率
+            filters = reference_filters(probe_video(original_path), probe_video(compressed_path, use_cache=False))
+            reference = f"[0:v]{','.join(filters)}[ref];[ref]" if filters else '[0:v]'
             # 使用ffmpeg提取一帧进行比较
             command = [
                 'ffmpeg',
                 '-i', original_path,
                 '-i', compressed_path,
-                '-filter_complex', '[0:v][1:v]ssim',
+                '-filter_complex', f'{reference}[1:v]ssim',
                 '-f', 'null',
                 '-'
             ]
@@ -492,6 +3787,7 @@ class VideoCompressThread(QThread):
         else:
             return f"显著 ({ssim_percent})"
 
+    @profiled()
     def copy_video_metadata(self, input_path, output_path):
         """复制视频的所有元数据信息，包括拍摄设备、相机镜头等所有元数据"""
         try:
@@ -538,6 +3834,7 @@ class VideoCompressThread(QThread):
                 '-i', output_path,  # 压缩后的文件
                 '-map', '1:v',  # 使用压缩后的视频流
                 '-map', '1:a?',  # 使用压缩后的音频流（如果存在）
+                '-map', '1:s?',  # 使用压缩后的字幕流（如果存在）
                 '-map_metadata', '0',  # 复制全局元数据
                 '-map_metadata:s', '0',  # 复制流元数据
                 '-c', 'copy'  # 仅复制，不重新编码
@@ -746,6 +4043,7 @@ class VideoCompressThread(QThread):
                     impact_level TEXT,
                     status TEXT,
                     compression_time TEXT)''')
+                ensure_history_columns(cursor)
                 
                 # 检查是否已存在记录
                 cursor.execute('SELECT status FROM compression_history WHERE file_path = ?', (file_path,))
@@ -769,6 +4067,8 @@ class VideoCompressThread(QThread):
                     'status': compression_info.get('status', ''),
                     'compression_time': datetime.datetime.now().isoformat()
                 }
+                for column in HISTORY_EXTRA_COLUMNS:
+                    data[column] = compression_info.get(column)
 
                 # 清理空值和0值
                 data = {k: v for k, v in data.items() if v not in [None, '', 0]}
@@ -806,6 +4106,7 @@ class VideoCompressThread(QThread):
                     impact_level TEXT,
                     status TEXT,
                     compression_time TEXT)''')
+                ensure_history_columns(cursor)
                 
                 cursor.execute('SELECT * FROM compression_history')
                 rows = cursor.fetchall()
@@ -954,6 +4255,406 @@ class VideoInfoWorker(QThread):
             size /= 1024.0
         return f"{size:.2f} PB"
 
+class FileCatalog:
+    """按列存储的文件目录，筛选和排序都在数组上进行，不必遍历树形控件的项目
+
+    每个视频文件一行，行号即文件编号；数值列是 array.array('d')，未知的值为 NaN。
+    安装了 NumPy 时直接在数组上做向量化比较，否则退回纯 Python 实现。
+    scales 列保存画面复杂度对应的量化系数倍数（见 load_complexity_scales），只用于预估节省。
+    """
+    NUMERIC_FIELDS = ('size', 'duration', 'width', 'height', 'fps', 'bitrate', 'ratio')
+    # 筛选条件中可用的字段名
+    FIELD_ALIASES = {
+        'name': 'name', '名称': 'name', '文件名': 'name',
+        'size': 'size', '大小': 'size',
+        'duration': 'duration', '时长': 'duration',
+        'width': 'width', '宽': 'width',
+        'height': 'height', '高': 'height',
+        'fps': 'fps', '帧率': 'fps',
+        'bitrate': 'bitrate', '比特率': 'bitrate',
+        'ratio': 'ratio', '比例': 'ratio',
+        'status': 'status', '状态': 'status',
+    }
+    # 筛选条件中数值的单位换算：大小按 MB，比例按百分比
+    FIELD_SCALES = {'size': 1024 * 1024, 'ratio': 0.01}
+    # 状态“未压缩”包含的状态
+    UNCOMPRESSED_STATUSES = ('', '等待压缩', '停止压缩')
+    # 树形控件的列 -> 排序字段
+    SORT_COLUMNS = {0: 'name', 2: 'duration', 3: 'size', 4: 'bitrate', 7: 'ratio', 9: 'status'}
+    CONDITION_PATTERN = re.compile(r'^(\w+)(>=|<=|!=|=|>|<|~)(.+)$')
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.paths = []
+        self.names = []
+        self.items = []
+        self.ids = {}
+        self.columns = {field: array.array('d') for field in self.NUMERIC_FIELDS}
+        self.scales = array.array('d')
+        self.status = array.array('q')
+        self.status_names = []
+        self.status_codes = {}
+        self.removed = 0
+
+    def __len__(self):
+        return len(self.paths) - self.removed
+
+    def live_ids(self):
+        """未被删除的文件编号"""
+        if not self.removed:
+            return range(len(self.paths))
+        return [file_id for file_id, item in enumerate(self.items) if item is not None]
+
+    def status_code(self, status):
+        """状态字符串只存一份，列中保存编号"""
+        if status.startswith("正在压缩"):
+            status = "正在压缩"
+        code = self.status_codes.get(status)
+        if code is None:
+            code = len(self.status_names)
+            self.status_names.append(status)
+            self.status_codes[status] = code
+        return code
+
+    def add(self, path, item, status='', **values):
+        """添加一个文件，values 为数值列，没有的列记为未知"""
+        file_id = len(self.paths)
+        self.paths.append(path)
+        self.names.append(os.path.basename(path).lower())
+        self.items.append(item)
+        self.ids[path] = file_id
+        for field in self.NUMERIC_FIELDS:
+            value = values.get(field)
+            self.columns[field].append(float(value) if value else math.nan)
+        self.scales.append(math.nan)
+        self.status.append(self.status_code(status or ''))
+        return file_id
+
+    def update(self, path, status=None, **values):
+        file_id = self.ids.get(path)
+        if file_id is None:
+            return
+        for field, value in values.items():
+            if value:
+                self.columns[field][file_id] = float(value)
+        if status is not None:
+            self.status[file_id] = self.status_code(status)
+
+    def remove(self, path):
+        """删除一个文件：编号保留不复用，项目记为 None，数值列记为未知"""
+        file_id = self.ids.pop(path, None)
+        if file_id is None:
+            return
+        self.items[file_id] = None
+        self.names[file_id] = ''
+        for field in self.NUMERIC_FIELDS:
+            self.columns[field][file_id] = math.nan
+        self.scales[file_id] = math.nan
+        self.removed += 1
+
+    def query(self, text):
+        """按筛选条件返回匹配的文件编号列表
+
+        条件之间用空格分隔，全部满足才算匹配，例如 "height>=2160 bitrate>40 status=未压缩"；
+        不带运算符的词按文件名包含匹配。条件无法解析时抛出 ValueError。
+        """
+        conditions = []
+        for token in text.split():
+            match = self.CONDITION_PATTERN.match(token)
+            if not match:
+                conditions.append(('name', '~', token.lower()))
+                continue
+            field_name, operator, value = match.groups()
+            field = self.FIELD_ALIASES.get(field_name.lower())
+            if field is None:
+                raise ValueError(f"未知的字段：{field_name}")
+            if field == 'name':
+                if operator not in ('=', '~', '!='):
+                    raise ValueError(f"文件名只支持 = ~ != ：{token}")
+                conditions.append((field, operator, value.lower()))
+            elif field == 'status':
+                if operator not in ('=', '~', '!='):
+                    raise ValueError(f"状态只支持 = ~ != ：{token}")
+                conditions.append((field, operator, self.matching_status_codes(operator, value)))
+            else:
+                if operator == '~':
+                    raise ValueError(f"数值字段不支持 ~ ：{token}")
+                try:
+                    number = float(value) * self.FIELD_SCALES.get(field, 1)
+                except ValueError:
+                    raise ValueError(f"无法识别的数值：{token}")
+                conditions.append((field, operator, number))
+
+        if np is not None:
+            ids = self.query_numpy(conditions)
+        else:
+            ids = self.query_python(conditions)
+        if self.removed:
+            ids = [file_id for file_id in ids if self.items[file_id] is not None]
+        return ids
+
+    def matching_status_codes(self, operator, value):
+        """状态条件匹配的状态编号集合；!= 按 = 的集合取反"""
+        if operator == '~':
+            return {code for code, name in enumerate(self.status_names) if value in name}
+        if value == '未压缩':
+            return {self.status_codes[name] for name in self.UNCOMPRESSED_STATUSES if name in self.status_codes}
+        return {self.status_codes[value]} if value in self.status_codes else set()
+
+    def query_numpy(self, conditions):
+        count = len(self.paths)
+        mask = np.ones(count, dtype=bool)
+        for field, operator, value in conditions:
+            if field == 'name':
+                if operator == '=':
+                    matched = np.fromiter((name == value for name in self.names), dtype=bool, count=count)
+                else:
+                    matched = np.fromiter((value in name for name in self.names), dtype=bool, count=count)
+                mask &= ~matched if operator == '!=' else matched
+            elif field == 'status':
+                matched = np.isin(np.frombuffer(self.status, dtype=np.int64), list(value))
+                mask &= ~matched if operator == '!=' else matched
+            else:
+                column = np.frombuffer(self.columns[field], dtype=np.float64)
+                with np.errstate(invalid='ignore'):
+                    if operator == '>=':
+                        mask &= column >= value
+                    elif operator == '<=':
+                        mask &= column <= value
+                    elif operator == '>':
+                        mask &= column > value
+                    elif operator == '<':
+                        mask &= column < value
+                    elif operator == '=':
+                        mask &= column == value
+                    else:
+                        mask &= column != value
+        return np.flatnonzero(mask).tolist()
+
+    def query_python(self, conditions):
+        ids = range(len(self.paths))
+        for field, operator, value in conditions:
+            if field == 'name':
+                names = self.names
+                if operator == '=':
+                    ids = [i for i in ids if names[i] == value]
+                elif operator == '~':
+                    ids = [i for i in ids if value in names[i]]
+                else:
+                    ids = [i for i in ids if value not in names[i]]
+            elif field == 'status':
+                status = self.status
+                if operator == '!=':
+                    ids = [i for i in ids if status[i] not in value]
+                else:
+                    ids = [i for i in ids if status[i] in value]
+            else:
+                # NaN 参与任何比较都为 False，与 NumPy 的结果一致（!= 除外，NaN != x 为 True）
+                column = self.columns[field]
+                compare = {
+                    '>=': lambda x: x >= value, '<=': lambda x: x <= value,
+                    '>': lambda x: x > value, '<': lambda x: x < value,
+                    '=': lambda x: x == value, '!=': lambda x: x != value,
+                }[operator]
+                ids = [i for i in ids if compare(column[i])]
+        return list(ids)
+
+    def load_complexity_scales(self):
+        """从探测缓存读取测过的画面复杂度，换算成量化系数的倍数存入 scales 列，没测过的为 NaN
+
+        在文件列表生成或探测信息变化后调用一次，预估节省时不必每次读取数据库
+        """
+        self.scales = array.array('d', [math.nan]) * len(self.paths)
+        for path, complexity in cached_complexities().items():
+            file_id = self.ids.get(path)
+            if file_id is not None:
+                self.scales[file_id] = complexity_scale(complexity)
+
+    def project_savings(self, ids, quantization_coef, max_height=None, max_fps=None, content_aware=False):
+        """按 estimate_appropriate_bitrate 的公式（target_bitrate），预估给定文件在某个量化系数下的压缩结果
+
+        返回 dict：files 参与估算的文件数，unknown 缺少探测信息的文件数，skipped 会被跳过的文件数，
+        original_size 原总大小，projected_size 预计压缩后总大小（字节）。
+        视频以外的部分（音频、容器）按原大小计入。content_aware 时使用 scales 列中的复杂度倍数，没测过的按倍数 1 估算。
+        """
+        if np is not None:
+            return self.project_savings_numpy(ids, quantization_coef, max_height, max_fps, content_aware)
+        
+        columns = self.columns
+        result = {'files': 0, 'unknown': 0, 'skipped': 0, 'original_size': 0.0, 'projected_size': 0.0}
+        for i in ids:
+            width, height, fps = columns['width'][i], columns['height'][i], columns['fps'][i]
+            current = columns['bitrate'][i] * 1024 * 1024
+            duration, size = columns['duration'][i], columns['size'][i]
+            if any(math.isnan(value) for value in (width, height, fps, current, duration, size)):
+                result['unknown'] += 1
+                continue
+            result['files'] += 1
+            result['original_size'] += size
+            info = {'width': width, 'height': height, 'frame_rate': fps}
+            bitrate = target_bitrate(info, quantization_coef, max_height, max_fps)
+            if content_aware and not math.isnan(self.scales[i]):
+                bitrate *= self.scales[i]
+            # 与 process_file 相同：新比特率不低于原比特率的 90% 时不压缩
+            if bitrate >= current * 0.9:
+                result['skipped'] += 1
+                result['projected_size'] += size
+            else:
+                other_size = max(size - current * duration / 8, 0)
+                result['projected_size'] += bitrate * duration / 8 + other_size
+        return result
+
+    def project_savings_numpy(self, ids, quantization_coef, max_height, max_fps, content_aware):
+        """project_savings 的向量化实现，输出尺寸和帧率按 output_geometry 的规则在数组上计算"""
+        ids = np.asarray(ids, dtype=np.int64)
+        columns = {field: np.frombuffer(self.columns[field], dtype=np.float64)[ids] for field in
+                   ('width', 'height', 'fps', 'bitrate', 'duration', 'size')}
+        known = np.ones(len(ids), dtype=bool)
+        for values in columns.values():
+            known &= ~np.isnan(values)
+        width, height, fps, current, duration, size = (
+            columns[field][known] for field in ('width', 'height', 'fps', 'bitrate', 'duration', 'size'))
+        current = current * 1024 * 1024
+        
+        # 帧率上限
+        if max_fps:
+            fps = np.where(fps > max_fps + 0.01, max_fps, fps)
+        # 分辨率上限作用于短边，长边按比例缩放到偶数
+        pixels = width * height
+        if max_height:
+            short_side = np.minimum(width, height)
+            long_side = np.maximum(width, height)
+            over = short_side > max_height
+            scaled_long = np.maximum(2, np.round(long_side * max_height / np.maximum(short_side, 1) / 2) * 2)
+            pixels = np.where(over, scaled_long * max_height, pixels)
+        bitrate = pixels * fps * quantization_coef
+        if content_aware:
+            scales = np.frombuffer(self.scales, dtype=np.float64)[ids[known]]
+            bitrate *= np.where(np.isnan(scales), 1.0, scales)
+        
+        skipped = bitrate >= current * 0.9
+        other_size = np.maximum(size - current * duration / 8, 0)
+        projected = np.where(skipped, size, bitrate * duration / 8 + other_size)
+        return {
+            'files': int(known.sum()),
+            'unknown': int(len(ids) - known.sum()),
+            'skipped': int(skipped.sum()),
+            'original_size': float(size.sum()),
+            'projected_size': float(projected.sum()),
+        }
+
+    def sort_ranks(self, field, descending=False):
+        """返回每个文件在排序结果中的位置（按文件编号索引），未知的值总是排在最后"""
+        count = len(self.paths)
+        if field == 'name':
+            order = sorted(range(count), key=self.names.__getitem__, reverse=descending)
+        elif field == 'status':
+            status_names = self.status_names
+            order = sorted(range(count), key=lambda i: status_names[self.status[i]], reverse=descending)
+        elif np is not None and count:
+            column = np.frombuffer(self.columns[field], dtype=np.float64)
+            order = np.argsort(-column if descending else column, kind='stable').tolist()
+        else:
+            column = self.columns[field]
+            sign = -1 if descending else 1
+            order = sorted(range(count), key=lambda i: (math.isnan(column[i]), sign * column[i] if not math.isnan(column[i]) else 0))
+        ranks = [0] * count
+        for position, file_id in enumerate(order):
+            ranks[file_id] = position
+        return ranks
+
+
+class QueueProbeWorker(QThread):
+    """在后台探测队列中所有文件的时长和参数，分批发送结果用于估算剩余时间"""
+    probed_signal = pyqtSignal(dict)  # 文件路径 -> probe_video 的结果
+    BATCH_SIZE = 20
+
+    def __init__(self, file_paths):
+        super().__init__()
+        self.file_paths = file_paths
+        self.is_running = True
+
+    def run(self):
+        batch = {}
+        for file_path in self.file_paths:
+            if not self.is_running:
+                return
+            info = probe_video(file_path)
+            if info:
+                batch[file_path] = info
+            if len(batch) >= self.BATCH_SIZE:
+                self.probed_signal.emit(batch)
+                batch = {}
+        if batch:
+            self.probed_signal.emit(batch)
+
+    def stop(self):
+        self.is_running = False
+
+
+LIBRARY_SNAPSHOT_FILE = 'library_snapshot.json.gz'
+LIBRARY_SNAPSHOT_VERSION = 1
+
+
+class LibraryRevalidator(QThread):
+    """在后台检查快照中的文件夹是否有变化
+
+    修改时间没变的文件夹不读取内容，只继续检查快照中它的子文件夹；
+    修改时间变了或新出现的文件夹重新列出子文件夹和视频文件。
+    """
+    changed_signal = pyqtSignal(int, dict)  # 文件列表的版本号，文件夹路径 -> (修改时间, [子文件夹和视频文件名])
+
+    def __init__(self, root, dir_mtimes, generation):
+        super().__init__()
+        self.root = root
+        self.dir_mtimes = dict(dir_mtimes)
+        self.generation = generation
+        self.is_running = True
+
+    def run(self):
+        video_extensions = ['.mp4', '.avi', '.mov', '.mkv']
+        known_children = {}
+        for dir_path in self.dir_mtimes:
+            if dir_path != self.root:
+                known_children.setdefault(os.path.dirname(dir_path), []).append(dir_path)
+        
+        changes = {}
+        stack = [self.root]
+        while stack:
+            if not self.is_running:
+                return
+            dir_path = stack.pop()
+            try:
+                mtime = os.stat(dir_path).st_mtime
+            except OSError:
+                # 文件夹已被删除，由上层文件夹的变化处理
+                continue
+            if self.dir_mtimes.get(dir_path) == mtime:
+                stack.extend(known_children.get(dir_path, []))
+                continue
+            try:
+                entries = sorted(os.scandir(dir_path), key=lambda entry: entry.name)
+            except OSError as e:
+                print(f"读取文件夹失败：{e}")
+                continue
+            names = []
+            for entry in entries:
+                if entry.is_dir():
+                    names.append(entry.name)
+                    # 新的子文件夹在添加时整体扫描，这里只继续检查已知的
+                    if entry.path in self.dir_mtimes:
+                        stack.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in video_extensions:
+                    names.append(entry.name)
+            changes[dir_path] = (mtime, names)
+        self.changed_signal.emit(self.generation, changes)
+
+    def stop(self):
+        self.is_running = False
+
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -967,6 +4668,7 @@ class MainWindow(QMainWindow):
         
         # 加载窗口设置
         self.settings_file = "settings.json"
+        self.settings = SettingsStore(self.settings_file)
         self.load_window_settings()
         
         # 主布局
@@ -1001,9 +4703,20 @@ class MainWindow(QMainWindow):
         self.coef_warning = QLabel("")
         self.coef_warning.setStyleSheet("color: red")
         
+        # 修改量化系数时预估选中文件的压缩效果
+        self.coef_projection_label = QLabel("")
+        self.checked_catalog_ids = None
+        
         params_layout.addWidget(coef_label)
         params_layout.addWidget(self.coef_spin)
+        # 按画面复杂度调整：每个文件先抽帧分析细节和运动，结果随探测信息缓存
+        self.content_aware_cb = QCheckBox("按画面复杂度调整")
+        self.content_aware_cb.setToolTip("压缩前在几个片段上低分辨率抽帧分析画面细节和运动，\n静态画面（如屏幕录制）降低量化系数，剧烈运动提高量化系数")
+        self.content_aware_cb.stateChanged.connect(lambda state: self.settings.set('content_aware', bool(state)))
+        self.content_aware_cb.stateChanged.connect(lambda state: self.update_coef_projection(self.coef_spin.value()))
+        params_layout.addWidget(self.content_aware_cb)
         params_layout.addWidget(self.coef_warning)
+        params_layout.addWidget(self.coef_projection_label)
         
         # 添加一些间距
         params_layout.addSpacing(20)
@@ -1018,9 +4731,248 @@ class MainWindow(QMainWindow):
         params_layout.addWidget(cpu_label)
         params_layout.addWidget(self.cpu_spin)
         
+        # 自适应：按系统负载自动调整线程数、并发数和优先级
+        self.adaptive_cpu_cb = QCheckBox("自适应")
+        self.adaptive_cpu_cb.setToolTip("根据系统负载、CPU空闲和可用内存自动调整编码线程数与同时压缩的文件数，\n机器被其他程序使用时以低优先级运行")
+        self.adaptive_cpu_cb.stateChanged.connect(self.on_adaptive_cpu_changed)
+        if not AdaptiveThrottle.is_supported():
+            self.adaptive_cpu_cb.setEnabled(False)
+            self.adaptive_cpu_cb.setToolTip("当前平台无法采样系统负载")
+        params_layout.addWidget(self.adaptive_cpu_cb)
+        # 校准结果：运行 `python VideoCompressTool.py calibrate` 后按分辨率选择并发数和线程数
+        self.calibration_cb = QCheckBox("按校准结果")
+        self.calibration_cb.stateChanged.connect(self.on_calibration_changed)
+        params_layout.addWidget(self.calibration_cb)
+        self.adaptive_status_label = QLabel("")
+        params_layout.addWidget(self.adaptive_status_label)
+        
+        params_layout.addSpacing(20)
+        
+        # 目标质量模式：按目标SSIM在采样片段上搜索比特率
+        self.target_quality_cb = QCheckBox("目标质量 SSIM≥")
+        self.target_quality_cb.stateChanged.connect(self.on_target_quality_changed)
+        self.target_ssim_spin = QDoubleSpinBox()
+        self.target_ssim_spin.setRange(0.900, 0.999)
+        self.target_ssim_spin.setSingleStep(0.005)
+        self.target_ssim_spin.setDecimals(3)
+        self.target_ssim_spin.setValue(0.98)
+        self.target_ssim_spin.setEnabled(False)
+        self.target_ssim_spin.valueChanged.connect(self.on_target_quality_changed)
+        params_layout.addWidget(self.target_quality_cb)
+        params_layout.addWidget(self.target_ssim_spin)
+        
         params_layout.addStretch()  # 添加弹性空间
         layout.addLayout(params_layout)
 
+        # 体积预测设置
+        predict_layout = QHBoxLayout()
+        self.predict_size_cb = QCheckBox("压缩前预测体积，预计节省少于")
+        self.predict_size_cb.stateChanged.connect(self.on_predict_settings_changed)
+        self.min_savings_percent_spin = QSpinBox()
+        self.min_savings_percent_spin.setRange(0, 90)
+        self.min_savings_percent_spin.setSuffix(" %")
+        self.min_savings_percent_spin.setValue(10)
+        self.min_savings_percent_spin.valueChanged.connect(self.on_predict_settings_changed)
+        self.min_savings_mb_spin = QSpinBox()
+        self.min_savings_mb_spin.setRange(0, 100000)
+        self.min_savings_mb_spin.setSuffix(" MB")
+        self.min_savings_mb_spin.setValue(0)
+        self.min_savings_mb_spin.valueChanged.connect(self.on_predict_settings_changed)
+        predict_layout.addWidget(self.predict_size_cb)
+        predict_layout.addWidget(self.min_savings_percent_spin)
+        predict_layout.addWidget(QLabel("或"))
+        predict_layout.addWidget(self.min_savings_mb_spin)
+        predict_layout.addWidget(QLabel("时跳过"))
+        predict_layout.addSpacing(20)
+        # 编码中途按已写入的大小外推最终大小，预计体积比例过高时中止，节省剩余的编码时间
+        self.early_abort_cb = QCheckBox("编码中预计体积超过原文件的")
+        self.early_abort_cb.stateChanged.connect(self.on_early_abort_settings_changed)
+        self.early_abort_spin = QSpinBox()
+        self.early_abort_spin.setRange(50, 100)
+        self.early_abort_spin.setSuffix(" %")
+        self.early_abort_spin.setValue(92)
+        self.early_abort_spin.valueChanged.connect(self.on_early_abort_settings_changed)
+        predict_layout.addWidget(self.early_abort_cb)
+        predict_layout.addWidget(self.early_abort_spin)
+        predict_layout.addWidget(QLabel("时中止"))
+        predict_layout.addStretch()
+        layout.addLayout(predict_layout)
+
+        # 长视频分段并行设置
+        segment_layout = QHBoxLayout()
+        self.segment_parallel_cb = QCheckBox("长视频分段并行：时长超过")
+        self.segment_parallel_cb.stateChanged.connect(self.on_segment_settings_changed)
+        self.segment_min_minutes_spin = QSpinBox()
+        self.segment_min_minutes_spin.setRange(1, 1440)
+        self.segment_min_minutes_spin.setSuffix(" 分钟")
+        self.segment_min_minutes_spin.setValue(60)
+        self.segment_min_minutes_spin.valueChanged.connect(self.on_segment_settings_changed)
+        self.segment_count_spin = QSpinBox()
+        self.segment_count_spin.setRange(2, 64)
+        self.segment_count_spin.setSuffix(" 段")
+        self.segment_count_spin.setValue(4)
+        self.segment_count_spin.valueChanged.connect(self.on_segment_settings_changed)
+        segment_layout.addWidget(self.segment_parallel_cb)
+        segment_layout.addWidget(self.segment_min_minutes_spin)
+        segment_layout.addWidget(QLabel("时切分为"))
+        segment_layout.addWidget(self.segment_count_spin)
+        segment_layout.addWidget(QLabel("同时压缩"))
+        segment_layout.addStretch()
+        layout.addLayout(segment_layout)
+        
+        # 本地暂存：源文件在网络共享上时，先复制到本地目录处理，只把结果写回一次
+        scratch_layout = QHBoxLayout()
+        self.scratch_dir = ''
+        self.scratch_cb = QCheckBox("本地暂存目录：")
+        self.scratch_cb.stateChanged.connect(self.on_scratch_settings_changed)
+        self.scratch_path_label = QLabel("未选择")
+        self.scratch_path_button = QPushButton("选择暂存目录")
+        self.scratch_path_button.clicked.connect(self.select_scratch_folder)
+        scratch_layout.addWidget(self.scratch_cb)
+        scratch_layout.addWidget(self.scratch_path_label)
+        scratch_layout.addWidget(self.scratch_path_button)
+        scratch_layout.addStretch()
+        layout.addLayout(scratch_layout)
+        
+        # 重复文件：内容完全相同的文件只压缩一次
+        dedupe_layout = QHBoxLayout()
+        self.dedupe_cb = QCheckBox("压缩前检测重复文件，内容相同的文件只压缩一次")
+        self.dedupe_cb.stateChanged.connect(self.on_dedupe_settings_changed)
+        self.dedupe_hardlink_cb = QCheckBox("其余位置使用硬链接（修改时间不同时仍复制）")
+        self.dedupe_hardlink_cb.stateChanged.connect(self.on_dedupe_settings_changed)
+        dedupe_layout.addWidget(self.dedupe_cb)
+        dedupe_layout.addWidget(self.dedupe_hardlink_cb)
+        dedupe_layout.addStretch()
+        layout.addLayout(dedupe_layout)
+        
+        # 处理顺序：按探测信息决定先压缩哪些文件
+        schedule_layout = QHBoxLayout()
+        self.schedule_combo = QComboBox()
+        for policy, label in SCHEDULE_POLICIES:
+            self.schedule_combo.addItem(label, policy)
+        self.schedule_combo.currentIndexChanged.connect(self.on_schedule_policy_changed)
+        schedule_layout.addWidget(QLabel("处理顺序："))
+        schedule_layout.addWidget(self.schedule_combo)
+        schedule_layout.addSpacing(20)
+        # 输出上限：超过时编码中缩小分辨率（按短边）、降低帧率，比特率按输出的尺寸和帧率估算
+        self.max_height_combo = QComboBox()
+        for height in MAX_HEIGHT_OPTIONS:
+            self.max_height_combo.addItem(f"{height}p" if height else "不限", height)
+        self.max_height_combo.currentIndexChanged.connect(
+            lambda index: self.settings.set('max_height', self.max_height_combo.itemData(index))
+        )
+        self.max_height_combo.currentIndexChanged.connect(lambda index: self.update_coef_projection(self.coef_spin.value()))
+        self.max_fps_combo = QComboBox()
+        for fps in MAX_FPS_OPTIONS:
+            self.max_fps_combo.addItem(f"{fps}fps" if fps else "不限", fps)
+        self.max_fps_combo.currentIndexChanged.connect(
+            lambda index: self.settings.set('max_fps', self.max_fps_combo.itemData(index))
+        )
+        self.max_fps_combo.currentIndexChanged.connect(lambda index: self.update_coef_projection(self.coef_spin.value()))
+        schedule_layout.addWidget(QLabel("最高分辨率："))
+        schedule_layout.addWidget(self.max_height_combo)
+        schedule_layout.addWidget(QLabel("最高帧率："))
+        schedule_layout.addWidget(self.max_fps_combo)
+        schedule_layout.addStretch()
+        layout.addLayout(schedule_layout)
+        
+        # 附加输出：压缩时同一次解码生成剪辑用的代理文件和封面帧，路径模板可用 {dir} {name} {height}
+        rendition_layout = QHBoxLayout()
+        self.proxy_cb = QCheckBox("同时生成代理文件，短边")
+        self.proxy_cb.stateChanged.connect(self.on_rendition_settings_changed)
+        self.proxy_heights_edit = QLineEdit("480")
+        self.proxy_heights_edit.setPlaceholderText("480,720")
+        self.proxy_heights_edit.setMaximumWidth(80)
+        self.proxy_heights_edit.editingFinished.connect(self.on_rendition_settings_changed)
+        self.proxy_template_edit = QLineEdit(PROXY_TEMPLATE)
+        self.proxy_template_edit.setToolTip("{dir} 压缩结果所在目录，{name} 源文件名（不含扩展名），{height} 代理文件的短边")
+        self.proxy_template_edit.editingFinished.connect(self.on_rendition_settings_changed)
+        self.poster_cb = QCheckBox("封面帧")
+        self.poster_cb.stateChanged.connect(self.on_rendition_settings_changed)
+        self.poster_template_edit = QLineEdit(POSTER_TEMPLATE)
+        self.poster_template_edit.setToolTip("{dir} 压缩结果所在目录，{name} 源文件名（不含扩展名）")
+        self.poster_template_edit.editingFinished.connect(self.on_rendition_settings_changed)
+        rendition_layout.addWidget(self.proxy_cb)
+        rendition_layout.addWidget(self.proxy_heights_edit)
+        rendition_layout.addWidget(self.proxy_template_edit)
+        rendition_layout.addWidget(self.poster_cb)
+        rendition_layout.addWidget(self.poster_template_edit)
+        layout.addLayout(rendition_layout)
+        
+        # 远程节点：其他机器运行 `python VideoCompressTool.py worker --host 本机地址` 后领取编码任务
+        coordinator_layout = QHBoxLayout()
+        self.coordinator = None
+        self.coordinator_cb = QCheckBox("接受远程压缩节点，地址")
+        self.coordinator_cb.stateChanged.connect(self.on_coordinator_settings_changed)
+        self.coordinator_host_edit = QLineEdit(COORDINATOR_HOST)
+        self.coordinator_host_edit.setToolTip("默认只接受本机的节点；接受局域网中其他机器时填写 0.0.0.0 或本机的局域网地址")
+        self.coordinator_host_edit.setMaximumWidth(110)
+        self.coordinator_host_edit.editingFinished.connect(self.on_coordinator_settings_changed)
+        self.coordinator_port_spin = QSpinBox()
+        self.coordinator_port_spin.setRange(1024, 65535)
+        self.coordinator_port_spin.setValue(COORDINATOR_PORT)
+        self.coordinator_port_spin.valueChanged.connect(self.on_coordinator_settings_changed)
+        # 节点连接时必须提供的令牌，第一次启用时随机生成
+        self.coordinator_token_edit = QLineEdit()
+        self.coordinator_token_edit.setPlaceholderText("令牌")
+        self.coordinator_token_edit.setToolTip("节点运行 worker 时用 --token 提供同样的令牌")
+        self.coordinator_token_edit.setMaximumWidth(150)
+        self.coordinator_token_edit.editingFinished.connect(self.on_coordinator_settings_changed)
+        self.coordinator_status_label = QLabel("")
+        self.coordinator_timer = QTimer(self)
+        self.coordinator_timer.timeout.connect(self.update_coordinator_status)
+        coordinator_layout.addWidget(self.coordinator_cb)
+        coordinator_layout.addWidget(self.coordinator_host_edit)
+        coordinator_layout.addWidget(self.coordinator_port_spin)
+        coordinator_layout.addWidget(self.coordinator_token_edit)
+        coordinator_layout.addWidget(self.coordinator_status_label)
+        # 多实例协作：多个程序处理共享存储上重叠的文件夹时，按文件租约分工
+        self.lease_cb = QCheckBox("与其他实例协作（共享存储上的文件租约）")
+        self.lease_cb.stateChanged.connect(lambda state: self.settings.set('leases_enabled', bool(state)))
+        coordinator_layout.addWidget(self.lease_cb)
+        # 指标端点：在本机端口上以 Prometheus 文本格式提供 /metrics
+        self.metrics_server = None
+        self.metrics_cb = QCheckBox("指标端点，端口")
+        self.metrics_cb.stateChanged.connect(self.on_metrics_settings_changed)
+        self.metrics_port_spin = QSpinBox()
+        self.metrics_port_spin.setRange(1024, 65535)
+        self.metrics_port_spin.setValue(METRICS_PORT)
+        self.metrics_port_spin.valueChanged.connect(self.on_metrics_settings_changed)
+        coordinator_layout.addWidget(self.metrics_cb)
+        coordinator_layout.addWidget(self.metrics_port_spin)
+        coordinator_layout.addStretch()
+        layout.addLayout(coordinator_layout)
+        
+        # 筛选栏：在文件目录上按条件筛选，不遍历树形控件
+        filter_layout = QHBoxLayout()
+        self.catalog = FileCatalog()
+        self.folder_items = []
+        self.folder_item_by_path = {}
+        self.dir_mtimes = {}
+        self.library_generation = 0
+        self.library_revalidator = None
+        self.filter_result_ids = None
+        self.catalog_probe_worker = None
+        self.filter_edit = QLineEdit()
+        self.filter_edit.setPlaceholderText("筛选，例如：height>=2160 bitrate>40 status=未压缩（大小单位MB，比例单位%）")
+        self.filter_edit.setClearButtonEnabled(True)
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(200)
+        self.filter_timer.timeout.connect(self.apply_filter)
+        self.filter_edit.textChanged.connect(lambda: self.filter_timer.start())
+        self.filter_result_label = QLabel()
+        self.check_results_button = QPushButton("勾选全部结果")
+        self.check_results_button.clicked.connect(self.check_filter_results)
+        self.probe_unknown_button = QPushButton("探测未知")
+        self.probe_unknown_button.setToolTip("在后台获取还没有分辨率、帧率信息的文件的参数")
+        self.probe_unknown_button.clicked.connect(self.probe_catalog_unknown)
+        filter_layout.addWidget(self.filter_edit, 1)
+        filter_layout.addWidget(self.filter_result_label)
+        filter_layout.addWidget(self.check_results_button)
+        filter_layout.addWidget(self.probe_unknown_button)
+        layout.addLayout(filter_layout)
+
         # 将表格改为树形结构
         self.tree = QTreeWidget()
         self.tree.setHeaderLabels(['文件'])
@@ -1051,6 +5003,11 @@ class MainWindow(QMainWindow):
         # 设置为只读
         self.tree.setEditTriggers(QTreeWidget.EditTrigger.NoEditTriggers)
         self.tree.itemDoubleClicked.connect(self.handle_item_double_click)
+        # 点击列标题时按文件目录中的数值排序
+        self.sort_column = None
+        self.sort_descending = False
+        self.tree.header().setSectionsClickable(True)
+        self.tree.header().sectionClicked.connect(self.sort_by_column)
         layout.addWidget(self.tree)
         
         # 存储缩略图加载线程的引用
@@ -1106,6 +5063,7 @@ class MainWindow(QMainWindow):
         layout.addLayout(button_layout)
 
         # 最后再加载设置
+        self.show_timing_columns = False
         self.load_settings()
 
         self.temp_files = []  # 用于跟踪临时文件
@@ -1123,12 +5081,21 @@ class MainWindow(QMainWindow):
         self.video_info_label = QLabel()
         self.processing_label = QLabel()  # 新增：处理进度标签
         self.selection_info_label = QLabel()
+        self.eta_label = QLabel()  # 队列剩余时间和预计完成时间
         
         # 添加标签到状态栏
         self.statusBar.addWidget(self.video_info_label, 1)  # 设置拉伸因子为1
         self.statusBar.addWidget(self.processing_label, 2)  # 设置拉伸因子为2，使其占据更多空间
+        self.statusBar.addPermanentWidget(self.eta_label)
         self.statusBar.addPermanentWidget(self.selection_info_label)
         
+        # 剩余时间估算
+        self.eta_predictor = None
+        self.eta_worker = None
+        self.eta_probes = {}
+        self.eta_pending = set()
+        self.eta_progress = {}
+        
         # 连接树形控件的选择变化信号
         self.tree.itemSelectionChanged.connect(self.update_status_bar)
         self.tree.itemChanged.connect(self.update_selection_count)
@@ -1139,6 +5106,9 @@ class MainWindow(QMainWindow):
         # 创建菜单栏
         self.create_menus()
 
+        # 界面显示后检查上次未完成的压缩任务
+        QTimer.singleShot(0, self.check_pending_jobs)
+
     def init_methods(self):
         """初始化所有需要的方法"""
         def save_compression_history(self, file_path, compression_info):
@@ -1165,6 +5135,7 @@ class MainWindow(QMainWindow):
                         impact_level TEXT,
                         status TEXT,
                         compression_time TEXT)''')
+                    ensure_history_columns(cursor)
                     
                     # 检查是否已存在记录
                     cursor.execute('SELECT status FROM compression_history WHERE file_path = ?', (file_path,))
@@ -1188,6 +5159,8 @@ class MainWindow(QMainWindow):
                         'status': compression_info.get('status', ''),
                         'compression_time': datetime.datetime.now().isoformat()
                     }
+                    for column in HISTORY_EXTRA_COLUMNS:
+                        data[column] = compression_info.get(column)
 
                     # 清理空值和0值
                     data = {k: v for k, v in data.items() if v not in [None, '', 0]}
@@ -1225,6 +5198,7 @@ class MainWindow(QMainWindow):
                         impact_level TEXT,
                         status TEXT,
                         compression_time TEXT)''')
+                    ensure_history_columns(cursor)
                     
                     cursor.execute('SELECT * FROM compression_history')
                     rows = cursor.fetchall()
@@ -1264,143 +5238,202 @@ class MainWindow(QMainWindow):
 
     def load_settings(self):
         """加载设置"""
-        try:
-            with open(self.settings_file, 'r', encoding='utf-8') as f:
-                settings = json.load(f)
-                self.source_folder = settings.get('last_folder', '')
-                self.coef_spin.setValue(settings.get('quantization_coef', 0.12))
-                self.replace_source_cb.setChecked(settings.get('replace_source', False))
-                self.show_thumbnail_cb.setChecked(settings.get('show_thumbnail', True))
-                # 加载 CPU 核心数设置
-                cpu_cores = settings.get('cpu_cores', max(1, multiprocessing.cpu_count() // 2))
-                self.cpu_spin.setValue(cpu_cores)
-                if self.source_folder:
-                    self.source_path_label.setText(f"源文件夹：{self.source_folder}")
-                    self.update_file_list()
-        except (FileNotFoundError, json.JSONDecodeError):
+        # 复制一份：加载过程中控件的信号会把当前值写回设置
+        settings = dict(self.settings.data)
+        if not settings:
             self.source_folder = ''
             self.coef_spin.setValue(0.12)
+            self.content_aware_cb.setChecked(False)
             self.replace_source_cb.setChecked(False)
             self.show_thumbnail_cb.setChecked(True)
             # 设置默认 CPU 核心数
             self.cpu_spin.setValue(max(1, multiprocessing.cpu_count() // 2))
+            self.adaptive_cpu_cb.setChecked(False)
+            self.update_calibration_option(True)
+            self.show_timing_columns = False
+            self.target_ssim_spin.setValue(0.98)
+            self.target_quality_cb.setChecked(False)
+            self.predict_size_cb.setChecked(False)
+            self.early_abort_cb.setChecked(False)
+            self.segment_parallel_cb.setChecked(False)
+            self.scratch_cb.setChecked(False)
+            self.dedupe_cb.setChecked(False)
+            self.dedupe_hardlink_cb.setChecked(False)
+            self.schedule_combo.setCurrentIndex(0)
+            self.max_height_combo.setCurrentIndex(0)
+            self.max_fps_combo.setCurrentIndex(0)
+            self.proxy_cb.setChecked(False)
+            self.poster_cb.setChecked(False)
+            self.coordinator_cb.setChecked(False)
+            self.lease_cb.setChecked(False)
+            self.metrics_cb.setChecked(False)
+            return
+        self.source_folder = settings.get('last_folder', '')
+        self.coef_spin.setValue(settings.get('quantization_coef', 0.12))
+        self.content_aware_cb.setChecked(settings.get('content_aware', False))
+        self.replace_source_cb.setChecked(settings.get('replace_source', False))
+        self.show_thumbnail_cb.setChecked(settings.get('show_thumbnail', True))
+        # 加载 CPU 核心数设置
+        cpu_cores = settings.get('cpu_cores', max(1, multiprocessing.cpu_count() // 2))
+        self.cpu_spin.setValue(cpu_cores)
+        self.adaptive_cpu_cb.setChecked(settings.get('adaptive_cpu', False) and AdaptiveThrottle.is_supported())
+        self.update_calibration_option(settings.get('use_calibration', True))
+        self.show_timing_columns = settings.get('show_timing_columns', False)
+        # 加载目标质量设置（先设数值再设开关，避免互相覆盖）
+        target_quality = settings.get('target_quality', False)
+        self.target_ssim_spin.setValue(settings.get('target_ssim', 0.98))
+        self.target_quality_cb.setChecked(target_quality)
+        # 加载体积预测设置
+        predict_size = settings.get('predict_size', False)
+        min_savings_mb = settings.get('min_savings_mb', 0)
+        self.min_savings_percent_spin.setValue(settings.get('min_savings_percent', 10))
+        self.min_savings_mb_spin.setValue(min_savings_mb)
+        self.predict_size_cb.setChecked(predict_size)
+        # 加载编码中止设置
+        early_abort = settings.get('early_abort', False)
+        self.early_abort_spin.setValue(settings.get('early_abort_percent', 92))
+        self.early_abort_cb.setChecked(early_abort)
+        # 加载长视频分段并行设置
+        segment_parallel = settings.get('segment_parallel', False)
+        segment_count = settings.get('segment_count', 4)
+        self.segment_min_minutes_spin.setValue(settings.get('segment_min_minutes', 60))
+        self.segment_count_spin.setValue(segment_count)
+        self.segment_parallel_cb.setChecked(segment_parallel)
+        # 加载本地暂存设置
+        scratch_enabled = settings.get('scratch_enabled', False)
+        self.scratch_dir = settings.get('scratch_dir', '')
+        if self.scratch_dir:
+            self.scratch_path_label.setText(self.scratch_dir)
+        self.scratch_cb.setChecked(scratch_enabled)
+        # 加载重复文件设置
+        dedupe_hardlink = settings.get('dedupe_hardlink', False)
+        self.dedupe_cb.setChecked(settings.get('dedupe', False))
+        self.dedupe_hardlink_cb.setChecked(dedupe_hardlink)
+        # 加载处理顺序
+        schedule_index = self.schedule_combo.findData(settings.get('schedule_policy', 'savings_rate'))
+        self.schedule_combo.setCurrentIndex(max(0, schedule_index))
+        # 加载附加输出设置
+        self.proxy_heights_edit.setText(settings.get('proxy_heights', '480'))
+        self.proxy_template_edit.setText(settings.get('proxy_template', PROXY_TEMPLATE))
+        self.poster_template_edit.setText(settings.get('poster_template', POSTER_TEMPLATE))
+        self.proxy_cb.setChecked(settings.get('proxy_enabled', False))
+        self.poster_cb.setChecked(settings.get('poster_enabled', False))
+        # 加载输出上限
+        self.max_height_combo.setCurrentIndex(max(0, self.max_height_combo.findData(settings.get('max_height'))))
+        self.max_fps_combo.setCurrentIndex(max(0, self.max_fps_combo.findData(settings.get('max_fps'))))
+        # 加载远程节点设置
+        coordinator_enabled = settings.get('coordinator_enabled', False)
+        self.coordinator_host_edit.setText(settings.get('coordinator_host', COORDINATOR_HOST))
+        self.coordinator_token_edit.setText(settings.get('coordinator_token', ''))
+        self.coordinator_port_spin.setValue(settings.get('coordinator_port', COORDINATOR_PORT))
+        self.coordinator_cb.setChecked(coordinator_enabled)
+        self.lease_cb.setChecked(settings.get('leases_enabled', False))
+        # 加载指标端点设置
+        metrics_enabled = settings.get('metrics_enabled', False)
+        self.metrics_port_spin.setValue(settings.get('metrics_port', METRICS_PORT))
+        self.metrics_cb.setChecked(metrics_enabled)
+        if self.source_folder:
+            self.source_path_label.setText(f"源文件夹：{self.source_folder}")
+            self.load_library()
 
     def load_window_settings(self):
         """加载窗口设置"""
-        try:
-            with open(self.settings_file, 'r', encoding='utf-8') as f:
-                settings = json.load(f)
-                window_settings = settings.get('window', {})
-                
-                # 获取所有屏幕
-                screens = QApplication.screens()
-                if not screens:
-                    return
-                
-                # 获取主屏幕尺寸
-                primary_screen = QApplication.primaryScreen()
-                screen_geometry = primary_screen.availableGeometry()
-                
-                # 恢复窗口尺寸
-                if 'size' in window_settings:
-                    width = min(window_settings['size']['width'], screen_geometry.width())
-                    height = min(window_settings['size']['height'], screen_geometry.height())
-                    self.resize(width, height)
-                
-                # 恢复窗口位置
-                if 'pos' in window_settings:
-                    x = window_settings['pos']['x']
-                    y = window_settings['pos']['y']
-                    
-                    # 检查位置是否在任何屏幕内
-                    pos_visible = False
-                    for screen in screens:
-                        screen_geo = screen.availableGeometry()
-                        if screen_geo.contains(x, y):
-                            pos_visible = True
-                            break
-                    
-                    # 如果位置有效则使用，否则居中显示
-                    if pos_visible:
-                        self.move(x, y)
-                    else:
-                        self.center_window()
-                else:
-                    self.center_window()
-                
-        except (FileNotFoundError, json.JSONDecodeError):
+        settings = dict(self.settings.data)
+        if not settings:
             self.center_window()
-
-    def center_window(self):
-        """将窗口居中显示"""
-        screen = QApplication.primaryScreen().availableGeometry()
-        size = self.geometry()
-        x = (screen.width() - size.width()) // 2
-        y = (screen.height() - size.height()) // 2
-        self.move(x, y)
-
-    def save_settings(self):
-        """保存所有设置"""
-        try:
-            settings = {}
-            if os.path.exists(self.settings_file):
-                with open(self.settings_file, 'r', encoding='utf-8') as f:
-                    settings = json.load(f)
-            
-            # 保存树形控件的状态
-            tree_state = {
-                'expanded': [],  # 展开的节点路径列表
-                'checked': [],   # 选中的节点路径列表
-                'partially_checked': []  # 部分选中的节点路径列表
-            }
-            
-            def save_item_state(item):
-                item_path = item.data(0, Qt.ItemDataRole.UserRole)
-                if not item_path:
-                    return
-                    
-                # 保存展开状态
-                if item.isExpanded():
-                    tree_state['expanded'].append(item_path)
-                
-                # 保存选中状态
-                check_state = item.checkState(0)
-                if check_state == Qt.CheckState.Checked:
-                    tree_state['checked'].append(item_path)
-                elif check_state == Qt.CheckState.PartiallyChecked:
-                    tree_state['partially_checked'].append(item_path)
-                
-                # 递归处理子项目
-                for i in range(item.childCount()):
-                    save_item_state(item.child(i))
-            
-            # 遍历所有顶层项目
-            for i in range(self.tree.topLevelItemCount()):
-                save_item_state(self.tree.topLevelItem(i))
+            return
+        window_settings = settings.get('window', {})
+        
+        # 获取所有屏幕
+        screens = QApplication.screens()
+        if not screens:
+            return
+        
+        # 获取主屏幕尺寸
+        primary_screen = QApplication.primaryScreen()
+        screen_geometry = primary_screen.availableGeometry()
+        
+        # 恢复窗口尺寸
+        if 'size' in window_settings:
+            width = min(window_settings['size']['width'], screen_geometry.width())
+            height = min(window_settings['size']['height'], screen_geometry.height())
+            self.resize(width, height)
+        
+        # 恢复窗口位置
+        if 'pos' in window_settings:
+            x = window_settings['pos']['x']
+            y = window_settings['pos']['y']
             
-            settings.update({
-                'last_folder': self.source_folder,
-                'quantization_coef': self.coef_spin.value(),
-                'replace_source': self.replace_source_cb.isChecked(),
-                'show_thumbnail': self.show_thumbnail_cb.isChecked(),
-                'tree_state': tree_state,
-                'window': {
-                    'size': {
-                        'width': self.width(),
-                        'height': self.height()
-                    },
-                    'pos': {
-                        'x': self.x(),
-                        'y': self.y()
-                    }
-                },
-                'cpu_cores': self.cpu_spin.value()  # 保存 CPU 核心数设置
-            })
+            # 检查位置是否在任何屏幕内
+            pos_visible = False
+            for screen in screens:
+                screen_geo = screen.availableGeometry()
+                if screen_geo.contains(x, y):
+                    pos_visible = True
+                    break
             
-            with open(self.settings_file, 'w', encoding='utf-8') as f:
-                json.dump(settings, f, ensure_ascii=False, indent=4)
-        except Exception as e:
-            print(f"保存设置失败：{e}")
+            # 如果位置有效则使用，否则居中显示
+            if pos_visible:
+                self.move(x, y)
+            else:
+                self.center_window()
+        else:
+            self.center_window()
+
+    def center_window(self):
+        """将窗口居中显示"""
+        screen = QApplication.primaryScreen().availableGeometry()
+        size = self.geometry()
+        x = (screen.width() - size.width()) // 2
+        y = (screen.height() - size.height()) // 2
+        self.move(x, y)
+
+    def save_settings(self):
+        """把当前界面上的设置写入设置缓存，由缓存延迟写入文件
+
+        树形控件的展开、勾选状态不在这里收集，由 save_tree_state 在退出时单独保存
+        """
+        self.settings.update({
+            'last_folder': self.source_folder,
+            'quantization_coef': self.coef_spin.value(),
+            'content_aware': self.content_aware_cb.isChecked(),
+            'replace_source': self.replace_source_cb.isChecked(),
+            'show_thumbnail': self.show_thumbnail_cb.isChecked(),
+            'window': self.window_geometry_settings(),
+            'cpu_cores': self.cpu_spin.value(),  # 保存 CPU 核心数设置
+            'adaptive_cpu': self.adaptive_cpu_cb.isChecked(),
+            'use_calibration': self.calibration_cb.isChecked(),
+            'show_timing_columns': self.show_timing_action.isChecked() if hasattr(self, 'show_timing_action') else self.show_timing_columns,
+            'target_quality': self.target_quality_cb.isChecked(),
+            'target_ssim': self.target_ssim_spin.value(),
+            'predict_size': self.predict_size_cb.isChecked(),
+            'min_savings_percent': self.min_savings_percent_spin.value(),
+            'min_savings_mb': self.min_savings_mb_spin.value(),
+            'early_abort': self.early_abort_cb.isChecked(),
+            'early_abort_percent': self.early_abort_spin.value(),
+            'segment_parallel': self.segment_parallel_cb.isChecked(),
+            'segment_min_minutes': self.segment_min_minutes_spin.value(),
+            'segment_count': self.segment_count_spin.value(),
+            'scratch_enabled': self.scratch_cb.isChecked(),
+            'scratch_dir': self.scratch_dir,
+            'dedupe': self.dedupe_cb.isChecked(),
+            'dedupe_hardlink': self.dedupe_hardlink_cb.isChecked(),
+            'schedule_policy': self.schedule_combo.currentData(),
+            'max_height': self.max_height_combo.currentData(),
+            'max_fps': self.max_fps_combo.currentData(),
+            'proxy_enabled': self.proxy_cb.isChecked(),
+            'proxy_heights': self.proxy_heights_edit.text(),
+            'proxy_template': self.proxy_template_edit.text(),
+            'poster_enabled': self.poster_cb.isChecked(),
+            'poster_template': self.poster_template_edit.text(),
+            'coordinator_enabled': self.coordinator_cb.isChecked(),
+            'coordinator_port': self.coordinator_port_spin.value(),
+            'coordinator_host': self.coordinator_host_edit.text().strip(),
+            'coordinator_token': self.coordinator_token_edit.text().strip(),
+            'leases_enabled': self.lease_cb.isChecked(),
+            'metrics_enabled': self.metrics_cb.isChecked(),
+            'metrics_port': self.metrics_port_spin.value()
+        })
 
     def save_tree_state(self):
         """单独保存树形控件的状态到tree_state.json"""
@@ -1434,17 +5467,19 @@ class MainWindow(QMainWindow):
                 
                 iterator += 1
             
-            # 保存到单独的文件
-            with open('tree_state.json', 'w', encoding='utf-8') as f:
+            # 保存到单独的文件（先写临时文件再重命名）
+            with open('tree_state.json.tmp', 'w', encoding='utf-8') as f:
                 json.dump(tree_state, f, ensure_ascii=False, indent=4)
-                print(f"保存树形控件状态：展开 {len(tree_state['expanded'])} 项，"
-                      f"选中 {len(tree_state['checked'])} 项，"
-                      f"部分选中 {len(tree_state['partially_checked'])} 项，"
-                      f"滚动位置 {tree_state['scroll_position']}")
+            os.replace('tree_state.json.tmp', 'tree_state.json')
+            print(f"保存树形控件状态：展开 {len(tree_state['expanded'])} 项，"
+                  f"选中 {len(tree_state['checked'])} 项，"
+                  f"部分选中 {len(tree_state['partially_checked'])} 项，"
+                  f"滚动位置 {tree_state['scroll_position']}")
             
         except Exception as e:
             print(f"保存树形控件状态失败：{e}")
 
+    @profiled()
     def restore_tree_state(self):
         """从tree_state.json恢复树形控件的状态"""
         try:
@@ -1524,12 +5559,10 @@ class MainWindow(QMainWindow):
             self.save_settings()  # 保存选择的文件夹路径
             self.update_file_list()
 
-    def update_file_list(self):
-        video_extensions = ['.mp4', '.avi', '.mov', '.mkv']
-        
-        # 在更新前禁用树形控件
-        self.tree.setUpdatesEnabled(False)
+    def prepare_tree(self):
+        """清空树形控件和文件目录，设置列标题和列宽"""
         self.tree.clear()
+        self.library_generation += 1
         
         # 清理旧的缩略图加载线程
         for thread in self.thumbnail_threads:
@@ -1544,9 +5577,11 @@ class MainWindow(QMainWindow):
             "时长", "文件大小", "当前比特率",
             "目标比特率", "压缩后大小", "体积比例", "影响程度", "状态"
         ]
+        headers.extend(header for _, header, _ in TIMING_COLUMNS)
         
         self.tree.setColumnCount(len(headers))
         self.tree.setHeaderLabels(headers)
+        self.apply_timing_columns_visibility()
         
         # 设置图标大小
         icon_size = QSize(16, 16)  # 设置为16x16像素
@@ -1565,104 +5600,15 @@ class MainWindow(QMainWindow):
             0, QHeaderView.ResizeMode.Interactive
         )
         
-        # 加载压缩历史
-        compression_history = self.load_compression_history()
-        
-        def add_items_recursively(parent_path, parent_item=None):
-            items = sorted(os.listdir(parent_path))
-            for item_name in items:
-                item_path = os.path.join(parent_path, item_name)
-                
-                # 创建新项目
-                if parent_item is None:
-                    tree_item = QTreeWidgetItem(self.tree)
-                else:
-                    tree_item = QTreeWidgetItem(parent_item)
-                
-                # 设置项目文本和数据
-                tree_item.setText(0, item_name)
-                tree_item.setData(0, Qt.ItemDataRole.UserRole, item_path)
-                
-                # 启用复选框
-                tree_item.setFlags(tree_item.flags() | Qt.ItemFlag.ItemIsUserCheckable | Qt.ItemFlag.ItemIsEnabled)
-                tree_item.setCheckState(0, Qt.CheckState.Unchecked)
-                
-                if os.path.isdir(item_path):
-                    # 文件夹处理代码...
-                    folder_icon = self.style().standardIcon(QStyle.StandardPixmap.SP_DirIcon)
-                    tree_item.setIcon(0, folder_icon)
-                    add_items_recursively(item_path, tree_item)
-                else:
-                    # 只处理视频文件
-                    if os.path.splitext(item_name)[1].lower() in video_extensions:
-                        # 设置文件图标
-                        file_icon = self.style().standardIcon(QStyle.StandardPixmap.SP_FileIcon)
-                        tree_item.setIcon(0, file_icon)
-                        
-                        # 从历史记录中恢复信息
-                        if item_path in compression_history:
-                            history = compression_history[item_path]
-                            # 恢复所有表格字段，确保所有数值都有默认值且不为 None
-                            duration = history.get('duration', '')
-                            tree_item.setText(2, f"{duration} 秒" if duration else "")  # 时长
-                            
-                            # 显示原始文件大小
-                            original_size = history.get('original_size')
-                            if original_size:
-                                tree_item.setText(3, format_size(original_size))  # 原始大小
-                            
-                            # 安全地处理比特率
-                            original_bitrate = history.get('original_bitrate')
-                            if original_bitrate is not None:
-                                tree_item.setText(4, f"{float(original_bitrate):.2f}Mbps")  # 原始比特率
-                            else:
-                                tree_item.setText(4, "0.00Mbps")
-                            
-                            target_bitrate = history.get('target_bitrate')
-                            if target_bitrate is not None:
-                                tree_item.setText(5, f"{float(target_bitrate):.2f}Mbps")  # 目标比特率
-                            else:
-                                tree_item.setText(5, "0.00Mbps")
-                            
-                            # 安全地处理压缩后大小
-                            compressed_size = history.get('compressed_size')
-                            if compressed_size:
-                                tree_item.setText(6, format_size(compressed_size))
-                            
-                            # 安全地处理压缩比例
-                            compression_ratio = history.get('compression_ratio')
-                            if compression_ratio is not None:
-                                tree_item.setText(7, f"{float(compression_ratio)*100:.1f}%")
-                            
-                            tree_item.setText(8, history.get('impact_level', ''))  # 影响程度
-                            tree_item.setText(9, history.get('status', '等待压缩'))  # 状态
-                            
-                            # 如果压缩已完成，设置文本颜色为灰色
-                            if history.get('status') == '完成':
-                                for col in range(tree_item.columnCount()):
-                                    tree_item.setForeground(col, QColor(128, 128, 128))
-                        else:
-                            # 新文件，设置初始状态为空
-                            tree_item.setText(9, "")  # 修改这里，初始状态为空
-                        
-                        # 只在开关打开时加载缩略图
-                        if self.show_thumbnail_cb.isChecked():
-                            thread = ThumbnailLoader(item_path, tree_item)
-                            thread.thumbnail_ready.connect(self.set_thumbnail)
-                            self.thumbnail_threads.append(thread)
-                            thread.start()
-                    else:
-                        # 移除非视频文件的项目
-                        if parent_item:
-                            parent_item.removeChild(tree_item)
-                        else:
-                            index = self.tree.indexOfTopLevelItem(tree_item)
-                            self.tree.takeTopLevelItem(index)
-        
-        # 从源文件夹开始递归添加项目
-        if self.source_folder:
-            add_items_recursively(self.source_folder)
-        
+        # 重建文件目录
+        self.catalog.clear()
+        self.folder_items = []
+        self.folder_item_by_path = {}
+        self.dir_mtimes = {}
+        self.checked_catalog_ids = None
+
+    def finish_tree_update(self):
+        """树形控件内容生成后：连接信号、恢复展开/勾选状态，并保持当前的排序和筛选"""
         # 连接项目变化信号
         self.tree.itemChanged.connect(self.on_item_changed)
         
@@ -1677,8 +5623,497 @@ class MainWindow(QMainWindow):
         else:
             self.expand_button.setText("展开全部")
 
+        # 预估节省用的画面复杂度倍数
+        self.catalog.load_complexity_scales()
+        
         # 在文件列表更新完成后恢复状态
         self.restore_tree_state()
+        
+        # 保持当前的排序和筛选
+        if self.sort_column is not None:
+            self.apply_sort()
+        elif self.filter_edit.text().strip():
+            self.apply_filter()
+
+    @profiled()
+    def update_file_list(self):
+        # 在更新前禁用树形控件
+        self.tree.setUpdatesEnabled(False)
+        self.prepare_tree()
+        
+        # 加载压缩历史
+        compression_history = self.load_compression_history()
+        probe_cache = load_probe_cache()
+        
+        # 从源文件夹开始递归添加项目
+        if self.source_folder:
+            self.add_folder_items(self.source_folder, None, compression_history, probe_cache)
+        
+        self.finish_tree_update()
+
+    def add_folder_items(self, parent_path, parent_item, compression_history, probe_cache):
+        """递归添加文件夹中的子文件夹和视频文件，并记录文件夹的修改时间"""
+        try:
+            self.dir_mtimes[parent_path] = os.stat(parent_path).st_mtime
+            items = sorted(os.listdir(parent_path))
+        except OSError as e:
+            print(f"读取文件夹失败：{e}")
+            return
+        for item_name in items:
+            self.add_library_item(parent_path, item_name, parent_item, compression_history, probe_cache)
+
+    def add_library_item(self, parent_path, item_name, parent_item, compression_history, probe_cache, index=None):
+        """添加一个文件夹（递归添加其内容）或视频文件，其他文件忽略；index 为插入位置，默认添加到末尾"""
+        video_extensions = ['.mp4', '.avi', '.mov', '.mkv']
+        item_path = os.path.join(parent_path, item_name)
+        is_dir = os.path.isdir(item_path)
+        if not is_dir and os.path.splitext(item_name)[1].lower() not in video_extensions:
+            return None
+        
+        # 创建新项目
+        tree_item = QTreeWidgetItem()
+        parent = parent_item if parent_item is not None else self.tree.invisibleRootItem()
+        if index is None:
+            parent.addChild(tree_item)
+        else:
+            parent.insertChild(index, tree_item)
+        
+        # 设置项目文本和数据
+        tree_item.setText(0, item_name)
+        tree_item.setData(0, Qt.ItemDataRole.UserRole, item_path)
+        
+        # 启用复选框
+        tree_item.setFlags(tree_item.flags() | Qt.ItemFlag.ItemIsUserCheckable | Qt.ItemFlag.ItemIsEnabled)
+        tree_item.setCheckState(0, Qt.CheckState.Unchecked)
+        
+        if is_dir:
+            folder_icon = self.style().standardIcon(QStyle.StandardPixmap.SP_DirIcon)
+            tree_item.setIcon(0, folder_icon)
+            self.folder_items.append(tree_item)
+            self.folder_item_by_path[item_path] = tree_item
+            self.add_folder_items(item_path, tree_item, compression_history, probe_cache)
+            return tree_item
+        
+        # 设置文件图标
+        file_icon = self.style().standardIcon(QStyle.StandardPixmap.SP_FileIcon)
+        tree_item.setIcon(0, file_icon)
+        
+        # 从历史记录中恢复信息
+        if item_path in compression_history:
+            history = compression_history[item_path]
+            # 恢复所有表格字段，确保所有数值都有默认值且不为 None
+            duration = history.get('duration', '')
+            tree_item.setText(2, f"{duration} 秒" if duration else "")  # 时长
+            
+            # 显示原始文件大小
+            original_size = history.get('original_size')
+            if original_size:
+                tree_item.setText(3, format_size(original_size))  # 原始大小
+            
+            # 安全地处理比特率
+            original_bitrate = history.get('original_bitrate')
+            if original_bitrate is not None:
+                tree_item.setText(4, f"{float(original_bitrate):.2f}Mbps")  # 原始比特率
+            else:
+                tree_item.setText(4, "0.00Mbps")
+            
+            target_bitrate = history.get('target_bitrate')
+            if target_bitrate is not None:
+                tree_item.setText(5, format_target(float(target_bitrate), history.get('target_resolution')))  # 目标比特率
+            else:
+                tree_item.setText(5, "0.00Mbps")
+            
+            # 安全地处理压缩后大小
+            compressed_size = history.get('compressed_size')
+            if compressed_size:
+                tree_item.setText(6, format_size(compressed_size))
+            
+            # 安全地处理压缩比例
+            compression_ratio = history.get('compression_ratio')
+            predicted_ratio = history.get('predicted_ratio')
+            if compression_ratio is not None:
+                tree_item.setText(7, f"{float(compression_ratio)*100:.1f}%")
+            elif predicted_ratio is not None:
+                tree_item.setText(7, f"预测 {float(predicted_ratio)*100:.1f}%")
+            
+            tree_item.setText(8, history.get('impact_level', ''))  # 影响程度
+            tree_item.setText(9, history.get('status', '等待压缩'))  # 状态
+            self.set_timing_columns(tree_item, history)  # 各阶段耗时
+            
+            # 如果压缩已完成，设置文本颜色为灰色
+            if history.get('status') == '完成':
+                for col in range(tree_item.columnCount()):
+                    tree_item.setForeground(col, QColor(128, 128, 128))
+        else:
+            # 新文件，设置初始状态为空
+            tree_item.setText(9, "")  # 修改这里，初始状态为空
+        
+        self.add_to_catalog(item_path, tree_item, compression_history.get(item_path), probe_cache.get(item_path))
+        self.start_thumbnail_loader(item_path, tree_item)
+        return tree_item
+
+    def start_thumbnail_loader(self, file_path, item):
+        """只在开关打开时加载缩略图"""
+        if self.show_thumbnail_cb.isChecked():
+            thread = ThumbnailLoader(file_path, item)
+            thread.thumbnail_ready.connect(self.set_thumbnail)
+            self.thumbnail_threads.append(thread)
+            thread.start()
+
+    def load_library(self):
+        """启动时优先用上次保存的快照立即显示文件列表，再在后台检查有变化的文件夹；没有可用快照时完整扫描"""
+        snapshot = self.read_library_snapshot()
+        if not snapshot:
+            self.update_file_list()
+            return
+        
+        self.tree.setUpdatesEnabled(False)
+        self.prepare_tree()
+        for node in snapshot['tree']:
+            self.add_snapshot_item(self.source_folder, node, None)
+        self.dir_mtimes = dict(snapshot['dirs'])
+        self.finish_tree_update()
+        print(f"已从快照加载文件列表：{len(self.catalog)} 个视频")
+        
+        # 后台检查修改时间有变化的文件夹
+        self.library_revalidator = LibraryRevalidator(self.source_folder, self.dir_mtimes, self.library_generation)
+        self.library_revalidator.changed_signal.connect(self.apply_library_changes)
+        self.library_revalidator.start()
+
+    def read_library_snapshot(self):
+        try:
+            with gzip.open(LIBRARY_SNAPSHOT_FILE, 'rt', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, EOFError, json.JSONDecodeError):
+            return None
+        if snapshot.get('version') != LIBRARY_SNAPSHOT_VERSION or snapshot.get('root') != self.source_folder:
+            return None
+        return snapshot
+
+    def add_snapshot_item(self, parent_path, node, parent_item):
+        """按快照中的节点创建项目，文件直接使用保存的列文本和文件目录数值"""
+        item_path = os.path.join(parent_path, node['n'])
+        tree_item = QTreeWidgetItem(parent_item if parent_item is not None else self.tree)
+        tree_item.setText(0, node['n'])
+        tree_item.setData(0, Qt.ItemDataRole.UserRole, item_path)
+        tree_item.setFlags(tree_item.flags() | Qt.ItemFlag.ItemIsUserCheckable | Qt.ItemFlag.ItemIsEnabled)
+        tree_item.setCheckState(0, Qt.CheckState.Unchecked)
+        
+        if 'c' in node:
+            tree_item.setIcon(0, self.style().standardIcon(QStyle.StandardPixmap.SP_DirIcon))
+            self.folder_items.append(tree_item)
+            self.folder_item_by_path[item_path] = tree_item
+            for child in node['c']:
+                self.add_snapshot_item(item_path, child, tree_item)
+            return
+        
+        tree_item.setIcon(0, self.style().standardIcon(QStyle.StandardPixmap.SP_FileIcon))
+        for offset, text in enumerate(node['t']):
+            if text:
+                tree_item.setText(2 + offset, text)
+        if node.get('g'):
+            for col in range(tree_item.columnCount()):
+                tree_item.setForeground(col, QColor(128, 128, 128))
+        values = dict(zip(FileCatalog.NUMERIC_FIELDS, node['v']))
+        self.catalog.add(item_path, tree_item, status=node.get('s', ''), **values)
+        self.start_thumbnail_loader(item_path, tree_item)
+
+    def save_library_snapshot(self):
+        """保存当前文件列表（包括各列文本和文件目录数值）及各文件夹的修改时间，下次启动时直接显示"""
+        if not self.source_folder:
+            return
+        columns = self.tree.columnCount()
+        
+        def snapshot_node(item):
+            node = {'n': item.text(0)}
+            file_id = self.catalog.ids.get(item.data(0, Qt.ItemDataRole.UserRole))
+            if file_id is None:
+                node['c'] = [snapshot_node(item.child(i)) for i in range(item.childCount())]
+                return node
+            texts = [item.text(col) for col in range(2, columns)]
+            status = texts[7]
+            # 压缩过程中的临时状态不保存
+            if status.startswith("正在") or status.endswith("中") or status in ("等待压缩", "停止压缩"):
+                texts[7] = ""
+                status = ""
+            node['t'] = texts
+            node['s'] = status
+            node['v'] = [None if math.isnan(self.catalog.columns[field][file_id]) else self.catalog.columns[field][file_id]
+                         for field in FileCatalog.NUMERIC_FIELDS]
+            if item.foreground(0).color() == QColor(128, 128, 128):
+                node['g'] = 1
+            return node
+        
+        root = self.tree.invisibleRootItem()
+        snapshot = {
+            'version': LIBRARY_SNAPSHOT_VERSION,
+            'root': self.source_folder,
+            'dirs': self.dir_mtimes,
+            'tree': [snapshot_node(root.child(i)) for i in range(root.childCount())],
+        }
+        temp_path = LIBRARY_SNAPSHOT_FILE + '.tmp'
+        try:
+            with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(temp_path, LIBRARY_SNAPSHOT_FILE)
+        except Exception as e:
+            print(f"保存文件列表快照失败：{e}")
+
+    def apply_library_changes(self, generation, changes):
+        """把后台检查发现的文件夹变化合并到树中：删除已不存在的项目，按名称顺序插入新项目"""
+        if generation != self.library_generation:
+            # 检查期间文件列表已经重新生成
+            return
+        if not changes:
+            print("文件列表快照仍然有效")
+            return
+        
+        compression_history = self.load_compression_history()
+        probe_cache = load_probe_cache()
+        structure_changed = False
+        self.tree.blockSignals(True)
+        # 先处理上层文件夹，新增的子文件夹会被递归添加
+        for dir_path in sorted(changes, key=len):
+            mtime, names = changes[dir_path]
+            if dir_path == self.source_folder:
+                parent_item = None
+            else:
+                parent_item = self.folder_item_by_path.get(dir_path)
+                if parent_item is None:
+                    continue
+            parent = parent_item if parent_item is not None else self.tree.invisibleRootItem()
+            self.dir_mtimes[dir_path] = mtime
+            
+            existing = {parent.child(i).text(0): parent.child(i) for i in range(parent.childCount())}
+            for name, child in existing.items():
+                if name not in names:
+                    self.remove_library_item(parent, child)
+                    structure_changed = True
+            for name in names:
+                if name in existing:
+                    continue
+                current_names = [parent.child(i).text(0) for i in range(parent.childCount())]
+                index = bisect.bisect_left(current_names, name)
+                if self.add_library_item(dir_path, name, parent_item, compression_history, probe_cache, index) is not None:
+                    structure_changed = True
+        self.tree.blockSignals(False)
+        
+        if structure_changed:
+            print(f"已更新有变化的文件夹：{len(changes)} 个")
+            self.catalog.load_complexity_scales()
+            if self.sort_column is not None:
+                self.apply_sort()
+            elif self.filter_edit.text().strip():
+                self.apply_filter()
+            self.update_selection_count()
+        self.save_library_snapshot()
+
+    def remove_library_item(self, parent, item):
+        """从树和文件目录中删除一个项目及其所有子项目"""
+        stack = [item]
+        while stack:
+            current = stack.pop()
+            path = current.data(0, Qt.ItemDataRole.UserRole)
+            self.catalog.remove(path)
+            if path in self.folder_item_by_path:
+                del self.folder_item_by_path[path]
+                self.folder_items.remove(current)
+                self.dir_mtimes.pop(path, None)
+            stack.extend(current.child(i) for i in range(current.childCount()))
+        parent.removeChild(item)
+
+    def add_to_catalog(self, file_path, item, history, cached_probe):
+        """把扫描到的文件连同压缩历史和探测缓存加入文件目录"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            stat = None
+        values = {'size': stat.st_size if stat else 0}
+        history = history or {}
+        # 探测缓存只在文件没有变化时可用
+        if cached_probe and stat and cached_probe[0] == stat.st_size and cached_probe[1] == stat.st_mtime:
+            info = cached_probe[2]
+            values.update({
+                'width': info['width'],
+                'height': info['height'],
+                'fps': info['frame_rate'],
+                'duration': info['duration'],
+                'bitrate': info['bit_rate'] / 1024 / 1024 if info['bit_rate'] else 0,
+            })
+        try:
+            values.setdefault('duration', float(history.get('duration') or 0))
+        except (TypeError, ValueError):
+            pass
+        values.setdefault('bitrate', history.get('original_bitrate'))
+        values['ratio'] = history.get('compression_ratio')
+        self.catalog.add(file_path, item, status=history.get('status') or '', **values)
+
+    def apply_filter(self):
+        """按筛选栏的条件查询文件目录，隐藏不匹配的文件和没有匹配文件的文件夹"""
+        text = self.filter_edit.text().strip()
+        try:
+            ids = self.catalog.query(text) if text else None
+        except ValueError as e:
+            self.filter_result_label.setText(str(e))
+            return
+        self.filter_result_ids = ids
+        
+        self.tree.setUpdatesEnabled(False)
+        if ids is None:
+            for item in self.catalog.items:
+                if item is not None:
+                    item.setHidden(False)
+            for folder in self.folder_items:
+                folder.setHidden(False)
+            self.filter_result_label.setText("")
+        else:
+            matched = set(ids)
+            for file_id, item in enumerate(self.catalog.items):
+                if item is not None:
+                    item.setHidden(file_id not in matched)
+            # 只显示包含匹配文件的文件夹
+            visible_folders = set()
+            for file_id in ids:
+                parent = self.catalog.items[file_id].parent()
+                while parent is not None and id(parent) not in visible_folders:
+                    visible_folders.add(id(parent))
+                    parent = parent.parent()
+            for folder in self.folder_items:
+                folder.setHidden(id(folder) not in visible_folders)
+            self.filter_result_label.setText(f"{len(ids)} / {len(self.catalog)} 个文件")
+        self.tree.setUpdatesEnabled(True)
+
+    def sort_by_column(self, column):
+        """点击列标题：同一列再次点击时切换升序/降序"""
+        if column not in FileCatalog.SORT_COLUMNS:
+            return
+        if self.sort_column == column:
+            self.sort_descending = not self.sort_descending
+        else:
+            self.sort_column = column
+            self.sort_descending = False
+        self.tree.header().setSortIndicatorShown(True)
+        self.tree.header().setSortIndicator(
+            column, Qt.SortOrder.DescendingOrder if self.sort_descending else Qt.SortOrder.AscendingOrder
+        )
+        self.apply_sort()
+
+    def apply_sort(self):
+        """按文件目录的排序结果重新排列每个文件夹中的文件，文件夹排在文件前面"""
+        ranks = self.catalog.sort_ranks(FileCatalog.SORT_COLUMNS[self.sort_column], self.sort_descending)
+        ids = self.catalog.ids
+        expanded_folders = [folder for folder in self.folder_items if folder.isExpanded()]
+        # 缩略图是项目控件，项目移出树时会被销毁，先记下图片
+        thumbnails = []
+        for item in self.catalog.items:
+            if item is None:
+                continue
+            label = self.tree.itemWidget(item, 1)
+            if label is not None and label.pixmap() is not None:
+                thumbnails.append((item, label.pixmap()))
+        
+        self.tree.setUpdatesEnabled(False)
+        self.tree.blockSignals(True)
+        for parent in [self.tree.invisibleRootItem()] + self.folder_items:
+            children = parent.takeChildren()
+            if not children:
+                continue
+            folders = [child for child in children if child.data(0, Qt.ItemDataRole.UserRole) not in ids]
+            files = [child for child in children if child.data(0, Qt.ItemDataRole.UserRole) in ids]
+            files.sort(key=lambda child: ranks[ids[child.data(0, Qt.ItemDataRole.UserRole)]])
+            parent.addChildren(folders + files)
+        # 重新插入的项目会丢失展开状态、隐藏状态和缩略图
+        for folder in expanded_folders:
+            folder.setExpanded(True)
+        for item, pixmap in thumbnails:
+            self.set_thumbnail(item, pixmap)
+        self.tree.blockSignals(False)
+        self.tree.setUpdatesEnabled(True)
+        if self.filter_edit.text().strip():
+            self.apply_filter()
+
+    def check_filter_results(self):
+        """一次勾选筛选结果中的所有文件（没有筛选时勾选全部），最后统一更新文件夹的勾选状态"""
+        ids = self.filter_result_ids if self.filter_result_ids is not None else self.catalog.live_ids()
+        
+        self.tree.blockSignals(True)
+        parents = {}
+        for file_id in ids:
+            item = self.catalog.items[file_id]
+            item.setCheckState(0, Qt.CheckState.Checked)
+            parent = item.parent()
+            while parent is not None and id(parent) not in parents:
+                parents[id(parent)] = parent
+                parent = parent.parent()
+        
+        def depth(item):
+            level = 0
+            while item.parent() is not None:
+                item = item.parent()
+                level += 1
+            return level
+        
+        # 从最深的文件夹开始，按直接子项目的状态更新
+        for parent in sorted(parents.values(), key=depth, reverse=True):
+            states = {parent.child(i).checkState(0) for i in range(parent.childCount())}
+            if states == {Qt.CheckState.Checked}:
+                parent.setCheckState(0, Qt.CheckState.Checked)
+            elif states == {Qt.CheckState.Unchecked}:
+                parent.setCheckState(0, Qt.CheckState.Unchecked)
+            else:
+                parent.setCheckState(0, Qt.CheckState.PartiallyChecked)
+        self.tree.blockSignals(False)
+        self.tree.viewport().update()
+        self.update_selection_count()
+
+    def probe_catalog_unknown(self):
+        """在后台探测文件目录中还没有分辨率信息的文件"""
+        if self.catalog_probe_worker is not None and self.catalog_probe_worker.isRunning():
+            return
+        heights = self.catalog.columns['height']
+        paths = [self.catalog.paths[file_id] for file_id in self.catalog.live_ids() if math.isnan(heights[file_id])]
+        if not paths:
+            self.filter_result_label.setText("所有文件都已探测")
+            return
+        self.filter_result_label.setText(f"正在探测 {len(paths)} 个文件…")
+        self.catalog_probe_worker = QueueProbeWorker(paths)
+        self.catalog_probe_worker.probed_signal.connect(self.on_catalog_probed)
+        self.catalog_probe_worker.finished.connect(self.apply_filter)
+        self.catalog_probe_worker.start()
+
+    def on_catalog_probed(self, probes):
+        for file_path, info in probes.items():
+            self.catalog.update(
+                file_path,
+                width=info['width'], height=info['height'], fps=info['frame_rate'],
+                duration=info['duration'],
+                bitrate=info['bit_rate'] / 1024 / 1024 if info['bit_rate'] else 0
+            )
+        self.catalog.load_complexity_scales()
+        self.update_coef_projection(self.coef_spin.value())
+        if self.filter_edit.text().strip():
+            self.filter_timer.start()
+
+    def set_timing_columns(self, item, data):
+        """填充耗时列（探测、编码、SSIM、复制属性、替换的耗时及编码帧率/速度）"""
+        for offset, (key, _, text_format) in enumerate(TIMING_COLUMNS):
+            value = data.get(key)
+            if value:
+                try:
+                    item.setText(TIMING_COLUMN_START + offset, text_format.format(float(value)))
+                except (TypeError, ValueError):
+                    pass
+
+    def apply_timing_columns_visibility(self):
+        """按“显示耗时列”选项显示或隐藏耗时列"""
+        show = hasattr(self, 'show_timing_action') and self.show_timing_action.isChecked()
+        for offset in range(len(TIMING_COLUMNS)):
+            self.tree.setColumnHidden(TIMING_COLUMN_START + offset, not show)
+
+    def toggle_timing_columns(self, checked):
+        """切换耗时列显示"""
+        self.apply_timing_columns_visibility()
+        self.save_settings()
 
     def set_thumbnail(self, item, pixmap):
         """设置缩略图"""
@@ -1721,6 +6156,10 @@ class MainWindow(QMainWindow):
                 update_selected_items(item)
             iterator += 1
         
+        self.launch_compress_thread()
+
+    def launch_compress_thread(self, files=None):
+        """创建并启动压缩线程；files 为 None 时压缩树中选中的文件"""
         self.source_path_button.setEnabled(False)
         self.start_button.setEnabled(False)
         self.stop_button.setEnabled(True)
@@ -1730,13 +6169,117 @@ class MainWindow(QMainWindow):
             self.source_folder, 
             self.replace_source_cb.isChecked(),
             self.coef_spin.value(),
-            self.tree
+            self.tree,
+            files=files
         )
         self.compress_thread.setParent(self)
         self.compress_thread.progress_signal.connect(self.update_progress)
         self.compress_thread.finished_signal.connect(self.compression_finished)
+        self.compress_thread.throttle_signal.connect(self.adaptive_status_label.setText)
+        self.compress_thread.job_finished_signal.connect(self.on_job_finished)
+        self.start_eta_estimate(files if files is not None else self.compress_thread.collect_checked_files())
         self.compress_thread.start()
 
+    def start_eta_estimate(self, files):
+        """用压缩历史训练速度模型，并在后台探测队列中文件的时长"""
+        self.stop_eta_estimate()
+        self.eta_predictor = EtaPredictor()
+        self.eta_predictor.train(self.load_compression_history())
+        self.eta_probes = {}
+        self.eta_pending = {file_path for file_path, _ in files}
+        self.eta_progress = {}
+        if not self.eta_pending:
+            return
+        self.eta_label.setText("正在估算剩余时间…")
+        self.eta_worker = QueueProbeWorker(list(self.eta_pending))
+        self.eta_worker.probed_signal.connect(self.on_queue_probed)
+        self.eta_worker.start()
+
+    def stop_eta_estimate(self):
+        if self.eta_worker is not None:
+            self.eta_worker.stop()
+            self.eta_worker.wait()
+            self.eta_worker = None
+        self.eta_pending = set()
+        self.eta_label.setText("")
+
+    def on_queue_probed(self, probes):
+        self.eta_probes.update(probes)
+        self.refresh_eta()
+
+    def on_job_finished(self, file_path):
+        self.eta_pending.discard(file_path)
+        self.eta_progress.pop(file_path, None)
+        self.refresh_eta()
+
+    def refresh_eta(self):
+        """汇总队列中未完成文件的预计耗时，更新状态栏的剩余时间和预计完成时间"""
+        if not self.eta_pending or self.eta_predictor is None or not getattr(self, 'compress_thread', None):
+            self.eta_label.setText("")
+            return
+        
+        threads = self.compress_thread.cpu_cores
+        coef = self.coef_spin.value()
+        total = 0
+        probed_count = 0
+        for file_path in self.eta_pending:
+            info = self.eta_probes.get(file_path)
+            if not info:
+                continue
+            probed_count += 1
+            seconds = self.eta_predictor.estimate_seconds(
+                info, threads, coef, self.compress_thread.max_height, self.compress_thread.max_fps,
+                self.compress_thread.content_aware
+            )
+            total += seconds * (1 - self.eta_progress.get(file_path, 0))
+        if not probed_count:
+            return
+        
+        # 还没探测完时，按已探测文件的平均耗时外推
+        total = total * len(self.eta_pending) / probed_count
+        remaining = total / max(1, self.compress_thread.concurrency)
+        finish_time = datetime.datetime.now() + datetime.timedelta(seconds=remaining)
+        if finish_time.date() == datetime.date.today():
+            finish_text = finish_time.strftime('%H:%M')
+        else:
+            finish_text = finish_time.strftime('%m-%d %H:%M')
+        text = f"剩余 {len(self.eta_pending)} 个，约 {format_duration(remaining)}，预计 {finish_text} 完成"
+        if probed_count < len(self.eta_pending) and self.eta_worker is not None and self.eta_worker.isRunning():
+            text += f"（已探测 {probed_count}/{len(self.eta_pending)}）"
+        self.eta_label.setText(text)
+
+    def check_pending_jobs(self):
+        """启动时检查上次未完成的压缩任务，清理中断留下的半成品并询问是否继续"""
+        job_queue = JobQueue()
+        job_queue.recover_interrupted()
+        pending_jobs = job_queue.pending_jobs()
+        if not pending_jobs:
+            return
+        
+        reply = QMessageBox.question(
+            self, "继续压缩",
+            f"发现上次未完成的 {len(pending_jobs)} 个压缩任务，是否继续？\n选择“否”将放弃这些任务并删除未完成的输出文件。"
+        )
+        if reply != QMessageBox.StandardButton.Yes:
+            job_queue.discard_pending()
+            return
+        
+        self.compression_stats = {
+            'processed_count': 0,
+            'original_total_size': 0,
+            'compressed_total_size': 0,
+            'current_file': ''
+        }
+        # 在树中标记待处理的文件
+        pending_paths = {file_path for file_path, _ in pending_jobs}
+        iterator = QTreeWidgetItemIterator(self.tree)
+        while iterator.value():
+            item = iterator.value()
+            if item.data(0, Qt.ItemDataRole.UserRole) in pending_paths:
+                item.setText(9, "等待压缩")
+            iterator += 1
+        self.launch_compress_thread(files=pending_jobs)
+
     def stop_compression(self):
         if hasattr(self, 'compress_thread'):
             # 立即更新界面状态
@@ -1751,22 +6294,13 @@ class MainWindow(QMainWindow):
                 cell_text = item.text(9)
                 if cell_text == "正在压缩" or cell_text.startswith("正在压缩"):  # 匹配"正在压缩"和"正在压缩 XX%"
                     item.setText(9, "停止压缩")
-                    current_file = item.data(0, Qt.ItemDataRole.UserRole)  # 这里获取的是完整路径
-                    # 如果有临时文件，删除它
-                    if current_file:
-                        name, ext = os.path.splitext(current_file)
-                        temp_file = f"{name}_comp{ext}"
-                        try:
-                            if os.path.exists(temp_file):
-                                os.remove(temp_file)
-                                print(f"已删除未完成的临时文件：{temp_file}")
-                        except Exception as e:
-                            print(f"删除临时文件失败：{e}")
                 iterator += 1
             
-            # 停止压缩线程
+            # 停止压缩线程；正在编码的半成品由工作线程在 ffmpeg 退出后删除，并把任务放回队列，
+            # 下次启动时可继续。这里不能直接删除：ffmpeg 可能还打开着这些文件
             self.compress_thread.stop()
             self.compress_thread = None
+            self.stop_eta_estimate()
 
     def update_progress(self, data):
         """更新树形结构中的压缩进度"""
@@ -1823,7 +6357,7 @@ class MainWindow(QMainWindow):
             history_data["original_bitrate"] = data["original_bitrate"]
         
         if "target_bitrate" in data:
-            item.setText(5, f"{data['target_bitrate']:.2f} Mbps")
+            item.setText(5, format_target(data['target_bitrate'], data.get('target_resolution')))
             history_data["target_bitrate"] = data["target_bitrate"]
         
         # 处理压缩后的信息
@@ -1831,7 +6365,9 @@ class MainWindow(QMainWindow):
             # 如果为空，则标记为"-"；否则保留原有数据
             if item.text(6) == "":
                 item.setText(6, "-")
-            if item.text(7) == "":
+            if "predicted_ratio" in data:
+                item.setText(7, f"预测 {data['predicted_ratio']:.1%}")
+            elif item.text(7) == "":
                 item.setText(7, "-")
             history_data["skip_compression"] = True
         else:
@@ -1846,6 +6382,12 @@ class MainWindow(QMainWindow):
                     item.setText(7, ratio_text)
                     history_data["compression_ratio"] = ratio
         
+        # 预测比例、各阶段耗时等附加字段
+        for column in HISTORY_EXTRA_COLUMNS:
+            if column in data:
+                history_data[column] = data[column]
+        self.set_timing_columns(item, data)
+        
         # 更新影响程度
         if "impact_level" in data:
             item.setText(8, data["impact_level"])
@@ -1855,9 +6397,20 @@ class MainWindow(QMainWindow):
         item.setText(9, data["status"])
         history_data["status"] = data["status"]
         
+        self.catalog.update(
+            file_path, status=data["status"],
+            ratio=history_data.get("compression_ratio"),
+            bitrate=history_data.get("original_bitrate")
+        )
+        
         # 当压缩完成时保存历史记录
         if data["status"] in ["完成", "完成(属性复制失败)"]:
             self.save_compression_history(file_path, history_data)
+            # 用刚完成的文件修正速度模型
+            if self.eta_predictor is not None:
+                self.eta_predictor.add_sample(history_data)
+        elif "progress" in data and file_path in self.eta_pending:
+            self.eta_progress[file_path] = data["progress"]
         
         # 更新状态栏中的处理进度
         if data.get("status", "").startswith("正在压缩") or data.get("status") == "计算SSIM中":
@@ -1885,6 +6438,7 @@ class MainWindow(QMainWindow):
         self.source_path_button.setEnabled(True)
         self.start_button.setEnabled(True)
         self.stop_button.setEnabled(False)
+        self.stop_eta_estimate()
         
         # 显示最终统计信息
         if self.compression_stats['processed_count'] > 0:
@@ -1896,6 +6450,7 @@ class MainWindow(QMainWindow):
             self.processing_label.setText(final_message)
         else:
             self.processing_label.setText("")
+        self.save_library_snapshot()
         
         # 重置统计信息
         self.compression_stats = {
@@ -1914,9 +6469,25 @@ class MainWindow(QMainWindow):
         except Exception as e:
             print(f"关闭数据库连接失败：{e}")
             
+        # 停止正在进行的压缩，未完成的任务留在队列中，下次启动时继续
+        if getattr(self, 'compress_thread', None) is not None:
+            self.compress_thread.stop()
+            self.compress_thread.wait(10000)
+        self.stop_eta_estimate()
+        if self.catalog_probe_worker is not None:
+            self.catalog_probe_worker.stop()
+            self.catalog_probe_worker.wait()
+        if self.library_revalidator is not None:
+            self.library_revalidator.stop()
+            self.library_revalidator.wait()
+        self.stop_coordinator()
+        self.stop_metrics_server()
+            
         # 保存其他设置
+        self.save_library_snapshot()
         self.save_tree_state()
         self.save_settings()
+        self.settings.flush()
         event.accept()
 
     def cleanup_temp_files(self):
@@ -1950,44 +6521,199 @@ class MainWindow(QMainWindow):
         if hasattr(self, 'compress_thread') and self.compress_thread is not None:
             self.compress_thread.update_quantization_coef(new_value)
         
+        self.update_coef_projection(new_value)
+        
         # 保存新的设置
+        self.settings.set('quantization_coef', new_value)
+
+    def update_coef_projection(self, quantization_coef):
+        """用选中文件的分辨率、帧率和比特率预估该量化系数下跳过的文件数和节省的空间"""
+        if not hasattr(self, 'catalog') or not len(self.catalog):
+            return
+        # 选中的文件在勾选变化时重新收集
+        if self.checked_catalog_ids is None:
+            self.checked_catalog_ids = [
+                file_id for file_id, item in enumerate(self.catalog.items)
+                if item is not None and item.checkState(0) == Qt.CheckState.Checked
+            ]
+        if not self.checked_catalog_ids:
+            self.coef_projection_label.setText("")
+            return
+        
+        projection = self.catalog.project_savings(
+            self.checked_catalog_ids, quantization_coef, self.max_height_combo.currentData(),
+            self.max_fps_combo.currentData(), self.content_aware_cb.isChecked()
+        )
+        text = f"预估：{projection['files']} 个文件中跳过 {projection['skipped']} 个"
+        if projection['files']:
+            saved = projection['original_size'] - projection['projected_size']
+            text += (f"，{format_size(projection['original_size'])} -> {format_size(projection['projected_size'])}"
+                     f"，节省 {format_size(saved)}")
+        if projection['unknown']:
+            text += f"（{projection['unknown']} 个未探测）"
+        self.coef_projection_label.setText(text)
+
+    def on_target_quality_changed(self, *args):
+        """处理目标质量模式开关或目标SSIM变化"""
+        enabled = self.target_quality_cb.isChecked()
+        self.target_ssim_spin.setEnabled(enabled)
+        
+        if hasattr(self, 'compress_thread') and self.compress_thread is not None:
+            self.compress_thread.update_target_ssim(self.target_ssim_spin.value() if enabled else None)
+        
+        self.settings.update({
+            'target_quality': enabled,
+            'target_ssim': self.target_ssim_spin.value()
+        })
+
+    def on_predict_settings_changed(self, *args):
+        """处理体积预测开关或节省阈值变化"""
+        self.settings.update({
+            'predict_size': self.predict_size_cb.isChecked(),
+            'min_savings_percent': self.min_savings_percent_spin.value(),
+            'min_savings_mb': self.min_savings_mb_spin.value()
+        })
+
+    def on_early_abort_settings_changed(self, *args):
+        """处理编码中止开关或体积比例阈值变化"""
+        self.settings.update({
+            'early_abort': self.early_abort_cb.isChecked(),
+            'early_abort_percent': self.early_abort_spin.value()
+        })
+
+    def on_segment_settings_changed(self, *args):
+        """处理长视频分段并行开关、时长阈值或分段数变化"""
+        self.settings.update({
+            'segment_parallel': self.segment_parallel_cb.isChecked(),
+            'segment_min_minutes': self.segment_min_minutes_spin.value(),
+            'segment_count': self.segment_count_spin.value()
+        })
+
+    def select_scratch_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "选择本地暂存目录", self.scratch_dir or tempfile.gettempdir())
+        if folder:
+            self.scratch_dir = folder
+            self.scratch_path_label.setText(folder)
+            self.scratch_cb.setChecked(True)
+            self.on_scratch_settings_changed()
+
+    def on_scratch_settings_changed(self, *args):
+        """处理本地暂存开关或目录变化"""
+        self.settings.update({
+            'scratch_enabled': self.scratch_cb.isChecked(),
+            'scratch_dir': self.scratch_dir
+        })
+
+    def on_dedupe_settings_changed(self, *args):
+        """处理重复文件检测开关或放置方式变化"""
+        self.settings.update({
+            'dedupe': self.dedupe_cb.isChecked(),
+            'dedupe_hardlink': self.dedupe_hardlink_cb.isChecked()
+        })
+
+    def on_schedule_policy_changed(self, index):
+        """处理顺序变化，从下一次开始压缩时生效"""
+        self.settings.set('schedule_policy', self.schedule_combo.itemData(index))
+
+    def on_rendition_settings_changed(self, *args):
+        """附加输出的设置变化，从下一次开始压缩时生效"""
+        self.settings.update({
+            'proxy_enabled': self.proxy_cb.isChecked(),
+            'proxy_heights': self.proxy_heights_edit.text(),
+            'proxy_template': self.proxy_template_edit.text(),
+            'poster_enabled': self.poster_cb.isChecked(),
+            'poster_template': self.poster_template_edit.text()
+        })
+
+    def proxy_heights(self):
+        """代理文件的短边列表，忽略无效的值"""
+        heights = []
+        for item in self.proxy_heights_edit.text().replace('，', ',').split(','):
+            item = item.strip().lower().rstrip('p')
+            if item.isdigit() and int(item) >= 2:
+                heights.append(int(item) - int(item) % 2)
+        return heights
+
+    def on_coordinator_settings_changed(self, *args):
+        """开关远程节点或修改地址、端口、令牌：停止旧的监听，按新设置重新监听"""
+        if self.coordinator_cb.isChecked() and not self.coordinator_token_edit.text().strip():
+            self.coordinator_token_edit.setText(secrets.token_urlsafe(16))
+        host = self.coordinator_host_edit.text().strip()
+        token = self.coordinator_token_edit.text().strip()
+        self.settings.update({
+            'coordinator_enabled': self.coordinator_cb.isChecked(),
+            'coordinator_port': self.coordinator_port_spin.value(),
+            'coordinator_host': host,
+            'coordinator_token': token
+        })
+        self.stop_coordinator()
+        if not self.coordinator_cb.isChecked():
+            return
+        coordinator = JobCoordinator(token, self.coordinator_port_spin.value(), host)
         try:
-            settings = {}
-            if os.path.exists(self.settings_file):
-                with open(self.settings_file, 'r', encoding='utf-8') as f:
-                    settings = json.load(f)
-            
-            settings['quantization_coef'] = new_value
-            
-            with open(self.settings_file, 'w', encoding='utf-8') as f:
-                json.dump(settings, f, ensure_ascii=False, indent=4)
-        except Exception as e:
-            print(f"保存设置失败：{e}")
+            coordinator.start()
+        except OSError as e:
+            print(f"监听远程节点失败：{e}")
+            self.coordinator_status_label.setText(f"监听失败：{e}")
+            return
+        self.coordinator = coordinator
+        self.coordinator_timer.start(2000)
+        self.update_coordinator_status()
+
+    def stop_coordinator(self):
+        self.coordinator_timer.stop()
+        if self.coordinator is not None:
+            self.coordinator.stop()
+            self.coordinator = None
+        self.coordinator_status_label.setText("")
+
+    def update_coordinator_status(self):
+        if self.coordinator is not None:
+            self.coordinator_status_label.setText(f"已连接 {self.coordinator.worker_count()} 个节点")
+
+    def on_metrics_settings_changed(self, *args):
+        """开关指标端点或修改端口"""
+        self.settings.update({
+            'metrics_enabled': self.metrics_cb.isChecked(),
+            'metrics_port': self.metrics_port_spin.value()
+        })
+        self.stop_metrics_server()
+        if not self.metrics_cb.isChecked():
+            return
+        try:
+            server = MetricsServer(self.metrics_port_spin.value())
+        except OSError as e:
+            print(f"启动指标端点失败：{e}")
+            return
+        server.start()
+        self.metrics_server = server
+
+    def stop_metrics_server(self):
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
 
     def on_replace_source_changed(self, state):
         """处理替换源文件选项变化"""
-        try:
-            settings = {}
-            if os.path.exists(self.settings_file):
-                with open(self.settings_file, 'r', encoding='utf-8') as f:
-                    settings = json.load(f)
-            
-            settings['replace_source'] = bool(state)
-            
-            with open(self.settings_file, 'w', encoding='utf-8') as f:
-                json.dump(settings, f, ensure_ascii=False)
-        except Exception as e:
-            print(f"保存替换源文件设置失败：{e}")
+        self.settings.set('replace_source', bool(state))
 
     def moveEvent(self, event):
         """窗口移动时保存位置"""
         super().moveEvent(event)
-        self.save_settings()
+        if hasattr(self, 'settings'):
+            self.settings.set('window', self.window_geometry_settings())
 
     def resizeEvent(self, event):
         """窗口大小改变时保存尺寸"""
         super().resizeEvent(event)
-        self.save_settings()
+        if hasattr(self, 'settings'):
+            self.settings.set('window', self.window_geometry_settings())
+
+    def window_geometry_settings(self):
+        return {
+            'size': {'width': self.width(), 'height': self.height()},
+            'pos': {'x': self.x(), 'y': self.y()}
+        }
 
     def handle_item_double_click(self, item, column):
         """处理树形项目双击事件"""
@@ -2037,6 +6763,7 @@ class MainWindow(QMainWindow):
             self.tree.expandAll()
             self.expand_button.setText("折叠全部")
 
+    @profiled()
     def toggle_thumbnails(self, state):
         """切换缩略图显示状态"""
         show_thumbnails = state == Qt.CheckState.Checked.value
@@ -2111,6 +6838,7 @@ class MainWindow(QMainWindow):
 
         return item
 
+    @profiled()
     def on_item_changed(self, item, column):
         """处理项目选中状态变化"""
         # 阻止信号以避免递归
@@ -2382,6 +7110,9 @@ class MainWindow(QMainWindow):
             iterator += 1
         
         self.selection_info_label.setText(f"已选择: {checked_count} 个视频")
+        # 勾选变化后，量化系数预估重新收集选中的文件并刷新
+        self.checked_catalog_ids = None
+        self.update_coef_projection(self.coef_spin.value())
 
     def init_database(self):
         """初始化SQLite数据库"""
@@ -2403,28 +7134,49 @@ class MainWindow(QMainWindow):
                     compression_time TEXT
                 )
             ''')
+            ensure_history_columns(cursor)
             self.conn.commit()
         except Exception as e:
             print(f"初始化数据库失败：{e}")
 
     def on_cpu_changed(self, new_value):
         """处理 CPU 核心数变化"""
-        try:
-            settings = {}
-            if os.path.exists(self.settings_file):
-                with open(self.settings_file, 'r', encoding='utf-8') as f:
-                    settings = json.load(f)
-            
-            settings['cpu_cores'] = new_value
-            
-            with open(self.settings_file, 'w', encoding='utf-8') as f:
-                json.dump(settings, f, ensure_ascii=False, indent=4)
-            
-            # 如果压缩线程正在运行，更新其 CPU 核心数设置
-            if hasattr(self, 'compress_thread') and self.compress_thread is not None:
-                self.compress_thread.update_cpu_cores(new_value)
-        except Exception as e:
-            print(f"保存 CPU 核心数设置失败：{e}")
+        self.settings.set('cpu_cores', new_value)
+        
+        # 如果压缩线程正在运行，更新其 CPU 核心数设置
+        if hasattr(self, 'compress_thread') and self.compress_thread is not None:
+            self.compress_thread.update_cpu_cores(new_value)
+
+    def on_adaptive_cpu_changed(self, state):
+        """处理自适应开关变化：开启后固定核心数设置和校准结果不再生效"""
+        adaptive = self.adaptive_cpu_cb.isChecked()
+        self.cpu_spin.setEnabled(not adaptive and not self.calibration_cb.isChecked())
+        self.calibration_cb.setEnabled(not adaptive and calibrated_config(self.settings.get('calibration'), 0) is not None)
+        if not adaptive:
+            self.adaptive_status_label.setText("")
+        self.settings.set('adaptive_cpu', adaptive)
+
+    def update_calibration_option(self, checked):
+        """本机有校准结果时才能勾选“按校准结果”，提示中列出各档位的组合"""
+        config = calibrated_config(self.settings.get('calibration'), 0)
+        if config is None:
+            self.calibration_cb.setToolTip("")
+            self.calibration_cb.setChecked(False)
+            self.calibration_cb.setEnabled(False)
+            return
+        classes = self.settings.get('calibration')['classes']
+        self.calibration_cb.setToolTip("运行 python VideoCompressTool.py calibrate 测得的组合：\n" + '\n'.join(
+            f"{key}p：{value['jobs']} 个文件 × {value['threads']} 线程（{value['fps']} 帧/秒）"
+            for key, value in sorted(classes.items(), key=lambda item: int(item[0]))
+        ))
+        self.calibration_cb.setChecked(checked)
+        self.calibration_cb.setEnabled(not self.adaptive_cpu_cb.isChecked())
+
+    def on_calibration_changed(self, state):
+        """勾选后按校准结果选择并发数和线程数，固定核心数设置不再生效"""
+        calibrated = self.calibration_cb.isChecked()
+        self.cpu_spin.setEnabled(not calibrated and not self.adaptive_cpu_cb.isChecked())
+        self.settings.set('use_calibration', calibrated)
 
     def create_menus(self):
         """创建菜单栏"""
@@ -2476,6 +7228,30 @@ class MainWindow(QMainWindow):
         invert_selection_action = QAction('反选', self)
         invert_selection_action.triggered.connect(self.invert_selection)
         select_menu.addAction(invert_selection_action)
+        
+        # 视图菜单
+        view_menu = menubar.addMenu('视图')
+        
+        # 显示各阶段耗时列
+        self.show_timing_action = QAction('显示耗时列', self)
+        self.show_timing_action.setCheckable(True)
+        self.show_timing_action.setChecked(self.show_timing_columns)
+        self.show_timing_action.toggled.connect(self.toggle_timing_columns)
+        view_menu.addAction(self.show_timing_action)
+        self.apply_timing_columns_visibility()
+        
+        # 性能分析开关：不放进菜单，只能用快捷键切换
+        self.profile_action = QAction('性能分析', self)
+        self.profile_action.setShortcut('Ctrl+Shift+P')
+        self.profile_action.setCheckable(True)
+        self.profile_action.setChecked(PROFILER.enabled)
+        self.profile_action.toggled.connect(self.toggle_profiling)
+        self.addAction(self.profile_action)
+
+    def toggle_profiling(self, checked):
+        PROFILER.output_dir = os.path.join(os.path.dirname(os.path.abspath(self.settings_file)), 'profiles')
+        PROFILER.set_enabled(checked)
+        self.statusBar.showMessage(f"性能分析已{'开启' if checked else '关闭'}：{PROFILER.output_dir}", 5000)
 
     def open_data_path(self):
         """打开数据文件所在路径"""
@@ -2551,7 +7327,33 @@ def format_size(size_in_bytes):
         size /= 1024.0
     return f"{size:.2f} PB"
 
+def format_duration(seconds):
+    """格式化剩余时间显示"""
+    minutes = int(seconds // 60)
+    if minutes < 1:
+        return "不到1分钟"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 1:
+        return f"{minutes}分钟"
+    days, hours = divmod(hours, 24)
+    if days < 1:
+        return f"{hours}小时{minutes}分钟"
+    return f"{days}天{hours}小时"
+
+def format_target(target_bitrate, target_resolution=None):
+    """目标比特率列的显示，受分辨率、帧率上限限制时附上输出规格"""
+    text = f"{target_bitrate:.2f} Mbps"
+    return f"{text} {target_resolution}" if target_resolution else text
+
 if __name__ == "__main__":
+    # SSIM 进程池在打包后的程序中也能启动子进程
+    multiprocessing.freeze_support()
+    if len(sys.argv) > 1 and sys.argv[1] == 'worker':
+        # 远程节点，不启动界面
+        sys.exit(run_worker(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'calibrate':
+        # 校准并发数和线程数，不启动界面
+        sys.exit(run_calibration(sys.argv[2:]))
     app = QApplication([])
     window = MainWindow()
     window.show()
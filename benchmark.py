@@ -0,0 +1,293 @@
+"""
+压缩流程基准测试
+
+用 ffmpeg 的 lavfi 源（testsrc2 / mandelbrot + sine 音频）在本地生成可复现的测试视频，
+分别计时每个阶段（估算比特率、编码、SSIM、复制元数据、替换源文件）以及完整的
+VideoCompressThread 流程，输出 JSON 报告，便于在不同提交之间对比。
+不需要网络和 GPU，可在只有 CPU 的 Linux 上离线运行。
+
+用法：
+    python benchmark.py                       # 生成语料并运行全部测试
+    python benchmark.py --quick               # 只跑小分辨率的样本
+    python benchmark.py --output report.json  # 指定报告路径
+    python benchmark.py --compare old.json new.json  # 对比两份报告
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# 没有显示器时也能创建 Qt 窗口
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+import VideoCompressTool as vct  # noqa: E402
+from PyQt6.QtWidgets import QApplication  # noqa: E402
+
+
+# 语料规格：(名称, lavfi 视频源, 宽, 高, 帧率, 时长秒, 容器)
+CORPUS_SPECS = [
+    ('testsrc2_360p_mp4', 'testsrc2', 640, 360, 30, 10, 'mp4'),
+    ('mandelbrot_360p_mkv', 'mandelbrot', 640, 360, 25, 8, 'mkv'),
+    ('testsrc2_720p_mkv', 'testsrc2', 1280, 720, 30, 10, 'mkv'),
+    ('mandelbrot_720p_mov', 'mandelbrot', 1280, 720, 30, 6, 'mov'),
+    ('testsrc2_1080p_mp4', 'testsrc2', 1920, 1080, 30, 15, 'mp4'),
+    ('mandelbrot_1080p_mov', 'mandelbrot', 1920, 1080, 60, 5, 'mov'),
+    ('testsrc2_2160p_mp4', 'testsrc2', 3840, 2160, 30, 4, 'mp4'),
+]
+
+# --quick 时只保留 720p 及以下
+QUICK_MAX_HEIGHT = 720
+
+
+def generate_corpus(corpus_dir, specs):
+    """生成测试视频，已存在的文件直接复用；返回 [(规格, 路径), ...]"""
+    os.makedirs(corpus_dir, exist_ok=True)
+    corpus = []
+    for spec in specs:
+        name, source, width, height, fps, duration, container = spec
+        path = os.path.join(corpus_dir, f"{name}.{container}")
+        if not os.path.exists(path):
+            print(f"正在生成测试视频：{path}")
+            command = [
+                'ffmpeg', '-v', 'error', '-y',
+                '-f', 'lavfi', '-i', f"{source}=size={width}x{height}:rate={fps}",
+                '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+                '-t', str(duration),
+                # 高码率、单线程、bitexact，保证每台机器生成的文件相同且有压缩空间
+                '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '8', '-threads', '1',
+                '-pix_fmt', 'yuv420p',
+                '-c:a', 'aac', '-b:a', '192k',
+                '-fflags', '+bitexact', '-flags:v', '+bitexact', '-flags:a', '+bitexact',
+                '-map_metadata', '-1',
+                '-metadata', 'comment=VideoCompressTool benchmark',
+                path
+            ]
+            result = subprocess.run(command, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"生成测试视频失败：{result.stderr}")
+        corpus.append((spec, path))
+    return corpus
+
+
+def timed(func, *args, **kwargs):
+    """运行函数，返回 (耗时秒, 返回值)"""
+    start = time.perf_counter()
+    value = func(*args, **kwargs)
+    return time.perf_counter() - start, value
+
+
+def bench_stages(thread, spec, source_path, work_dir, coef, threads):
+    """对单个文件分别计时各个阶段"""
+    name, _, width, height, fps, duration, container = spec
+    input_path = os.path.join(work_dir, os.path.basename(source_path))
+    shutil.copy2(source_path, input_path)
+    output_path = os.path.join(work_dir, f"{name}_comp.{container}")
+    stages = {}
+
+    stages['probe'], (bitrate, probed_duration, current_bitrate, _) = timed(
+        vct.estimate_appropriate_bitrate, input_path, coef
+    )
+
+    command = vct.build_encode_command(input_path, output_path, bitrate, threads)
+    stages['encode'], result = timed(subprocess.run, command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"编码失败：{result.stderr}")
+
+    stages['ssim'], ssim = timed(thread.calculate_ssim, input_path, output_path)
+    stages['metadata'], metadata_ok = timed(thread.copy_video_metadata, input_path, output_path)
+
+    def replace():
+        # 与 process_file 中替换源文件的步骤一致
+        backup_path = input_path + '.bak'
+        os.rename(input_path, backup_path)
+        os.rename(output_path, input_path)
+        os.remove(backup_path)
+
+    output_size = os.path.getsize(output_path)
+    stages['replace'], _ = timed(replace)
+
+    return {
+        'name': name,
+        'resolution': f"{width}x{height}",
+        'fps': fps,
+        'duration': duration,
+        'container': container,
+        'source_size': os.path.getsize(source_path),
+        'output_size': output_size,
+        'target_bitrate': bitrate,
+        'ssim': ssim,
+        'metadata_ok': metadata_ok,
+        'encode_fps': fps * duration / stages['encode'] if stages['encode'] > 0 else None,
+        'stages': stages,
+    }
+
+
+def bench_flow(app, window, corpus, work_dir):
+    """计时完整的 VideoCompressThread 流程：选中所有文件，开始压缩直到结束"""
+    flow_dir = os.path.join(work_dir, 'flow')
+    os.makedirs(flow_dir)
+    for _, source_path in corpus:
+        shutil.copy2(source_path, flow_dir)
+
+    window.source_folder = flow_dir
+    window.update_file_list()
+    window.select_all()
+
+    start = time.perf_counter()
+    window.start_compression()
+    thread = window.compress_thread
+    # 处理进度信号的同时等待线程结束
+    while not thread.isFinished():
+        app.processEvents()
+        time.sleep(0.05)
+    app.processEvents()
+    elapsed = time.perf_counter() - start
+    return {'files': len(corpus), 'seconds': elapsed}
+
+
+def median_stages(runs):
+    """多次运行时取各阶段耗时的中位数"""
+    result = dict(runs[0])
+    result['stages'] = {
+        stage: statistics.median(run['stages'][stage] for run in runs)
+        for stage in runs[0]['stages']
+    }
+    result['encode_fps'] = statistics.median(run['encode_fps'] or 0 for run in runs)
+    return result
+
+
+def environment_info():
+    """记录运行环境，方便判断两份报告是否可比"""
+    try:
+        ffmpeg_version = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True).stdout.split('\n')[0]
+    except OSError:
+        ffmpeg_version = None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=SCRIPT_DIR).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'time': datetime.datetime.now().isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'ffmpeg': ffmpeg_version,
+    }
+
+
+def run_benchmark(args):
+    specs = [spec for spec in CORPUS_SPECS if not args.quick or spec[3] <= QUICK_MAX_HEIGHT]
+    corpus = generate_corpus(os.path.abspath(args.corpus), specs)
+
+    app = QApplication.instance() or QApplication([])
+    work_root = tempfile.mkdtemp(prefix='vct_bench_')
+    original_cwd = os.getcwd()
+    # 在独立目录中运行，settings.json 和 compression_history.db 不会污染正常使用的数据
+    os.chdir(work_root)
+    try:
+        window = vct.MainWindow()
+        window.cpu_spin.setValue(args.threads)
+        thread = vct.VideoCompressThread(work_root, work_root, False, args.coef, window.tree)
+
+        files = []
+        for spec, source_path in corpus:
+            runs = []
+            for repeat in range(args.repeat):
+                work_dir = os.path.join(work_root, f"stages_{spec[0]}_{repeat}")
+                os.makedirs(work_dir)
+                runs.append(bench_stages(thread, spec, source_path, work_dir, args.coef, args.threads))
+                shutil.rmtree(work_dir, ignore_errors=True)
+            file_result = median_stages(runs)
+            files.append(file_result)
+            print(f"{file_result['name']}: " + ', '.join(
+                f"{stage} {seconds:.3f}s" for stage, seconds in file_result['stages'].items()
+            ))
+
+        flow = None
+        if not args.skip_flow:
+            flow = bench_flow(app, window, corpus, work_root)
+            print(f"完整流程：{flow['files']} 个文件，{flow['seconds']:.2f}s")
+        window.close()
+    finally:
+        os.chdir(original_cwd)
+        shutil.rmtree(work_root, ignore_errors=True)
+
+    totals = {}
+    for file_result in files:
+        for stage, seconds in file_result['stages'].items():
+            totals[stage] = totals.get(stage, 0) + seconds
+
+    report = {
+        'environment': environment_info(),
+        'settings': {'coef': args.coef, 'threads': args.threads, 'repeat': args.repeat, 'quick': args.quick},
+        'files': files,
+        'totals': totals,
+        'flow': flow,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    print(f"报告已保存：{args.output}")
+    return report
+
+
+def compare_reports(old_path, new_path):
+    """逐阶段对比两份报告的耗时"""
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+
+    print(f"旧：{old['environment'].get('commit')}  新：{new['environment'].get('commit')}")
+    old_files = {item['name']: item for item in old['files']}
+    for item in new['files']:
+        previous = old_files.get(item['name'])
+        if not previous:
+            continue
+        changes = []
+        for stage, seconds in item['stages'].items():
+            before = previous['stages'].get(stage)
+            if before:
+                changes.append(f"{stage} {(seconds - before) / before:+.1%}")
+        print(f"{item['name']}: " + ', '.join(changes))
+
+    for stage, seconds in new['totals'].items():
+        before = old['totals'].get(stage)
+        if before:
+            print(f"合计 {stage}: {before:.3f}s -> {seconds:.3f}s ({(seconds - before) / before:+.1%})")
+    if old.get('flow') and new.get('flow'):
+        before, after = old['flow']['seconds'], new['flow']['seconds']
+        print(f"完整流程：{before:.2f}s -> {after:.2f}s ({(after - before) / before:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="视频压缩流程基准测试")
+    parser.add_argument('--corpus', default=os.path.join(SCRIPT_DIR, 'bench_corpus'), help="测试视频缓存目录")
+    parser.add_argument('--output', default='benchmark_report.json', help="JSON 报告路径")
+    parser.add_argument('--quick', action='store_true', help="只测试 720p 及以下的样本")
+    parser.add_argument('--repeat', type=int, default=1, help="每个样本重复次数，取中位数")
+    parser.add_argument('--coef', type=float, default=0.12, help="量化系数")
+    parser.add_argument('--threads', type=int, default=max(1, (os.cpu_count() or 2) // 2), help="编码线程数")
+    parser.add_argument('--skip-flow', action='store_true', help="不测试完整的压缩流程")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="对比两份报告")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_reports(*args.compare)
+    else:
+        run_benchmark(args)
+
+
+if __name__ == '__main__':
+    main()